@@ -1,39 +1,148 @@
 import asyncio
-import threading
+import hashlib
 import logging
+import ssl
+import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, Depends, HTTPException
-from sqlalchemy.orm import Session
+from anyio import to_thread
+from fastapi import FastAPI, Request, Response, Depends, HTTPException
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+import orjson
+from sqlalchemy import select, text
+from sqlalchemy.orm import configure_mappers, raiseload
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.session import engine, Base, get_db
-from database.models import Tenant, WhatsAppAccount, Message
+from core.config import settings
+from database.session import async_engine, AsyncSessionLocal, get_async_db
+from database.init_db import init_db, seed_default_tenant
+from database.models import Tenant
 from routes import clients, webhook, messages, templates, scheduled_messages
 from middleware.auth import HMACAuth
 from routes.admin import router as admin_router
-from services.message_queue import rabbitmq_service
+from services.message_queue import rabbitmq_service, publish_buffer
 from services.message_consumer import start_message_consumers
 from services.scheduler import message_scheduler
+from services.cache import cache_service
+from services.api_log_writer import api_log_writer
+from middleware.rate_limiter import rate_limit_flusher
+from services.view_refresher import view_refresher
+from services.outbox import outbox_dispatcher
+from services.whatsapp_service import whatsapp_service
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Health probes hit /health every few seconds; memoize the table counts briefly
+COUNTS_TTL_SECONDS = 5
+_counts_cache = {"ts": 0.0, "counts": None}
+
+# All counts in one round-trip. messages grows without bound, so it uses the
+# planner's row estimate instead of COUNT(*)
+_COUNTS_SQL = text("""
+    SELECT
+        (SELECT count(*) FROM tenants) AS tenants,
+        (SELECT count(*) FROM tenants WHERE is_active) AS active_tenants,
+        (SELECT count(*) FROM whatsapp_accounts) AS whatsapp_accounts,
+        COALESCE((SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = 'messages'), 0) AS messages
+""")
+
+async def _cached_counts(db: AsyncSession, ttl: int = COUNTS_TTL_SECONDS) -> dict:
+    """Table counts shared by /health and /test-db, refreshed at most every `ttl` seconds"""
+    now = time.monotonic()
+    if _counts_cache["counts"] is not None and now - _counts_cache["ts"] < ttl:
+        return _counts_cache["counts"]
+    
+    row = (await db.execute(_COUNTS_SQL)).one()
+    counts = dict(row._mapping)
+    _counts_cache["ts"] = now
+    _counts_cache["counts"] = counts
+    return counts
+
+# Probes poll / and /health constantly; let them revalidate with If-None-Match
+PROBE_CACHE_CONTROL = "public, max-age=5"
+
+def _cacheable_response(request: Request, body: dict) -> Response:
+    """JSON response with a weak ETag; answers 304 when the client already has it"""
+    content = orjson.dumps(body)
+    etag = f'W/"{hashlib.blake2b(content, digest_size=8).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": PROBE_CACHE_CONTROL}
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content, media_type="application/json", headers=headers)
+
+# Swagger, debug and scheduled-message requests get a demo tenant injected.
+# Docs pages are hit by exact path (one set lookup); the rest by prefix, and
+# str.startswith takes the whole tuple in one C call
+DEMO_TENANT_EXACT = frozenset({"/docs", "/redoc", "/openapi.json"})
+DEMO_TENANT_PREFIXES = ("/docs/", "/__debug", "/api/v1/scheduled/")
+DEMO_TENANT_TTL_SECONDS = 60
+_demo_tenant_cache = {"tenant": None, "expires": 0.0}
+
+async def _get_demo_tenant():
+    """First tenant in the database, re-read at most once per DEMO_TENANT_TTL_SECONDS"""
+    now = time.monotonic()
+    if now < _demo_tenant_cache["expires"]:
+        return _demo_tenant_cache["tenant"]
+    
+    async with AsyncSessionLocal() as db:
+        # Runs in middleware - accidental lazy loads of tenant collections should fail loudly
+        tenant = await db.scalar(select(Tenant).options(raiseload("*")).limit(1))
+    
+    _demo_tenant_cache["tenant"] = tenant
+    _demo_tenant_cache["expires"] = now + DEMO_TENANT_TTL_SECONDS
+    return tenant
+
 # ✅ FIXED LIFESPAN FUNCTION (ONLY ONE)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("🚀 Starting Multi-tenant WhatsApp SaaS Gateway...")
+    # HMAC-SHA256 runs in this OpenSSL (SHA-NI accelerated on CPUs that have it)
+    logger.info(f"🔐 Crypto backend: {ssl.OPENSSL_VERSION}")
     
-    # Create database tables
-    try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("✅ Database tables created successfully!")
-    except Exception as e:
-        logger.error(f"❌ Database error: {e}")
-        raise
+    # Resolve all ORM relationships now instead of on the first request
+    configure_mappers()
+    
+    # Sync routes and run_in_threadpool sections each hold a pooled DB connection;
+    # let the threadpool grow to what the connection pool can actually serve
+    to_thread.current_default_thread_limiter().total_tokens = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    
+    # Create database tables - development only, deployments run
+    # `python -m database.init_db` / `alembic upgrade head` once instead of per worker
+    if settings.ENVIRONMENT == "development":
+        try:
+            init_db()
+            seed_default_tenant()
+            logger.info("✅ Database tables created successfully!")
+        except Exception as e:
+            logger.error(f"❌ Database error: {e}")
+            raise
+    else:
+        logger.info("ℹ️ Skipping create_all outside development")
+    
+    # Batch API log inserts off the request path
+    api_log_writer.start()
+    
+    # Persist per-minute rate-limit counters from Redis
+    rate_limit_flusher.start()
+    
+    # Keep the analytics materialized views fresh
+    view_refresher.start()
+    
+    # Connect the publisher (aio-pika, publisher confirms)
+    await rabbitmq_service.connect()
     
-    # Start message consumers in background thread
+    # Coalesce request-path publishes into confirm batches
+    publish_buffer.start()
+    
+    # Publish committed outbox rows (message sends) to RabbitMQ
+    outbox_dispatcher.start()
+    
+    # Start message consumers as a task on this event loop (aio-pika)
+    consumer_task = None
     if rabbitmq_service.is_connected:
-        consumer_thread = threading.Thread(target=start_message_consumers, daemon=True)
-        consumer_thread.start()
+        consumer_task = asyncio.create_task(start_message_consumers())
         logger.info("✅ RabbitMQ consumers started in background")
     else:
         logger.warning("⚠️ RabbitMQ not connected, running in direct mode")
@@ -55,20 +164,37 @@ async def lifespan(app: FastAPI):
     if scheduler_task:
         logger.info("🛑 Stopping message scheduler...")
         await message_scheduler.stop()
-        scheduler_task.cancel()
         try:
-            await scheduler_task
+            # stop() wakes the loop - let an in-flight tick commit rather than cancel it mid-write
+            await asyncio.wait_for(scheduler_task, timeout=10)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+    
+    # ✅ STOP CONSUMERS
+    if consumer_task:
+        consumer_task.cancel()
+        try:
+            await consumer_task
         except asyncio.CancelledError:
             pass
     
-    rabbitmq_service.close()
+    await outbox_dispatcher.stop()
+    await publish_buffer.stop()
+    await rabbitmq_service.close()
+    await whatsapp_service.close()
+    await cache_service.close()
+    await api_log_writer.stop()
+    await rate_limit_flusher.stop()
+    await view_refresher.stop()
+    await async_engine.dispose()
     logger.info("🛑 Shutdown completed - SaaS WhatsApp Gateway stopped")
 
 app = FastAPI(
     title="WhatsApp SaaS Gateway API",
     description="Multi-tenant WhatsApp Business API Gateway for Businesses", 
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 @app.middleware("http")
@@ -76,27 +202,20 @@ async def inject_tenant_for_swagger(request: Request, call_next):
     """
     ✅ Inject demo tenant for Swagger UI AND Scheduled Messages testing
     """
-    # Check if it's a Swagger, debug, OR scheduled messages request
-    swagger_paths = ["/docs", "/redoc", "/openapi.json", "/__debug"]
-    is_swagger_request = any(request.url.path.startswith(path) for path in swagger_paths)
-    
-    # ✅ ADD: Also handle scheduled messages for testing
-    is_scheduled_message = request.url.path.startswith('/api/v1/scheduled/')
+    path = request.url.path
     
-    if is_swagger_request or is_scheduled_message:
-        logger.debug(f"🔄 Injecting tenant for: {request.url.path}")
-        db = next(get_db())
+    # Requests already authenticated by HMACAuth keep their own tenant
+    if (path in DEMO_TENANT_EXACT or path.startswith(DEMO_TENANT_PREFIXES)) and getattr(request.state, 'tenant', None) is None:
+        logger.debug(f"🔄 Injecting tenant for: {path}")
         try:
-            tenant = db.query(Tenant).first()
+            tenant = await _get_demo_tenant()
             if tenant:
                 request.state.tenant = tenant
-                logger.debug(f"✅ Injected demo tenant: {tenant.name} for {request.url.path}")
+                logger.debug(f"✅ Injected demo tenant: {tenant.name} for {path}")
             else:
                 logger.warning("⚠️ No tenants found in database")
         except Exception as e:
             logger.error(f"❌ Failed to inject demo tenant: {e}")
-        finally:
-            db.close()
     
     response = await call_next(request)
     return response
@@ -104,6 +223,9 @@ async def inject_tenant_for_swagger(request: Request, call_next):
 # ✅ ADD HMAC AUTHENTICATION MIDDLEWARE
 app.add_middleware(HMACAuth)
 
+# ✅ COMPRESS RESPONSES (added last = outermost, so auth errors are compressed too)
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
 # ✅ INCLUDE ALL ROUTERS
 app.include_router(clients.router, prefix="/api/v1", tags=["Businesses"])
 app.include_router(webhook.router, tags=["Webhook"])
@@ -113,8 +235,8 @@ app.include_router(admin_router, prefix="/admin", tags=["Admin"])
 app.include_router(scheduled_messages.router, prefix="/api/v1/scheduled", tags=["Scheduled Messages"])
 
 @app.get("/")
-def root():
-    return {
+def root(request: Request):
+    return _cacheable_response(request, {
         "message": "Welcome to WhatsApp SaaS Gateway API!",
         "version": "2.0.0",
         "multi_tenant": True,
@@ -128,28 +250,25 @@ def root():
             "webhooks": "GET/POST /webhook",
             "business_management": "GET /api/v1/clients/*"
         }
-    }
+    })
 
 @app.get("/health")
-def health_check():
+async def health_check(request: Request, db: AsyncSession = Depends(get_async_db)):
     rabbitmq_status = "connected" if rabbitmq_service.is_connected else "disconnected"
     
-    db = next(get_db())
     try:
-        tenant_count = db.query(Tenant).count()
-        active_tenants = db.query(Tenant).filter(Tenant.is_active == True).count()
-        message_count = db.query(Message).count()
+        counts = await _cached_counts(db)
         
-        return {
+        return _cacheable_response(request, {
             "status": "healthy", 
             "database": "connected",
             "rabbitmq": rabbitmq_status,
             "tenants": {
-                "total": tenant_count,
-                "active": active_tenants
+                "total": counts["tenants"],
+                "active": counts["active_tenants"]
             },
-            "messages": message_count
-        }
+            "messages": counts["messages"]
+        })
     except Exception as e:
         return {
             "status": "healthy",
@@ -157,25 +276,19 @@ def health_check():
             "rabbitmq": rabbitmq_status,
             "error": f"Metrics unavailable: {str(e)}"
         }
-    finally:
-        db.close()
 
 @app.get("/test-db")
-def test_database():
+async def test_database(db: AsyncSession = Depends(get_async_db)):
     try:
-        db = next(get_db())
-        tenant_count = db.query(Tenant).count()
-        whatsapp_account_count = db.query(WhatsAppAccount).count()
-        message_count = db.query(Message).count()
-        db.close()
+        counts = await _cached_counts(db)
         
         return {
             "status": "success",
             "message": "Database is working perfectly!",
             "metrics": {
-                "tenants": tenant_count,
-                "whatsapp_accounts": whatsapp_account_count,
-                "messages": message_count
+                "tenants": counts["tenants"],
+                "whatsapp_accounts": counts["whatsapp_accounts"],
+                "messages": counts["messages"]
             },
             "rabbitmq": "connected" if rabbitmq_service.is_connected else "disconnected"
         }
@@ -187,14 +300,14 @@ def test_database():
 
 # ✅ TENANT INFO ENDPOINT (For testing)
 @app.get("/api/v1/me")
-async def get_tenant_info(request: Request, db: Session = Depends(get_db)):
+async def get_tenant_info(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Get current tenant info - with fallback"""
     try:
         # Try to get tenant from HMAC auth
         tenant = getattr(request.state, 'tenant', None)
         if not tenant:
             # Fallback: get first tenant from database
-            tenant = db.query(Tenant).first()
+            tenant = await db.scalar(select(Tenant).options(raiseload("*")).limit(1))
             if not tenant:
                 raise HTTPException(status_code=404, detail="No tenant found")
         
@@ -229,5 +342,17 @@ async def debug_check_tenant(request: Request):
     }
 
 if __name__ == "__main__":
+    from importlib.util import find_spec
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    
+    # uvloop/httptools are C implementations (uvicorn[standard]); uvloop has no Windows
+    # build, so fall back to the stock loop/parser wherever the extension isn't installed
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=settings.BACKGROUND_WORKER_COUNT,  # ignored when reload is on
+        loop="uvloop" if find_spec("uvloop") else "asyncio",
+        http="httptools" if find_spec("httptools") else "h11",
+        reload=settings.DEBUG
+    )
\ No newline at end of file
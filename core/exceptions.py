@@ -1,9 +1,20 @@
 from fastapi import HTTPException
 from typing import Any, Dict, Optional
 
+# Shared by every exception raised without details - treat as read-only.
+# (A plain dict rather than MappingProxyType so it stays JSON serializable.)
+_NO_DETAILS: Dict[str, Any] = {}
+
 class BusinessException(HTTPException):
     """Base exception for business logic errors"""
     
+    _type_name = "BusinessException"
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Resolved once per class instead of per raise
+        cls._type_name = cls.__name__
+    
     def __init__(
         self, 
         message: str, 
@@ -17,8 +28,8 @@ class BusinessException(HTTPException):
                 "error": {
                     "message": message,
                     "code": code,
-                    "type": self.__class__.__name__,
-                    "details": details or {}
+                    "type": self._type_name,
+                    "details": details or _NO_DETAILS
                 }
             }
         )
@@ -56,7 +67,7 @@ class WhatsAppAccountError(BusinessException):
         super().__init__(
             message=message,
             code="WHATSAPP_ACCOUNT_ERROR",
-            details={"whatsapp_error_code": error_code} if error_code else {}
+            details={"whatsapp_error_code": error_code} if error_code else None
         )
 
 class WhatsAppAPIError(BusinessException):
@@ -70,7 +81,7 @@ class WhatsAppAPIError(BusinessException):
 
 class MessageSendingError(BusinessException):
     def __init__(self, message: str, message_id: str = None):
-        details = {"message_id": message_id} if message_id else {}
+        details = {"message_id": message_id} if message_id else None
         super().__init__(
             message=message,
             code="MESSAGE_SENDING_ERROR",
@@ -81,7 +92,7 @@ class MessageSendingError(BusinessException):
 
 class ValidationError(BusinessException):
     def __init__(self, message: str, field: str = None):
-        details = {"field": field} if field else {}
+        details = {"field": field} if field else None
         super().__init__(
             message=message,
             code="VALIDATION_ERROR",
@@ -92,7 +103,7 @@ class ValidationError(BusinessException):
 
 class RateLimitExceededError(BusinessException):
     def __init__(self, retry_after: int = None):
-        details = {"retry_after": retry_after} if retry_after else {}
+        details = {"retry_after": retry_after} if retry_after else None
         super().__init__(
             message="Rate limit exceeded",
             code="RATE_LIMIT_EXCEEDED",
@@ -1,15 +1,16 @@
 import hmac
-import hashlib
 import secrets
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
-from fastapi import HTTPException, status, Header, Request
-from sqlalchemy.orm import Session
+from fastapi import Depends, HTTPException, status, Header, Request
+from sqlalchemy.orm import Session, raiseload
 from jose import JWTError, jwt
 
 from database.session import get_db
-from database.models import Tenant, RateLimit
+from database.models import Tenant
 from core.config import settings
+from middleware.rate_limiter import check_rate_limit
+from services.tenant_cache import tenant_cache, TenantSnapshot
 
 class SecurityManager:
     """Enterprise security manager for authentication and authorization"""
@@ -22,21 +23,17 @@ class SecurityManager:
     @staticmethod
     def generate_hmac_signature(payload: str) -> str:
         """Generate HMAC signature for webhook verification"""
-        signature = hmac.new(
-            settings.HMAC_SECRET.encode('utf-8'),
-            payload.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
-        return signature
+        # One-shot C path: no Python-level HMAC object per call
+        return hmac.digest(settings.HMAC_SECRET_BYTES, payload.encode('utf-8'), 'sha256').hex()
     
     @staticmethod
-    def verify_hmac_signature(payload: str, signature: str) -> bool:
-        """Verify HMAC signature for webhooks"""
-        expected_signature = SecurityManager.generate_hmac_signature(payload)
+    def verify_hmac_signature(payload: bytes, signature: bytes) -> bool:
+        """Verify HMAC signature for webhooks (raw digest bytes, not hex)"""
+        expected_signature = hmac.digest(settings.HMAC_SECRET_BYTES, payload, 'sha256')
         return hmac.compare_digest(expected_signature, signature)
     
     @staticmethod
-    def verify_api_key(api_key: str, db: Session) -> Optional[Tenant]:
+    def verify_api_key(api_key: str, db: Session) -> Optional[TenantSnapshot]:
         """Verify API key and return tenant with enhanced security"""
         if not api_key or not api_key.startswith("wp_"):
             raise HTTPException(
@@ -44,7 +41,13 @@ class SecurityManager:
                 detail="Invalid API key format"
             )
         
-        tenant = db.query(Tenant).filter(
+        # Only active tenants are ever cached
+        cached = tenant_cache.get(api_key)
+        if cached:
+            return cached
+        
+        # raiseload: the auth path must never lazy-load a tenant collection
+        tenant = db.query(Tenant).options(raiseload("*")).filter(
             Tenant.api_key == api_key, 
             Tenant.is_active == True
         ).first()
@@ -55,41 +58,22 @@ class SecurityManager:
                 detail="Invalid API key or tenant inactive"
             )
         
-        return tenant
+        return tenant_cache.put(tenant)
     
     @staticmethod
-    def check_rate_limit(tenant_id: str, db: Session) -> bool:
+    async def check_rate_limit(tenant_id: str) -> bool:
         """Check if tenant has exceeded rate limit"""
         if not settings.ENABLE_RATE_LIMITING:
             return True
             
-        current_window = datetime.utcnow().replace(second=0, microsecond=0)
-        
-        # Check minute-based rate limiting
-        rate_limit = db.query(RateLimit).filter(
-            RateLimit.tenant_id == tenant_id,
-            RateLimit.window_start == current_window,
-            RateLimit.window_size == "minute"
-        ).first()
-        
-        if not rate_limit:
-            # Create new rate limit window
-            rate_limit = RateLimit(
-                tenant_id=tenant_id,
-                window_start=current_window,
-                window_size="minute",
-                request_count=1
+        # Same per-minute Redis counter (and rate_limit_logs flusher) as the routes use,
+        # so a request is only ever counted against one budget
+        if not await check_rate_limit(tenant_id, settings.RATE_LIMIT_PER_MINUTE):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"Rate limit exceeded. {settings.RATE_LIMIT_PER_MINUTE} requests per minute allowed."
             )
-            db.add(rate_limit)
-        else:
-            if rate_limit.request_count >= settings.RATE_LIMIT_PER_MINUTE:
-                raise HTTPException(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    detail=f"Rate limit exceeded. {settings.RATE_LIMIT_PER_MINUTE} requests per minute allowed."
-                )
-            rate_limit.request_count += 1
         
-        db.commit()
         return True
     
     @staticmethod
@@ -119,11 +103,31 @@ class SecurityManager:
 
 # ==================== FASTAPI DEPENDENCIES ====================
 
+async def require_admin(authorization: Optional[str] = Header(None)) -> Dict[str, Any]:
+    """
+    Dependency for operator-only endpoints: Authorization: Bearer <JWT with role=admin>
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Admin credentials required"
+        )
+    
+    payload = SecurityManager.verify_access_token(token)
+    if payload.get("role") != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin role required"
+        )
+    
+    return payload
+
 async def get_current_tenant(
     request: Request,
     api_key: str = Header(..., alias=settings.API_KEY_HEADER),
     db: Session = Depends(get_db)
-) -> Tenant:
+) -> TenantSnapshot:
     """
     Dependency to get current tenant with rate limiting
     """
@@ -131,7 +135,7 @@ async def get_current_tenant(
     tenant = SecurityManager.verify_api_key(api_key, db)
     
     # Check rate limit
-    SecurityManager.check_rate_limit(tenant.id, db)
+    await SecurityManager.check_rate_limit(tenant.id)
     
     # Log the request (optional)
     request.state.tenant = tenant
@@ -145,12 +149,15 @@ async def verify_webhook_signature(request: Request):
     if not settings.ENABLE_WEBHOOK_VERIFICATION:
         return True
         
-    signature = request.headers.get("X-Hub-Signature-256", "").replace("sha256=", "")
+    signature_hex = request.headers.get("X-Hub-Signature-256", "").replace("sha256=", "")
+    try:
+        signature = bytes.fromhex(signature_hex)
+    except ValueError:
+        signature = b""
     
     body = await request.body()
-    payload = body.decode('utf-8')
     
-    if not SecurityManager.verify_hmac_signature(payload, signature):
+    if not SecurityManager.verify_hmac_signature(body, signature):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid webhook signature"
@@ -0,0 +1,49 @@
+import logging
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from database.session import engine, Base
+from database.models import Tenant, WhatsAppAccount
+
+logger = logging.getLogger(__name__)
+
+# Any fixed key works; every process bootstrapping the schema must use the same one
+SCHEMA_LOCK_ID = 42
+
+def init_db():
+    """Create missing tables. Concurrent workers are serialized by a transaction-scoped advisory lock"""
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": SCHEMA_LOCK_ID})
+        # gen_random_uuid() (primary key defaults) is core only from Postgres 13
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pgcrypto"))
+        Base.metadata.create_all(bind=conn)
+
+def seed_default_tenant():
+    """Create the demo tenant + WhatsApp account used by routes/clients.py when none exists"""
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": SCHEMA_LOCK_ID})
+        with Session(bind=conn) as db:
+            tenant = db.query(Tenant).first()
+            if not tenant:
+                tenant = Tenant(
+                    name="Test Tenant",
+                    email="test@example.com",
+                    api_key="test_key"
+                )
+                db.add(tenant)
+                db.flush()
+            
+            if not db.query(WhatsAppAccount.id).filter(WhatsAppAccount.tenant_id == tenant.id).first():
+                db.add(WhatsAppAccount(
+                    tenant_id=tenant.id,
+                    phone_number_id="TEST_PHONE_ID",
+                    access_token="TEST_ACCESS_TOKEN",
+                    phone_number="1234567890"
+                ))
+                db.flush()
+
+# One-shot deploy step: python -m database.init_db
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    seed_default_tenant()
+    logger.info("✅ Database tables created successfully!")
@@ -1,18 +1,31 @@
-from sqlalchemy import Column, String, Boolean, DateTime, Text, ForeignKey, Integer, JSON
+from sqlalchemy import DDL, Column, Enum, FetchedValue, String, Boolean, DateTime, Text, ForeignKey, Integer, BigInteger, LargeBinary, Uuid, Index, desc, event, func, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
-from datetime import datetime
-import uuid
+import enum
 import secrets
 from database.session import Base
 
 # -----------------------------
 # Helper Functions
 # -----------------------------
-def generate_uuid():
-    return str(uuid.uuid4())
+# Primary keys are generated by Postgres in the INSERT itself (returned via RETURNING),
+# so bulk inserts don't pay a Python uuid4() + str() per row
+UUID_SERVER_DEFAULT = text("gen_random_uuid()")
+
+# Native 16-byte uuid columns; as_uuid=False keeps ids as plain str in Python/JSON
+UUIDString = Uuid(as_uuid=False)
+
+def pk():
+    """uuid primary key generated by Postgres (pgcrypto/13+ gen_random_uuid); the ORM reads it back via RETURNING"""
+    return Column(UUIDString, primary_key=True, server_default=UUID_SERVER_DEFAULT)
+
+# Timestamps come from the database clock in the INSERT itself. Columns are naive
+# DateTime holding UTC, so pin now() to UTC rather than the server's TimeZone
+UTC_NOW = func.timezone("utc", func.now())
 
 def generate_hmac_secret():
-    return secrets.token_hex(64)
+    # Stored as the exact key bytes HMAC uses (clients sign with this ASCII-hex string)
+    return secrets.token_hex(32).encode()
 
 def generate_api_key():
     return f"wp_{secrets.token_hex(24)}"
@@ -22,12 +35,18 @@ def generate_api_key():
 # -----------------------------
 class Tenant(Base):
     __tablename__ = "tenants"
-    
-    id = Column(String, primary_key=True, default=generate_uuid)
+    __table_args__ = (
+        # Auth lookup: api_key = ? AND is_active
+        Index("ix_tenant_apikey_active", "api_key", "is_active"),
+        # Metadata containment lookups (custom_metadata @> '{"tag": ...}')
+        Index("ix_tenant_metadata_gin", "custom_metadata", postgresql_using="gin", postgresql_ops={"custom_metadata": "jsonb_path_ops"}),
+    )
+    
+    id = pk()
     name = Column(String(100), unique=True, nullable=False)
     email = Column(String(255), unique=True, nullable=True)
     api_key = Column(String(100), unique=True, nullable=False, default=generate_api_key)
-    hmac_secret = Column(String(128), nullable=False, default=generate_hmac_secret)
+    hmac_secret = Column(LargeBinary, nullable=False, default=generate_hmac_secret)
     webhook_url = Column(String(500))
     is_active = Column(Boolean, default=True)
     
@@ -36,22 +55,30 @@ class Tenant(Base):
     current_month_count = Column(Integer, default=0)
     rate_limit_per_minute = Column(Integer, default=60)
     timezone = Column(String(50), default="UTC")
-    custom_metadata = Column(JSON)
+    custom_metadata = Column(JSONB)
     
     # Security & Billing
     billing_tier = Column(String(20), default="starter")  # starter, growth, enterprise
     is_verified = Column(Boolean, default=False)
     max_whatsapp_accounts = Column(Integer, default=1)
     
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Activity counters - maintained by the trg_messages_tenant_activity trigger on messages
+    total_messages = Column(BigInteger, nullable=False, server_default=text("0"))
+    last_activity = Column(DateTime)
+    
+    created_at = Column(DateTime, server_default=UTC_NOW)
+    updated_at = Column(DateTime, server_default=UTC_NOW, server_onupdate=FetchedValue())
     
     # Relationships
+    # The unbounded collections may never be loaded implicitly (lazy="raise") -
+    # query them explicitly with a filter/limit
     whatsapp_accounts = relationship("WhatsAppAccount", back_populates="tenant")
-    messages = relationship("Message", back_populates="tenant")
-    api_logs = relationship("APILog", back_populates="tenant")
-    rate_limit_logs = relationship("RateLimitLog", back_populates="tenant")
-    webhook_delivery_logs = relationship("WebhookDeliveryLog", back_populates="tenant")
+    messages = relationship("Message", back_populates="tenant", lazy="raise")
+    api_logs = relationship("APILog", back_populates="tenant", lazy="raise")
+    rate_limit_logs = relationship("RateLimitLog", back_populates="tenant", lazy="raise")
+    webhook_delivery_logs = relationship("WebhookDeliveryLog", back_populates="tenant", lazy="raise")
+    message_templates = relationship("MessageTemplate", back_populates="tenant")
+    scheduled_messages = relationship("ScheduledMessage", back_populates="tenant", lazy="raise")
 
 # -----------------------------
 # WHATSAPP ACCOUNT MODEL
@@ -59,8 +86,8 @@ class Tenant(Base):
 class WhatsAppAccount(Base):
     __tablename__ = "whatsapp_accounts"
     
-    id = Column(String, primary_key=True, default=generate_uuid)
-    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
+    id = pk()
+    tenant_id = Column(UUIDString, ForeignKey("tenants.id"), nullable=False, index=True)
     phone_number_id = Column(String(100), nullable=False)
     access_token = Column(String(500), nullable=False)
     
@@ -70,7 +97,7 @@ class WhatsAppAccount(Base):
     webhook_verify_token = Column(String(100))
     quality_rating = Column(String(20))
     is_verified = Column(Boolean, default=False)
-    message_volume = Column(Integer, default=0)
+    message_volume = Column(BigInteger, default=0)
     health_status = Column(String(20), default="active")
     
     # Security
@@ -78,28 +105,42 @@ class WhatsAppAccount(Base):
     last_token_rotation = Column(DateTime)
     
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=UTC_NOW)
+    updated_at = Column(DateTime, server_default=UTC_NOW, server_onupdate=FetchedValue())
     
     # Relationships
-    tenant = relationship("Tenant", back_populates="whatsapp_accounts")
-    messages = relationship("Message", back_populates="whatsapp_account")
+    tenant = relationship("Tenant", back_populates="whatsapp_accounts", lazy="joined")
+    # write_only is the 2.0 (async-safe) form of lazy="dynamic": account.messages.select()
+    # builds a filtered query instead of materializing every message
+    messages = relationship("Message", back_populates="whatsapp_account", lazy="write_only")
+    scheduled_messages = relationship("ScheduledMessage", back_populates="whatsapp_account", lazy="raise")
 
 # -----------------------------
 # MESSAGE MODEL
 # -----------------------------
 class Message(Base):
     __tablename__ = "messages"
-    
-    id = Column(String, primary_key=True, default=generate_uuid)
-    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
-    whatsapp_account_id = Column(String, ForeignKey("whatsapp_accounts.id"))
+    __table_args__ = (
+        Index("ix_message_tenant_status_created", "tenant_id", "status", "created_at"),
+        # Per-tenant activity rollups (count / max(created_at) grouped by tenant)
+        Index("ix_message_tenant_created", "tenant_id", "created_at"),
+        # Append-only, so created_at follows physical order: a BRIN index is a few pages
+        # and lets time-range scans skip everything outside the range
+        Index("brin_messages_created", "created_at", postgresql_using="brin"),
+        Index("ix_message_pending", "created_at", postgresql_where=text("status = 'pending'")),
+        # Webhook status updates look messages up by WhatsApp's id; only outbound sends carry one
+        Index("ix_message_wamid", "wamid", postgresql_where=text("wamid IS NOT NULL")),
+    )
+    
+    id = pk()
+    tenant_id = Column(UUIDString, ForeignKey("tenants.id"), nullable=False)
+    whatsapp_account_id = Column(UUIDString, ForeignKey("whatsapp_accounts.id"))
     
     # Message content
     wamid = Column(String(100))
     from_number = Column(String(20), nullable=False)
     to_number = Column(String(20), nullable=False)
-    content = Column(Text)
+    content = Column(String(4096))  # WhatsApp's own cap for a text body
     message_type = Column(String(50), default="text")
     direction = Column(String(10))
     status = Column(String(20), default="pending")
@@ -110,27 +151,32 @@ class Message(Base):
     error_message = Column(Text)
     template_name = Column(String(100))
     media_url = Column(String(500))
-    custom_metadata = Column(JSON)
+    custom_metadata = Column(JSONB)
     
     # Billing & Analytics
     cost_units = Column(Integer, default=1)
     delivery_attempts = Column(Integer, default=0)
     
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=UTC_NOW)
+    updated_at = Column(DateTime, server_default=UTC_NOW, server_onupdate=FetchedValue())
     
     # Relationships
     tenant = relationship("Tenant", back_populates="messages")
-    whatsapp_account = relationship("WhatsAppAccount", back_populates="messages")
+    whatsapp_account = relationship("WhatsAppAccount", back_populates="messages", lazy="joined")
+    webhook_delivery_logs = relationship("WebhookDeliveryLog", back_populates="message", lazy="raise")
 
 # -----------------------------
 # API LOG MODEL
 # -----------------------------
 class APILog(Base):
     __tablename__ = "api_logs"
+    __table_args__ = (
+        Index("ix_apilog_tenant_created", "tenant_id", desc("created_at")),
+        Index("brin_api_logs_created", "created_at", postgresql_using="brin"),
+    )
     
-    id = Column(String, primary_key=True, default=generate_uuid)
-    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
+    id = pk()
+    tenant_id = Column(UUIDString, ForeignKey("tenants.id"), nullable=False)
     
     endpoint = Column(String(255), nullable=False)
     method = Column(String(10), nullable=False)
@@ -140,10 +186,10 @@ class APILog(Base):
     ip_address = Column(String(45))
     request_id = Column(String(100))
     client_version = Column(String(50))
-    error_message = Column(Text)
+    error_message = Column(String(1024))
     stack_trace = Column(Text)
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=UTC_NOW)
     tenant = relationship("Tenant", back_populates="api_logs")
 
 # -----------------------------
@@ -151,44 +197,70 @@ class APILog(Base):
 # -----------------------------
 class RateLimitLog(Base):
     __tablename__ = "rate_limit_logs"
+    __table_args__ = (
+        # One row per tenant/window/type - also what an upsert conflicts on
+        Index("ix_ratelimit_tenant_window", "tenant_id", "window_start", "limit_type", unique=True),
+    )
     
-    id = Column(String, primary_key=True, default=generate_uuid)
-    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
+    id = pk()
+    tenant_id = Column(UUIDString, ForeignKey("tenants.id"), nullable=False)
     
     window_start = Column(DateTime, nullable=False)
     window_end = Column(DateTime, nullable=False)
     request_count = Column(Integer, default=0)
     limit_type = Column(String(50), nullable=False)  # minute, hour, month
     
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=UTC_NOW)
+    updated_at = Column(DateTime, server_default=UTC_NOW, server_onupdate=FetchedValue())
     
     tenant = relationship("Tenant", back_populates="rate_limit_logs")
 
-# In database/models.py
+# -----------------------------
+# MESSAGE TEMPLATE MODEL
+# -----------------------------
 class MessageTemplate(Base):
     __tablename__ = "message_templates"
     
-    id = Column(String, primary_key=True, default=generate_uuid)
-    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
+    id = pk()
+    tenant_id = Column(UUIDString, ForeignKey("tenants.id"), nullable=False, index=True)
     name = Column(String)  # order_confirmation
     category = Column(String)  # UTILITY, MARKETING, etc.
     language = Column(String, default="en")
     header = Column(Text)
     body = Column(Text)
     footer = Column(Text)
-    buttons = Column(JSON)  # Store button config
+    buttons = Column(JSONB)  # Store button config
     status = Column(String)  # PENDING, APPROVED, REJECTED
     meta_template_id = Column(String)  # Meta's template ID
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=UTC_NOW)
+    
+    tenant = relationship("Tenant", back_populates="message_templates")
 
+# -----------------------------
+# SCHEDULED MESSAGE MODEL
+# -----------------------------
+class ScheduledStatus(str, enum.Enum):
+    """Lifecycle of a scheduled message; stored as the native scheduled_status enum (4 bytes, compared by sort order)"""
+    SCHEDULED = "scheduled"
+    PROCESSING = "processing"
+    SENT = "sent"
+    FAILED = "failed"
+    PERMANENTLY_FAILED = "permanently_failed"
+    CANCELLED = "cancelled"
 
 class ScheduledMessage(Base):
     __tablename__ = "scheduled_messages"
-    
-    id = Column(String, primary_key=True, default=generate_uuid)
-    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
-    whatsapp_account_id = Column(String, ForeignKey("whatsapp_accounts.id"))
+    __table_args__ = (
+        # Scheduler sweep: status IN ('scheduled', 'failed') AND scheduled_at <= now.
+        # Partial, so it only holds rows still waiting - not the sent/cancelled history
+        Index("ix_scheduled_due_partial", "scheduled_at", postgresql_where=text("status IN ('scheduled', 'failed')")),
+        # Per-tenant keyset listing (tenant_id, scheduled_at > cursor); also serves tenant_id lookups
+        Index("ix_scheduled_tenant_time", "tenant_id", "scheduled_at", postgresql_include=["status", "to_number"]),
+    )
+    
+    id = pk()
+    tenant_id = Column(UUIDString, ForeignKey("tenants.id"), nullable=False)
+    whatsapp_account_id = Column(UUIDString, ForeignKey("whatsapp_accounts.id"))
     
     # Message details
     to_number = Column(String(20), nullable=False)
@@ -200,7 +272,10 @@ class ScheduledMessage(Base):
     timezone = Column(String(50), default="UTC")
     
     # Status tracking
-    status = Column(String(20), default="scheduled")  # scheduled, processing, sent, failed, cancelled
+    status = Column(
+        Enum(ScheduledStatus, name="scheduled_status", values_callable=lambda statuses: [s.value for s in statuses]),
+        default=ScheduledStatus.SCHEDULED
+    )
     sent_at = Column(DateTime)  # When actually sent
     attempts = Column(Integer, default=0)
     max_attempts = Column(Integer, default=3)
@@ -210,27 +285,32 @@ class ScheduledMessage(Base):
     last_attempt_at = Column(DateTime)
     
     # Metadata
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=UTC_NOW)
+    updated_at = Column(DateTime, server_default=UTC_NOW, server_onupdate=FetchedValue())
     
     # Relationships
-    tenant = relationship("Tenant")
-    whatsapp_account = relationship("WhatsAppAccount")
+    tenant = relationship("Tenant", back_populates="scheduled_messages")
+    whatsapp_account = relationship("WhatsAppAccount", back_populates="scheduled_messages")
 
 # -----------------------------
 # WEBHOOK DELIVERY LOG MODEL
 # -----------------------------
 class WebhookDeliveryLog(Base):
     __tablename__ = "webhook_delivery_logs"
+    __table_args__ = (
+        Index("brin_webhook_delivery_logs_created", "created_at", postgresql_using="brin"),
+        # Retry sweep: deliveries that never got a response and may be retried
+        Index("ix_webhook_retryable", "initiated_at", postgresql_where=text("retryable = true AND response_status IS NULL")),
+    )
     
-    id = Column(String, primary_key=True, default=generate_uuid)
-    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
-    message_id = Column(String, ForeignKey("messages.id"))
+    id = pk()
+    tenant_id = Column(UUIDString, ForeignKey("tenants.id"), nullable=False, index=True)
+    message_id = Column(UUIDString, ForeignKey("messages.id"))
     
     webhook_url = Column(String(500), nullable=False)
     payload = Column(Text)
     response_status = Column(Integer)
-    response_body = Column(Text)
+    response_body = Column(String(8192))
     delivery_attempt = Column(Integer, default=1)
     
     initiated_at = Column(DateTime, nullable=False)
@@ -239,7 +319,93 @@ class WebhookDeliveryLog(Base):
     error_message = Column(Text)
     retryable = Column(Boolean, default=True)
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=UTC_NOW)
     
     tenant = relationship("Tenant", back_populates="webhook_delivery_logs")
-    message = relationship("Message")
+    message = relationship("Message", back_populates="webhook_delivery_logs")
+
+# -----------------------------
+# OUTBOX MODEL
+# -----------------------------
+class OutboxMessage(Base):
+    """
+    Queue payloads written in the same transaction as the rows they describe;
+    services/outbox.py publishes them to RabbitMQ and deletes them, so the table
+    only ever holds the unpublished backlog
+    """
+    __tablename__ = "outbox"
+    
+    id = pk()
+    queue = Column(String(100), nullable=False, default="outgoing_messages")
+    payload = Column(JSONB, nullable=False)
+    attempts = Column(Integer, nullable=False, server_default=text("0"))
+    created_at = Column(DateTime, server_default=UTC_NOW, index=True)
+
+# -----------------------------
+# updated_at MAINTENANCE
+# -----------------------------
+# Postgres has no ON UPDATE CURRENT_TIMESTAMP; a BEFORE UPDATE trigger stamps
+# updated_at for ORM flushes and bulk UPDATEs alike (server_onupdate=FetchedValue)
+event.listen(Base.metadata, "before_create", DDL("""
+    CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger AS $$
+    BEGIN
+        NEW.updated_at = timezone('utc', now());
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+"""))
+
+for _table in Base.metadata.tables.values():
+    if "updated_at" in _table.c:
+        event.listen(_table, "after_create", DDL(
+            f"CREATE TRIGGER trg_{_table.name}_updated_at BEFORE UPDATE ON {_table.name} "
+            f"FOR EACH ROW EXECUTE PROCEDURE set_updated_at()"
+        ))
+
+# -----------------------------
+# TENANT ACTIVITY COUNTERS
+# -----------------------------
+# Statement-level trigger: a multi-row INSERT updates each tenant once, with the
+# per-tenant count/max taken from the transition table
+event.listen(Base.metadata, "before_create", DDL("""
+    CREATE OR REPLACE FUNCTION bump_tenant_activity() RETURNS trigger AS $$
+    BEGIN
+        UPDATE tenants t
+        SET total_messages = t.total_messages + n.cnt,
+            last_activity = GREATEST(t.last_activity, n.last_created)
+        FROM (
+            SELECT tenant_id, count(*) AS cnt, max(created_at) AS last_created
+            FROM new_messages
+            GROUP BY tenant_id
+        ) n
+        WHERE t.id = n.tenant_id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+"""))
+
+event.listen(Message.__table__, "after_create", DDL(
+    "CREATE TRIGGER trg_messages_tenant_activity AFTER INSERT ON messages "
+    "REFERENCING NEW TABLE AS new_messages "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE bump_tenant_activity()"
+))
+
+# -----------------------------
+# MATERIALIZED VIEWS
+# -----------------------------
+# Pre-aggregated status counts for the success-rate dashboard; refreshed in the
+# background (services/view_refresher.py). The unique index is what allows
+# REFRESH ... CONCURRENTLY, so readers are never blocked by a refresh
+MESSAGE_STATUS_COUNTS_VIEW = "mv_message_status_counts"
+
+event.listen(Message.__table__, "after_create", DDL(f"""
+    CREATE MATERIALIZED VIEW IF NOT EXISTS {MESSAGE_STATUS_COUNTS_VIEW} AS
+    SELECT status, count(*) AS cnt FROM messages GROUP BY status
+"""))
+event.listen(Message.__table__, "after_create", DDL(
+    f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{MESSAGE_STATUS_COUNTS_VIEW}_status "
+    f"ON {MESSAGE_STATUS_COUNTS_VIEW} (status)"
+))
+event.listen(Message.__table__, "before_drop", DDL(
+    f"DROP MATERIALIZED VIEW IF EXISTS {MESSAGE_STATUS_COUNTS_VIEW}"
+))
@@ -1,34 +1,64 @@
 import hmac
-import hashlib
 import time
 from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
-from database.session import SessionLocal
-from database.models import Tenant, APILog
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from sqlalchemy import select
+from sqlalchemy.orm import raiseload
+from database.session import AsyncSessionLocal
+from database.models import Tenant
+from services.api_log_writer import api_log_writer
+from services.tenant_cache import tenant_cache
 import logging
 
 logger = logging.getLogger(__name__)
 
-class HMACAuth(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Skip auth for public routes
-        public_paths = [
-            '/docs', '/redoc', '/openapi.json', 
-            '/webhook', '/api/v1/tenants/register', 
-            '/health', '/', '/test-db',
-            '/tenants/', 
-            '/api/v1/me' 
-        ]
+# Public routes: exact paths are one set lookup, prefixes one C-level startswith(tuple)
+PUBLIC_EXACT_PATHS = frozenset({'/', '/docs', '/redoc', '/openapi.json', '/health', '/test-db'})
+PUBLIC_PATH_PREFIXES = ('/docs/', '/webhook', '/api/v1/tenants/register', '/tenants/', '/api/v1/me')
+
+# Above this size the body is streamed into a copy of the tenant's pre-keyed HMAC
+# instead of being concatenated with the timestamp first
+LARGE_BODY_BYTES = 16 * 1024
+
+class HMACAuth:
+    """
+    Pure ASGI middleware: the verified body is handed downstream through the ASGI receive
+    channel it passes on, so nothing has to patch Request internals
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Skip auth for public routes (and lifespan/websocket scopes)
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        if path in PUBLIC_EXACT_PATHS or path.startswith(PUBLIC_PATH_PREFIXES):
+            return await self.app(scope, receive, send)
         
-        if any(request.url.path == path or request.url.path.startswith(path) for path in public_paths):
-            return await call_next(request)
+        request = Request(scope, receive)
+        response = await self.verify_hmac(request)
+        if response is not None:
+            return await response(scope, receive, send)
         
-        return await self.verify_hmac(request, call_next)
+        # Replay the body already read for the signature, then hand back to the server's
+        # receive (http.disconnect) - Starlette 0.27 doesn't replay a consumed body itself
+        body_sent = False
+        
+        async def replay_receive() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': await request.body(), 'more_body': False}
+            return await receive()
+        
+        await self.app(scope, replay_receive, send)
     
-    async def verify_hmac(self, request: Request, call_next):
+    async def verify_hmac(self, request: Request):
+        """None when the request is authenticated (tenant on request.state), else the error response"""
         start_time = time.time()
-        db = SessionLocal()
         
         try:
             # Get headers
@@ -37,93 +67,90 @@ class HMACAuth(BaseHTTPMiddleware):
             timestamp = request.headers.get('X-Timestamp')
             
             if not all([client_id, signature, timestamp]):
-                await self.log_api_call(db, None, request, 401, start_time, "Missing headers")
+                self.log_api_call(None, request, 401, start_time, "Missing headers")
                 raise HTTPException(status_code=401, detail="Missing authentication headers")
             
             # Validate timestamp (prevent replay attacks)
             if abs(int(time.time()) - int(timestamp)) > 300:  # 5 minutes
-                await self.log_api_call(db, None, request, 401, start_time, "Invalid timestamp")
+                self.log_api_call(None, request, 401, start_time, "Invalid timestamp")
                 raise HTTPException(status_code=401, detail="Invalid timestamp")
             
-            # Get tenant
-            tenant = db.query(Tenant).filter(
-                Tenant.api_key == client_id,
-                Tenant.is_active == True
-            ).first()
+            # Get tenant - cached snapshot first, DB only on a miss
+            tenant = tenant_cache.get(client_id)
+            if tenant is None:
+                # Pooled async session, no lazy loads of the relationship collections
+                async with AsyncSessionLocal() as db:
+                    row = await db.scalar(
+                        select(Tenant)
+                        .options(raiseload("*"))
+                        .where(Tenant.api_key == client_id, Tenant.is_active == True)
+                    )
+                if row:
+                    tenant = tenant_cache.put(row)
             
             if not tenant:
-                await self.log_api_call(db, None, request, 401, start_time, "Invalid client ID")
+                self.log_api_call(None, request, 401, start_time, "Invalid client ID")
                 raise HTTPException(status_code=401, detail="Invalid client ID")
             
             # ✅ FIX: Store the body bytes for signature verification
             body_bytes = await request.body()
             
-            # ✅ CRITICAL FIX: Re-create the request with the body for downstream use
-            async def receive():
-                return {'type': 'http.request', 'body': body_bytes, 'more_body': False}
+            # Verify HMAC signature over "<timestamp>.<raw body>" - compared as raw digest bytes
+            try:
+                provided_signature = bytes.fromhex(signature)
+            except ValueError:
+                provided_signature = b""
+            if len(body_bytes) < LARGE_BODY_BYTES:
+                expected_signature = hmac.digest(
+                    tenant.hmac_secret_bytes,
+                    timestamp.encode() + b"." + body_bytes,
+                    'sha256'
+                )
+            else:
+                signer = tenant.hmac_template.copy()
+                signer.update(timestamp.encode())
+                signer.update(b".")
+                signer.update(memoryview(body_bytes))
+                expected_signature = signer.digest()
             
-            # Verify HMAC signature
-            body_str = body_bytes.decode() if body_bytes else ""
-            message = f"{timestamp}.{body_str}"
-            expected_signature = hmac.new(
-                key=tenant.hmac_secret.encode('utf-8'),
-                msg=message.encode('utf-8'),
-                digestmod=hashlib.sha256
-            ).hexdigest()
-            
-            if not hmac.compare_digest(expected_signature, signature):
-                await self.log_api_call(db, tenant.id, request, 401, start_time, "Invalid signature")
+            if not hmac.compare_digest(expected_signature, provided_signature):
+                self.log_api_call(tenant.id, request, 401, start_time, "Invalid signature")
                 raise HTTPException(status_code=401, detail="Invalid signature")
             
             # Add tenant to request state
             request.state.tenant = tenant
             
             # Log successful auth
-            response_time = int((time.time() - start_time) * 1000)
-            await self.log_api_call(db, tenant.id, request, 200, response_time)
-            
-            # ✅ FIX: Create a new request with the original body
-            from starlette.requests import Request
-            new_request = Request(request.scope, receive)
-            
-            # Continue to the next middleware/route with the restored request
-            response = await call_next(new_request)
-            return response
+            self.log_api_call(tenant.id, request, 200, start_time)
+            return None
             
         except HTTPException as e:
-            return Response(
+            return JSONResponse(
                 content={"detail": e.detail},
-                status_code=e.status_code,
-                media_type="application/json"
+                status_code=e.status_code
             )
         except Exception as e:
             logger.error(f"Auth error: {e}")
-            await self.log_api_call(db, None, request, 500, start_time, str(e))
-            return Response(
+            self.log_api_call(None, request, 500, start_time, str(e))
+            return JSONResponse(
                 content={"detail": "Authentication error"},
-                status_code=500,
-                media_type="application/json"
+                status_code=500
             )
-        finally:
-            db.close()
     
-    async def log_api_call(self, db, tenant_id, request, status_code, start_time, error_msg=None):
-        try:
-            response_time = int((time.time() - start_time) * 1000)
-            
-            api_log = APILog(
-                tenant_id=tenant_id,
-                endpoint=request.url.path,
-                method=request.method,
-                status_code=status_code,
-                response_time=response_time,
-                user_agent=request.headers.get('user-agent'),
-                ip_address=request.client.host if request.client else None,
-                error_message=error_msg
-            )
-            
-            db.add(api_log)
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            logger.error(f"Failed to log API call: {e}")
\ No newline at end of file
+    def log_api_call(self, tenant_id, request, status_code, start_time, error_msg=None):
+        """Hand the log row to the background writer - nothing is awaited on the request path"""
+        if tenant_id is None:
+            # api_logs.tenant_id is NOT NULL; unidentified callers only go to the app log
+            logger.warning(f"Unauthenticated {request.method} {request.url.path}: {status_code} {error_msg}")
+            return
+        
+        api_log_writer.log(
+            tenant_id=tenant_id,
+            endpoint=request.url.path,
+            method=request.method,
+            status_code=status_code,
+            response_time=int((time.time() - start_time) * 1000),
+            user_agent=request.headers.get('user-agent'),
+            ip_address=request.client.host if request.client else None,
+            error_message=error_msg
+        )
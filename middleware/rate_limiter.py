@@ -1,53 +1,147 @@
-from database.session import SessionLocal
-from database.models import RateLimitLog, Tenant
+import asyncio
+import time
 from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from database.session import AsyncSessionLocal
+from database.models import RateLimitLog
+from services.cache import cache_service
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def check_rate_limit(tenant_id: str) -> bool:
-    db = SessionLocal()
+WINDOW_SECONDS = 60
+COUNTER_TTL = 90  # outlives the window so the flusher can still read it
+
+def _counter_key(tenant_id: str, window: int) -> str:
+    return f"rl:minute:{tenant_id}:{window}"
+
+def _seen_key(window: int) -> str:
+    # Tenants that made requests in a window - what the flusher walks
+    return f"rl:minute:seen:{window}"
+
+def _window_bounds(window: int):
+    window_start = datetime.utcfromtimestamp(window * WINDOW_SECONDS)
+    return window_start, window_start + timedelta(seconds=WINDOW_SECONDS)
+
+async def _increment_in_db(tenant_id: str, window: int) -> int:
+    """Fallback counter: one atomic upsert on the (tenant_id, window_start, limit_type) unique index"""
+    window_start, window_end = _window_bounds(window)
+    stmt = (
+        insert(RateLimitLog)
+        .values(
+            tenant_id=tenant_id,
+            window_start=window_start,
+            window_end=window_end,
+            limit_type="minute",
+            request_count=1
+        )
+        .on_conflict_do_update(
+            index_elements=["tenant_id", "window_start", "limit_type"],
+            set_={"request_count": RateLimitLog.__table__.c.request_count + 1}
+        )
+        .returning(RateLimitLog.request_count)
+    )
+    async with AsyncSessionLocal() as db:
+        count = await db.scalar(stmt)
+        await db.commit()
+    return count
+
+async def check_rate_limit(tenant_id: str, limit: int) -> bool:
+    """Per-tenant, per-minute limit: one atomic Redis round-trip, no DB rows or locks"""
+    window = int(time.time()) // WINDOW_SECONDS
+    key = _counter_key(tenant_id, window)
+    seen_key = _seen_key(window)
+
     try:
-        tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
-        if not tenant:
-            return False
-        
-        now = datetime.utcnow()
-        window_start = now.replace(second=0, microsecond=0)
-        window_end = window_start + timedelta(minutes=1)
-        
-        # Get or create rate limit log for this minute
-        rate_log = db.query(RateLimitLog).filter(
-            RateLimitLog.tenant_id == tenant_id,
-            RateLimitLog.window_start == window_start,
-            RateLimitLog.window_end == window_end,
-            RateLimitLog.limit_type == 'minute'
-        ).first()
-        
-        if not rate_log:
-            rate_log = RateLimitLog(
-                tenant_id=tenant_id,
-                window_start=window_start,
-                window_end=window_end,
-                limit_type='minute',
-                request_count=0
-            )
-            db.add(rate_log)
-        
-        # Check if limit exceeded
-        if rate_log.request_count >= tenant.rate_limit_per_minute:
-            logger.warning(f"Rate limit exceeded for tenant {tenant_id}")
-            return False
-        
-        # Increment counter
-        rate_log.request_count += 1
-        db.commit()
-        
-        return True
-        
+        async with cache_service.client.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, COUNTER_TTL)
+            pipe.sadd(seen_key, tenant_id)
+            pipe.expire(seen_key, COUNTER_TTL)
+            count, *_ = await pipe.execute()
     except Exception as e:
-        logger.error(f"Rate limit check failed: {e}")
-        db.rollback()
+        logger.warning(f"Redis unavailable, counting rate limit in the database: {e}")
+        try:
+            count = await _increment_in_db(tenant_id, window)
+        except Exception as e:
+            # Fail open - neither store being reachable shouldn't take the API with it
+            logger.error(f"Rate limit check skipped: {e}")
+            return True
+
+    if count > limit:
+        logger.warning(f"Rate limit exceeded for tenant {tenant_id}")
         return False
-    finally:
-        db.close()
\ No newline at end of file
+
+    return True
+
+class RateLimitFlusher:
+    """Copies finished per-minute Redis counters into rate_limit_logs once a minute"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            # Wake just after each minute boundary and flush the window that closed
+            await asyncio.sleep(WINDOW_SECONDS - time.time() % WINDOW_SECONDS + 1)
+            try:
+                await self.flush_window(int(time.time()) // WINDOW_SECONDS - 1)
+            except Exception as e:
+                logger.error(f"Rate limit flush failed: {e}")
+
+    async def flush_window(self, window: int):
+        client = cache_service.client
+
+        # Every worker runs a flusher; only the first to claim the window writes it
+        if not await client.set(f"rl:minute:flushed:{window}", 1, nx=True, ex=COUNTER_TTL * 2):
+            return
+
+        tenant_ids = [t.decode() for t in await client.smembers(_seen_key(window))]
+        if not tenant_ids:
+            return
+
+        counts = await client.mget([_counter_key(t, window) for t in tenant_ids])
+        window_start, window_end = _window_bounds(window)
+
+        rows = [
+            {
+                "tenant_id": tenant_id,
+                "window_start": window_start,
+                "window_end": window_end,
+                "limit_type": "minute",
+                "request_count": int(count)
+            }
+            for tenant_id, count in zip(tenant_ids, counts)
+            if count is not None
+        ]
+        if not rows:
+            return
+
+        # Upsert so a window the DB fallback already counted isn't duplicated
+        stmt = insert(RateLimitLog).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["tenant_id", "window_start", "limit_type"],
+            set_={"request_count": func.greatest(RateLimitLog.__table__.c.request_count, stmt.excluded.request_count)}
+        )
+        async with AsyncSessionLocal() as db:
+            await db.execute(stmt)
+            await db.commit()
+
+        logger.info(f"Flushed rate limit counters for {len(rows)} tenants")
+
+# Global instance
+rate_limit_flusher = RateLimitFlusher()
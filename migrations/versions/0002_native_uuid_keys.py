@@ -0,0 +1,70 @@
+"""Store ids and foreign keys as native uuid instead of text
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = (
+    "tenants",
+    "whatsapp_accounts",
+    "messages",
+    "api_logs",
+    "rate_limit_logs",
+    "message_templates",
+    "scheduled_messages",
+    "webhook_delivery_logs",
+)
+
+# (table, column, referenced table)
+FOREIGN_KEYS = (
+    ("whatsapp_accounts", "tenant_id", "tenants"),
+    ("messages", "tenant_id", "tenants"),
+    ("messages", "whatsapp_account_id", "whatsapp_accounts"),
+    ("api_logs", "tenant_id", "tenants"),
+    ("rate_limit_logs", "tenant_id", "tenants"),
+    ("message_templates", "tenant_id", "tenants"),
+    ("scheduled_messages", "tenant_id", "tenants"),
+    ("scheduled_messages", "whatsapp_account_id", "whatsapp_accounts"),
+    ("webhook_delivery_logs", "tenant_id", "tenants"),
+    ("webhook_delivery_logs", "message_id", "messages"),
+)
+
+
+def _convert(column_type: str, default: str) -> None:
+    # Key types can't change underneath a live FK, so drop them first and put them back after
+    for table, column, _ in FOREIGN_KEYS:
+        op.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_{column}_fkey")
+
+    for table in TABLES:
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN id DROP DEFAULT")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN id TYPE {column_type} USING id::{column_type}")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT {default}")
+
+    for table, column, _ in FOREIGN_KEYS:
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE {column_type} USING {column}::{column_type}")
+
+    for table, column, referenced in FOREIGN_KEYS:
+        op.create_foreign_key(f"{table}_{column}_fkey", table, referenced, [column], ["id"])
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _convert("uuid", "gen_random_uuid()")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _convert("varchar", "gen_random_uuid()::text")
@@ -0,0 +1,56 @@
+"""Indexes for the auth, rate-limit, analytics and scheduler queries
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = (
+    ("ix_tenant_apikey_active", "tenants", "api_key, is_active"),
+    ("ix_apilog_tenant_created", "api_logs", "tenant_id, created_at DESC"),
+    ("ix_message_tenant_status_created", "messages", "tenant_id, status, created_at"),
+    ("ix_scheduled_due", "scheduled_messages", "status, scheduled_at"),
+    ("ix_whatsapp_accounts_tenant_id", "whatsapp_accounts", "tenant_id"),
+    ("ix_message_templates_tenant_id", "message_templates", "tenant_id"),
+    ("ix_scheduled_messages_tenant_id", "scheduled_messages", "tenant_id"),
+    ("ix_webhook_delivery_logs_tenant_id", "webhook_delivery_logs", "tenant_id"),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for name, table, columns in INDEXES:
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+    # The old get-or-create could race into duplicate windows; keep one row per window
+    op.execute("""
+        DELETE FROM rate_limit_logs a
+        USING rate_limit_logs b
+        WHERE a.tenant_id = b.tenant_id
+          AND a.window_start = b.window_start
+          AND a.limit_type = b.limit_type
+          AND a.id < b.id
+    """)
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_ratelimit_tenant_window "
+        "ON rate_limit_logs (tenant_id, window_start, limit_type)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS ix_ratelimit_tenant_window")
+    for name, _, _ in INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
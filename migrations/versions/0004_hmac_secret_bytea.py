@@ -0,0 +1,29 @@
+"""Store tenant HMAC secrets as bytea
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing secrets become their UTF-8 bytes - exactly the key clients already sign with
+    op.execute("ALTER TABLE tenants ALTER COLUMN hmac_secret TYPE bytea USING convert_to(hmac_secret, 'UTF8')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE tenants ALTER COLUMN hmac_secret TYPE varchar(128) USING convert_from(hmac_secret, 'UTF8')")
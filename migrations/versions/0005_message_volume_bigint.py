@@ -0,0 +1,28 @@
+"""Widen whatsapp_accounts.message_volume to bigint
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column("whatsapp_accounts", "message_volume", type_=sa.BigInteger(), existing_type=sa.Integer())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column("whatsapp_accounts", "message_volume", type_=sa.Integer(), existing_type=sa.BigInteger())
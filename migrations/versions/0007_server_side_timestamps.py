@@ -0,0 +1,72 @@
+"""Server-side created_at/updated_at defaults and an updated_at trigger
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CREATED_AT_TABLES = (
+    "tenants",
+    "whatsapp_accounts",
+    "messages",
+    "api_logs",
+    "rate_limit_logs",
+    "message_templates",
+    "scheduled_messages",
+    "webhook_delivery_logs",
+)
+
+UPDATED_AT_TABLES = (
+    "tenants",
+    "whatsapp_accounts",
+    "messages",
+    "rate_limit_logs",
+    "scheduled_messages",
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at = timezone('utc', now());
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    for table in CREATED_AT_TABLES:
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN created_at SET DEFAULT timezone('utc', now())")
+
+    for table in UPDATED_AT_TABLES:
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN updated_at SET DEFAULT timezone('utc', now())")
+        op.execute(f"DROP TRIGGER IF EXISTS trg_{table}_updated_at ON {table}")
+        op.execute(
+            f"CREATE TRIGGER trg_{table}_updated_at BEFORE UPDATE ON {table} "
+            f"FOR EACH ROW EXECUTE PROCEDURE set_updated_at()"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in UPDATED_AT_TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS trg_{table}_updated_at ON {table}")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN updated_at DROP DEFAULT")
+
+    for table in CREATED_AT_TABLES:
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN created_at DROP DEFAULT")
+
+    op.execute("DROP FUNCTION IF EXISTS set_updated_at()")
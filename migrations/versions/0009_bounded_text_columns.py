@@ -0,0 +1,36 @@
+"""Bound message content, API log errors and webhook response bodies
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, Sequence[str], None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = (
+    ("messages", "content", 4096),
+    ("api_logs", "error_message", 1024),
+    ("webhook_delivery_logs", "response_body", 8192),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table, column, length in COLUMNS:
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE varchar({length}) USING left({column}, {length})")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table, column, _ in COLUMNS:
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE text")
@@ -0,0 +1,43 @@
+"""Partial indexes for the scheduler, pending-message and webhook-retry sweeps
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, Sequence[str], None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_scheduled_due_partial ON scheduled_messages (scheduled_at) "
+        "WHERE status IN ('scheduled', 'failed')"
+    )
+    op.execute("DROP INDEX IF EXISTS ix_scheduled_due")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_message_pending ON messages (created_at) "
+        "WHERE status = 'pending'"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_webhook_retryable ON webhook_delivery_logs (initiated_at) "
+        "WHERE retryable = true AND response_status IS NULL"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS ix_webhook_retryable")
+    op.execute("DROP INDEX IF EXISTS ix_message_pending")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_scheduled_due ON scheduled_messages (status, scheduled_at)")
+    op.execute("DROP INDEX IF EXISTS ix_scheduled_due_partial")
@@ -0,0 +1,37 @@
+"""Covering (tenant_id, scheduled_at) index for keyset-paginated scheduled message listing
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0013'
+down_revision: Union[str, Sequence[str], None] = '0012'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY can't run inside the migration transaction
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_scheduled_tenant_time "
+            "ON scheduled_messages (tenant_id, scheduled_at) INCLUDE (status, to_number)"
+        )
+        # Leading tenant_id column of the new index covers the old single-column one
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_scheduled_messages_tenant_id")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_scheduled_messages_tenant_id ON scheduled_messages (tenant_id)")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_scheduled_tenant_time")
@@ -0,0 +1,67 @@
+"""Trigger-maintained message counters on tenants
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0014'
+down_revision: Union[str, Sequence[str], None] = '0013'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("ALTER TABLE tenants ADD COLUMN IF NOT EXISTS total_messages bigint NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE tenants ADD COLUMN IF NOT EXISTS last_activity timestamp")
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION bump_tenant_activity() RETURNS trigger AS $$
+        BEGIN
+            UPDATE tenants t
+            SET total_messages = t.total_messages + n.cnt,
+                last_activity = GREATEST(t.last_activity, n.last_created)
+            FROM (
+                SELECT tenant_id, count(*) AS cnt, max(created_at) AS last_created
+                FROM new_messages
+                GROUP BY tenant_id
+            ) n
+            WHERE t.id = n.tenant_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("DROP TRIGGER IF EXISTS trg_messages_tenant_activity ON messages")
+    op.execute(
+        "CREATE TRIGGER trg_messages_tenant_activity AFTER INSERT ON messages "
+        "REFERENCING NEW TABLE AS new_messages "
+        "FOR EACH STATEMENT EXECUTE PROCEDURE bump_tenant_activity()"
+    )
+
+    # Backfill from existing messages (same transaction as the trigger creation)
+    op.execute("""
+        UPDATE tenants t
+        SET total_messages = n.cnt, last_activity = n.last_created
+        FROM (
+            SELECT tenant_id, count(*) AS cnt, max(created_at) AS last_created
+            FROM messages
+            GROUP BY tenant_id
+        ) n
+        WHERE t.id = n.tenant_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS trg_messages_tenant_activity ON messages")
+    op.execute("DROP FUNCTION IF EXISTS bump_tenant_activity()")
+    op.execute("ALTER TABLE tenants DROP COLUMN IF EXISTS last_activity")
+    op.execute("ALTER TABLE tenants DROP COLUMN IF EXISTS total_messages")
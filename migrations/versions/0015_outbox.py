@@ -0,0 +1,37 @@
+"""Transactional outbox for RabbitMQ publishes
+
+Revision ID: 0015
+Revises: 0014
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0015'
+down_revision: Union[str, Sequence[str], None] = '0014'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+            queue varchar(100) NOT NULL,
+            payload jsonb NOT NULL,
+            attempts integer NOT NULL DEFAULT 0,
+            created_at timestamp DEFAULT timezone('utc', now())
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_outbox_created_at ON outbox (created_at)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TABLE IF EXISTS outbox")
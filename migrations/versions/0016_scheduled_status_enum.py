@@ -0,0 +1,56 @@
+"""Store scheduled_messages.status as a native scheduled_status enum
+
+Revision ID: 0016
+Revises: 0015
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0016'
+down_revision: Union[str, Sequence[str], None] = '0015'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        DO $$ BEGIN
+            CREATE TYPE scheduled_status AS ENUM (
+                'scheduled', 'processing', 'sent', 'failed', 'permanently_failed', 'cancelled'
+            );
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$
+    """)
+    # The partial index predicate compares varchar literals - rebuild it against the enum.
+    # The type change rewrites the table (and ix_scheduled_tenant_time) under an exclusive lock
+    op.execute("DROP INDEX IF EXISTS ix_scheduled_due_partial")
+    op.execute("ALTER TABLE scheduled_messages ALTER COLUMN status DROP DEFAULT")
+    op.execute(
+        "ALTER TABLE scheduled_messages ALTER COLUMN status TYPE scheduled_status "
+        "USING status::text::scheduled_status"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_scheduled_due_partial ON scheduled_messages (scheduled_at) "
+        "WHERE status IN ('scheduled', 'failed')"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS ix_scheduled_due_partial")
+    op.execute(
+        "ALTER TABLE scheduled_messages ALTER COLUMN status TYPE varchar(20) "
+        "USING status::text"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_scheduled_due_partial ON scheduled_messages (scheduled_at) "
+        "WHERE status IN ('scheduled', 'failed')"
+    )
+    op.execute("DROP TYPE IF EXISTS scheduled_status")
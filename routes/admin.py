@@ -1,39 +1,52 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from database.session import get_db
-from database.models import Tenant, Message
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Float, case, cast, desc, func, select, text, true
+from database.session import get_async_db
+from database.models import Tenant, Message, UTC_NOW, MESSAGE_STATUS_COUNTS_VIEW
+from services.cache import cache_service
 from datetime import datetime, timedelta, date
+from typing import Optional
 from loguru import logger
 
 router = APIRouter()
 
+# Dashboards poll these aggregates; serve repeats from Redis and let the TTL expire them
+ANALYTICS_CACHE_TTL = 120
+
 @router.get("/analytics/daily-growth")
-def daily_growth_analytics(db: Session = Depends(get_db)):
+async def daily_growth_analytics(db: AsyncSession = Depends(get_async_db)):
     """Daily business growth metrics"""
     try:
-        today = datetime.now().date()
+        # Computed once per request; created_at is stored in UTC, so the day boundary is too
+        today = datetime.utcnow().date()
         week_ago = today - timedelta(days=7)
         
-        # Message growth analysis
-        messages_today = db.query(Message).filter(
-            Message.created_at >= today
-        ).count()
-        
-        messages_week_ago = db.query(Message).filter(
-            Message.created_at >= week_ago,
-            Message.created_at < week_ago + timedelta(days=1)
-        ).count()
+        cache_key = f"analytics:daily:{today.isoformat()}"
+        cached = await cache_service.get_json(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Message growth and active tenants in one round-trip: both message counts come
+        # from a single range scan over created_at, the tenant count is a scalar subquery
+        active_tenants = (
+            select(func.count(Tenant.id))
+            .where(Tenant.is_active == True)
+            .scalar_subquery()
+        )
+        messages_today, messages_week_ago, active_today = (await db.execute(
+            select(
+                func.count(Message.id).filter(Message.created_at >= today),
+                func.count(Message.id).filter(Message.created_at < week_ago + timedelta(days=1)),
+                active_tenants
+            ).where(Message.created_at >= week_ago)
+        )).one()
         
         # Weekly growth rate
         weekly_growth = 0
         if messages_week_ago > 0:
             weekly_growth = ((messages_today - messages_week_ago) / messages_week_ago) * 100
         
-        # Active tenants trend
-        active_today = db.query(Tenant).filter(Tenant.is_active == True).count()
-        
-        return {
+        result = {
             "date": today.isoformat(),
             "daily_metrics": {
                 "messages_today": messages_today,
@@ -46,47 +59,80 @@ def daily_growth_analytics(db: Session = Depends(get_db)):
                 "trend": "positive" if weekly_growth > 10 else "stable" if weekly_growth > 0 else "negative"
             }
         }
+        await cache_service.set_json(cache_key, result, ANALYTICS_CACHE_TTL)
+        return result
         
     except Exception as e:
         logger.error(f"Growth analytics error: {e}")
         raise HTTPException(500, "Failed to generate growth analytics")
 
 @router.get("/tenants/engagement")
-def tenant_engagement_metrics(db: Session = Depends(get_db)):
-    """Measure how engaged your tenants are"""
+async def tenant_engagement_metrics(
+    days: Optional[int] = Query(None, ge=1, le=365, description="Activity window in days (default: lifetime)"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Measure how engaged your tenants are - lifetime, or over the last `days` days"""
     try:
-        # Get tenants with their message activity
-        tenants = db.query(
-            Tenant.name,
-            Tenant.created_at,
-            func.count(Message.id).label('total_messages'),
-            func.max(Message.created_at).label('last_activity')
-        ).outerjoin(Message).group_by(Tenant.id, Tenant.name).all()
-        
-        engagement_data = []
-        for tenant in tenants:
-            # Calculate engagement score
-            days_since_join = (datetime.now().date() - tenant.created_at.date()).days
-            messages_per_day = tenant.total_messages / max(days_since_join, 1)
-            
-            # Engagement tiers
-            if messages_per_day > 10:
-                engagement = "high"
-            elif messages_per_day > 3:
-                engagement = "medium" 
-            else:
-                engagement = "low"
-            
-            engagement_data.append({
+        cache_key = f"analytics:engagement:v3:{days or 'all'}:{limit}:{offset}"
+        cached = await cache_service.get_json(cache_key)
+        if cached is not None:
+            return cached
+        
+        days_since_join = func.extract('day', UTC_NOW - Tenant.created_at)
+        query = select(Tenant.name, days_since_join.label('joined_days_ago'))
+        
+        if days is None:
+            # Lifetime: the trigger-maintained counters on tenants - no messages access at all
+            message_count, last_activity = Tenant.total_messages, Tenant.last_activity
+            active_days = days_since_join
+            query = query.select_from(Tenant)
+        else:
+            # Per-tenant LATERAL aggregate over the window: an index range scan on
+            # ix_message_tenant_created per tenant instead of aggregating all messages
+            activity = select(
+                func.count().label('messages'),
+                func.max(Message.created_at).label('last_activity')
+            ).where(
+                Message.tenant_id == Tenant.id,
+                Message.created_at > UTC_NOW - timedelta(days=days)
+            ).lateral('activity')
+            message_count, last_activity = activity.c.messages, activity.c.last_activity
+            active_days = func.least(days_since_join, days)
+            query = query.select_from(Tenant).join(activity, true())
+        
+        # Score, tier and sort in SQL - the DB returns one ready page of rows
+        messages_per_day = (
+            cast(message_count, Float) / func.greatest(active_days, 1)
+        ).label('messages_per_day')
+        
+        tenants = (await db.execute(query.add_columns(
+            message_count.label('total_messages'),
+            messages_per_day,
+            last_activity.label('last_activity'),
+            case(
+                (messages_per_day > 10, 'high'),
+                (messages_per_day > 3, 'medium'),
+                else_='low'
+            ).label('engagement_tier')
+        ).order_by(
+            desc('messages_per_day')
+        ).limit(limit).offset(offset))).all()
+        
+        result = [
+            {
                 "name": tenant.name,
-                "joined_days_ago": days_since_join,
+                "joined_days_ago": int(tenant.joined_days_ago),
                 "total_messages": tenant.total_messages,
-                "messages_per_day": round(messages_per_day, 2),
+                "messages_per_day": round(tenant.messages_per_day, 2),
                 "last_activity": tenant.last_activity.isoformat() if tenant.last_activity else "Never",
-                "engagement_tier": engagement
-            })
-        
-        return sorted(engagement_data, key=lambda x: x['messages_per_day'], reverse=True)
+                "engagement_tier": tenant.engagement_tier
+            }
+            for tenant in tenants
+        ]
+        await cache_service.set_json(cache_key, result, ANALYTICS_CACHE_TTL)
+        return result
         
     except Exception as e:
         logger.error(f"Engagement metrics error: {e}")
@@ -136,14 +182,18 @@ def tenant_engagement_metrics(db: Session = Depends(get_db)):
     #     raise HTTPException(500, "Failed to generate revenue forecast")
 
 @router.get("/performance/message-success")
-def message_success_rates(db: Session = Depends(get_db)):
+async def message_success_rates(db: AsyncSession = Depends(get_async_db)):
     """Analyze message delivery success rates"""
     try:
-        # Get message status distribution
-        status_counts = db.query(
-            Message.status,
-            func.count(Message.id).label('count')
-        ).group_by(Message.status).all()
+        cache_key = "analytics:success:v1"
+        cached = await cache_service.get_json(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Get message status distribution - pre-aggregated, one row per status
+        status_counts = (await db.execute(text(
+            f"SELECT status, cnt FROM {MESSAGE_STATUS_COUNTS_VIEW}"
+        ))).all()
         
         total_messages = sum(count for status, count in status_counts)
         
@@ -157,12 +207,14 @@ def message_success_rates(db: Session = Depends(get_db)):
         # Overall success rate (considering 'sent' as success)
         success_rate = success_rates.get('sent', {}).get('percentage', 0)
         
-        return {
+        result = {
             "total_messages_analyzed": total_messages,
             "success_rate_percentage": success_rate,
             "status_breakdown": success_rates,
             "health_indicator": "excellent" if success_rate > 95 else "good" if success_rate > 85 else "needs_attention"
         }
+        await cache_service.set_json(cache_key, result, ANALYTICS_CACHE_TTL)
+        return result
         
     except Exception as e:
         logger.error(f"Success rates error: {e}")
@@ -1,22 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, BackgroundTasks
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, raiseload
+import base64
+from collections import Counter
+import os
 import secrets
+from typing import List, Optional
 from database.session import get_db
-from database.models import Tenant, WhatsAppAccount, Message
-from services.whatsapp_service import whatsapp_service
-from services.message_queue import rabbitmq_service
+from database.models import Tenant, WhatsAppAccount, Message, OutboxMessage
+from services.outbox import outbox_dispatcher
+from services.account_cache import account_cache, DEFAULT_SCOPE
+from services.cache import cache_service
+from core.security import require_admin
 from loguru import logger
 
 router = APIRouter()
 
+async def get_sender(db: Session) -> dict:
+    """Sender details for the demo tenant - Redis first, one tenant/account JOIN on a miss"""
+    sender = await account_cache.get(DEFAULT_SCOPE)
+    if sender is not None:
+        return sender
+    
+    # The demo tenant and account are seeded once at startup (database/init_db.py).
+    # Sync session - run the query in the threadpool, not on the event loop
+    row = await run_in_threadpool(
+        lambda: db.query(Tenant, WhatsAppAccount).join(
+            WhatsAppAccount, WhatsAppAccount.tenant_id == Tenant.id
+        ).options(raiseload(WhatsAppAccount.tenant)).first()
+    )
+    
+    if not row:
+        raise HTTPException(status_code=400, detail="No tenant with a WhatsApp account configured")
+    
+    tenant, whatsapp_account = row
+    return await account_cache.put(DEFAULT_SCOPE, tenant, whatsapp_account)
+
 @router.post("/tenants/")
 def create_tenant(name: str, db: Session = Depends(get_db)):
     """Create a new tenant (business)"""
     
-    existing_tenant = db.query(Tenant).filter(Tenant.name == name).first()
-    if existing_tenant:
-        raise HTTPException(status_code=400, detail="Name already exists")
-    
     api_key = f"wp_{secrets.token_urlsafe(32)}"
     
     tenant = Tenant(
@@ -25,8 +52,13 @@ def create_tenant(name: str, db: Session = Depends(get_db)):
         api_key=api_key
     )
     
+    # tenants.name is UNIQUE - let the INSERT do the duplicate check in the same round-trip
     db.add(tenant)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Name already exists")
     db.refresh(tenant)
     
     return {
@@ -36,11 +68,74 @@ def create_tenant(name: str, db: Session = Depends(get_db)):
         "message": "Save this API key securely!"
     }
 
+# Upper bound on one /tenants/bulk request
+MAX_BULK_TENANTS = 1000
+
+def _random_chunks(count: int, size: int) -> List[bytes]:
+    """`count` independent random byte strings from a single urandom read"""
+    buffer = os.urandom(count * size)
+    return [buffer[i * size:(i + 1) * size] for i in range(count)]
+
+@router.post("/tenants/bulk", dependencies=[Depends(require_admin)])
+def create_tenants_bulk(names: List[str], db: Session = Depends(get_db)):
+    """Create many tenants in one INSERT (admin only); API keys and HMAC secrets come from one urandom read"""
+    if not names:
+        raise HTTPException(status_code=400, detail="No tenant names given")
+    if len(names) > MAX_BULK_TENANTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_TENANTS} tenants per request")
+    
+    repeated = sorted(name for name, count in Counter(names).items() if count > 1)
+    if repeated:
+        raise HTTPException(status_code=400, detail={"message": "Duplicate names in request", "names": repeated})
+    
+    # tenants.name and the derived email are both UNIQUE - name the rows that would collide
+    emails = {f"{name}@example.com": name for name in names}
+    taken = db.execute(
+        select(Tenant.name, Tenant.email).where(or_(Tenant.name.in_(names), Tenant.email.in_(emails)))
+    ).all()
+    if taken:
+        requested = set(names)
+        conflicts = sorted(
+            {name for name, _ in taken if name in requested} | {emails[email] for _, email in taken if email in emails}
+        )
+        raise HTTPException(status_code=400, detail={"message": "Name already exists", "names": conflicts})
+    
+    # Same formats as the single path: wp_<urlsafe 32 bytes> keys, ASCII-hex HMAC secrets
+    key_bytes = _random_chunks(len(names), 32)
+    secret_bytes = _random_chunks(len(names), 32)
+    rows = [
+        {
+            "name": name,
+            "email": f"{name}@example.com",
+            "api_key": "wp_" + base64.urlsafe_b64encode(key).rstrip(b"=").decode(),
+            "hmac_secret": secret.hex().encode()
+        }
+        for name, key, secret in zip(names, key_bytes, secret_bytes)
+    ]
+    
+    try:
+        created = db.execute(
+            pg_insert(Tenant).values(rows).returning(Tenant.id, Tenant.name, Tenant.api_key)
+        ).all()
+        db.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent insert after the check above
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Name already exists")
+    
+    return {
+        "tenants": [row._asdict() for row in created],
+        "message": "Save these API keys securely!"
+    }
+
 @router.get("/tenants/")
 def list_tenants(db: Session = Depends(get_db)):
     """List all tenants"""
-    tenants = db.query(Tenant).all()
-    return tenants
+    # Project the listed columns only - no ORM objects, and no api_key/hmac_secret in the payload
+    rows = db.execute(
+        select(Tenant.id, Tenant.name, Tenant.is_active, Tenant.created_at)
+    ).all()
+    return ORJSONResponse([row._asdict() for row in rows])
 
 @router.post("/messages/send")
 async def send_message(
@@ -49,213 +144,125 @@ async def send_message(
     db: Session = Depends(get_db)
 ):
     """Send a WhatsApp message (with RabbitMQ queueing)"""
-    logger.info(f"📤 Sending message to {to_number}")
-    
-    # Get or create tenant
-    tenant = db.query(Tenant).first()
-    if not tenant:
-        tenant = Tenant(
-            name="Test Tenant", 
-            email="test@example.com",
-            api_key="test_key"
-        )
-        db.add(tenant)
-        db.commit()
-        db.refresh(tenant)
-    
-    # Get or create WhatsApp account
-    whatsapp_account = db.query(WhatsAppAccount).filter(
-        WhatsAppAccount.tenant_id == tenant.id
-    ).first()
-    
-    if not whatsapp_account:
-        whatsapp_account = WhatsAppAccount(
-            tenant_id=tenant.id,
-            phone_number_id="TEST_PHONE_ID",
-            access_token="TEST_ACCESS_TOKEN", 
-            phone_number="1234567890"
-        )
-        db.add(whatsapp_account)
-        db.commit()
-    
-    # Create message record
-    message_obj = Message(
-        tenant_id=tenant.id,
-        whatsapp_account_id=whatsapp_account.id,
-        from_number=whatsapp_account.phone_number,
-        to_number=to_number,
-        content=message,
-        direction="outbound",
-        status="queued"
-    )
-    db.add(message_obj)
-    db.commit()
-    db.refresh(message_obj)
-    
-    # Prepare message for RabbitMQ
-    queue_message = {
-        "message_id": message_obj.id,
-        "to_number": to_number,
-        "content": message,
-        "tenant_name": tenant.name
-    }
-    
-    # Send to RabbitMQ
-    if rabbitmq_service.is_connected:
-        success = rabbitmq_service.send_message('outgoing_messages', queue_message)
-        if success:
-            logger.success(f"✅ Message queued in RabbitMQ: {message_obj.id}")
-            return {
-                "message_id": message_obj.id,
-                "status": "queued",
-                "queue": "outgoing_messages",
-                "message": "Message queued successfully",
-                "rabbitmq": "connected"
-            }
-    
-    # Fallback: Direct sending (without queue)
-    logger.warning("🔄 RabbitMQ not available, sending directly")
-    result = await whatsapp_service.send_text_message(
-        phone_number_id=whatsapp_account.phone_number_id,
-        access_token=whatsapp_account.access_token,
-        to_number=to_number,
-        message=message
-    )
-    
-    # Update message status
-    if result["success"]:
-        message_obj.status = "sent"
-    else:
-        message_obj.status = "failed"
-    
-    db.commit()
-    
-    return {
-        "message_id": message_obj.id,
-        "status": message_obj.status,
-        "queue": "direct",
-        "rabbitmq": "disconnected",
-        "whatsapp_response": result
-    }
+    return await send_message_handler(to_number, message, db, label="Message")
 
 # ========================
 # SIMPLE AUTO-ENDPOINTS
 # ========================
+# Message bodies for the auto-endpoints, filled with str.format_map - one table to
+# edit (or later load from storage) instead of literals spread over the handlers
+AUTO_MESSAGE_TEMPLATES = {
+    "order_confirm": "✅ Order #{order_id} confirmed!\n📦 Items: {items}\n⏰ Ready in 30 minutes! 🍕",
+    "shipping_update": "🚚 Order #{order_id} shipped!\n📮 Track here: {tracking_url}",
+    "appointment_reminder": "📅 Your {service} appointment is confirmed!\n🕒 Date: {date_time}\n📍 See you soon! 👨‍⚕️",
+}
+
+# POS systems retry aggressively; a repeated Idempotency-Key replays the first response
+IDEMPOTENCY_TTL = 24 * 3600
+
+async def send_idempotent(endpoint: str, idempotency_key: Optional[str], to_number: str, message: str, db: Session):
+    """send_message_handler, short-circuited from Redis when the Idempotency-Key was already seen"""
+    if not idempotency_key:
+        return await send_message_handler(to_number, message, db)
+    
+    cache_key = f"idemp:{DEFAULT_SCOPE}:{endpoint}:{idempotency_key}"
+    
+    # SET NX claims the key before sending, so concurrent retries can't both get through;
+    # the winner then overwrites the placeholder with the real response
+    if not await cache_service.claim(cache_key, IDEMPOTENCY_TTL):
+        cached = await cache_service.get_json(cache_key)
+        if isinstance(cached, dict):
+            logger.info(f"♻️ Replaying {endpoint} response for Idempotency-Key {idempotency_key}")
+            return cached
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    
+    try:
+        response = await send_message_handler(to_number, message, db)
+    except Exception:
+        # Nothing was queued - release the key so the client's retry can go through
+        await cache_service.delete(cache_key)
+        raise
+    await cache_service.set_json(cache_key, response, IDEMPOTENCY_TTL)
+    return response
+
 @router.post("/auto/order-confirm")
-async def auto_order_confirm(customer_phone: str, order_id: str, items: str, db: Session = Depends(get_db)):
+async def auto_order_confirm(
+    customer_phone: str,
+    order_id: str,
+    items: str,
+    idempotency_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
     """Restaurants: Auto-send order confirmation"""
-    # Get tenant
-    tenant = db.query(Tenant).first()
-    
-    message = f"✅ Order #{order_id} confirmed!\n📦 Items: {items}\n⏰ Ready in 30 minutes! 🍕"
+    message = AUTO_MESSAGE_TEMPLATES["order_confirm"].format_map({"order_id": order_id, "items": items})
     
     # Use your existing message sending logic - CALL IT DIRECTLY
-    return await send_message_handler(customer_phone, message, db)
+    return await send_idempotent("order-confirm", idempotency_key, customer_phone, message, db)
 
 @router.post("/auto/shipping-update") 
-async def auto_shipping_update(customer_phone: str, order_id: str, tracking_url: str, db: Session = Depends(get_db)):
+async def auto_shipping_update(
+    customer_phone: str,
+    order_id: str,
+    tracking_url: str,
+    idempotency_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
     """Stores: Auto-send shipping info"""
-    tenant = db.query(Tenant).first()
-    
-    message = f"🚚 Order #{order_id} shipped!\n📮 Track here: {tracking_url}"
-    return await send_message_handler(customer_phone, message, db)
+    message = AUTO_MESSAGE_TEMPLATES["shipping_update"].format_map({"order_id": order_id, "tracking_url": tracking_url})
+    return await send_idempotent("shipping-update", idempotency_key, customer_phone, message, db)
 
 @router.post("/auto/appointment-reminder")
-async def auto_appointment_reminder(customer_phone: str, service: str, date_time: str, db: Session = Depends(get_db)):
+async def auto_appointment_reminder(
+    customer_phone: str,
+    service: str,
+    date_time: str,
+    idempotency_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
     """Clinics: Auto-send appointment reminder"""
-    tenant = db.query(Tenant).first()
-    
-    message = f"📅 Your {service} appointment is confirmed!\n🕒 Date: {date_time}\n📍 See you soon! 👨‍⚕️"
-    return await send_message_handler(customer_phone, message, db)
+    message = AUTO_MESSAGE_TEMPLATES["appointment_reminder"].format_map({"service": service, "date_time": date_time})
+    return await send_idempotent("appointment-reminder", idempotency_key, customer_phone, message, db)
 
-# Helper function to call send_message logic
-async def send_message_handler(to_number: str, message: str, db: Session):
-    """Helper to call send_message logic directly"""
-    logger.info(f"📤 Auto-sending message to {to_number}")
+# Shared send path for /messages/send and the auto-endpoints
+async def send_message_handler(to_number: str, message: str, db: Session, label: str = "Auto-message"):
+    """Record the message and its outbox entry in one transaction"""
+    logger.info(f"📤 Sending {label.lower()} to {to_number}")
     
-    # Get or create tenant
-    tenant = db.query(Tenant).first()
-    if not tenant:
-        tenant = Tenant(
-            name="Test Tenant", 
-            email="test@example.com",
-            api_key="test_key"
-        )
-        db.add(tenant)
-        db.commit()
-        db.refresh(tenant)
-    
-    # Get or create WhatsApp account
-    whatsapp_account = db.query(WhatsAppAccount).filter(
-        WhatsAppAccount.tenant_id == tenant.id
-    ).first()
-    
-    if not whatsapp_account:
-        whatsapp_account = WhatsAppAccount(
-            tenant_id=tenant.id,
-            phone_number_id="TEST_PHONE_ID",
-            access_token="TEST_ACCESS_TOKEN", 
-            phone_number="1234567890"
-        )
-        db.add(whatsapp_account)
-        db.commit()
+    sender = await get_sender(db)
     
     # Create message record
     message_obj = Message(
-        tenant_id=tenant.id,
-        whatsapp_account_id=whatsapp_account.id,
-        from_number=whatsapp_account.phone_number,
+        tenant_id=sender["tenant_id"],
+        whatsapp_account_id=sender["account_id"],
+        from_number=sender["phone_number"],
         to_number=to_number,
         content=message,
         direction="outbound",
         status="queued"
     )
-    db.add(message_obj)
-    db.commit()
-    db.refresh(message_obj)
-    
-    # Prepare message for RabbitMQ
-    queue_message = {
-        "message_id": message_obj.id,
-        "to_number": to_number,
-        "content": message,
-        "tenant_name": tenant.name
-    }
-    
-    # Send to RabbitMQ
-    if rabbitmq_service.is_connected:
-        success = rabbitmq_service.send_message('outgoing_messages', queue_message)
-        if success:
-            logger.success(f"✅ Auto-message queued in RabbitMQ: {message_obj.id}")
-            return {
-                "message_id": message_obj.id,
-                "status": "queued",
-                "queue": "outgoing_messages",
-                "message": "Auto-message queued successfully",
-                "rabbitmq": "connected"
-            }
     
-    # Fallback: Direct sending (without queue)
-    logger.warning("🔄 RabbitMQ not available, sending auto-message directly")
-    result = await whatsapp_service.send_text_message(
-        phone_number_id=whatsapp_account.phone_number_id,
-        access_token=whatsapp_account.access_token,
-        to_number=to_number,
-        message=message
-    )
-    
-    # Update message status
-    if result["success"]:
-        message_obj.status = "sent"
-    else:
-        message_obj.status = "failed"
+    def insert_message():
+        db.add(message_obj)
+        db.flush()
+        message_id = message_obj.id
+        # Same transaction as the message: the outbox dispatcher publishes it to RabbitMQ
+        db.add(OutboxMessage(queue='outgoing_messages', payload={
+            "message_id": message_id,
+            "to_number": to_number,
+            "content": message,
+            "tenant_name": sender["tenant_name"]
+        }))
+        db.commit()
+        return message_id
     
-    db.commit()
+    # Blocking session I/O goes to the threadpool so the event loop keeps serving requests
+    message_id = await run_in_threadpool(insert_message)
+    outbox_dispatcher.notify()
     
+    logger.success(f"✅ {label} queued: {message_id}")
     return {
-        "message_id": message_obj.id,
-        "status": message_obj.status,
-        "queue": "direct",
-        "rabbitmq": "disconnected",
-        "whatsapp_response": result
+        "message_id": message_id,
+        "status": "queued",
+        "queue": "outgoing_messages",
+        "message": f"{label} queued successfully"
     }
\ No newline at end of file
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Request, HTTPException, BackgroundTasks, Query
+from fastapi import APIRouter, Depends, Request, HTTPException, BackgroundTasks, Query
 from pydantic import BaseModel
-from database.session import SessionLocal
-from database.models import Message, Tenant, WhatsAppAccount
-from services.message_queue import rabbitmq_service
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import raiseload
+from database.session import get_async_db
+from database.models import Message, OutboxMessage, Tenant, WhatsAppAccount
+from services.outbox import outbox_dispatcher
+from services.account_cache import account_cache
 from middleware.rate_limiter import check_rate_limit
 import time
 import logging
@@ -22,30 +26,37 @@ async def send_message(
     to_number: str = Query(..., description="Recipient phone number"),
     message: str = Query(..., description="Message content"),
     message_type: str = Query("text", description="Type of message"),
-    template_name: Optional[str] = Query(None, description="Template name if using template")
+    template_name: Optional[str] = Query(None, description="Template name if using template"),
+    db: AsyncSession = Depends(get_async_db)
 ):
     tenant = request.state.tenant
     
     # Check rate limits
-    if not await check_rate_limit(tenant.id):
+    if not await check_rate_limit(tenant.id, tenant.rate_limit_per_minute):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
     
-    db = SessionLocal()
     try:
-        # Get tenant's WhatsApp account
-        whatsapp_account = db.query(WhatsAppAccount).filter(
-            WhatsAppAccount.tenant_id == tenant.id,
-            WhatsAppAccount.is_active == True
-        ).first()
-        
-        if not whatsapp_account:
-            raise HTTPException(status_code=400, detail="No active WhatsApp account configured")
+        # Get tenant's WhatsApp account - Redis first, DB only on a miss
+        sender = await account_cache.get(tenant.id)
+        if sender is None:
+            # The tenant is already on request.state - skip the joined load
+            whatsapp_account = await db.scalar(
+                select(WhatsAppAccount)
+                .options(raiseload("*"))
+                .where(WhatsAppAccount.tenant_id == tenant.id, WhatsAppAccount.is_active == True)
+                .limit(1)
+            )
+            
+            if not whatsapp_account:
+                raise HTTPException(status_code=400, detail="No active WhatsApp account configured")
+            
+            sender = await account_cache.put(tenant.id, tenant, whatsapp_account)
         
         # Create message record
         message_record = Message(
             tenant_id=tenant.id,
-            whatsapp_account_id=whatsapp_account.id,
-            from_number=whatsapp_account.phone_number or "unknown",
+            whatsapp_account_id=sender["account_id"],
+            from_number=sender["phone_number"] or "unknown",
             to_number=to_number,
             content=message,
             message_type=message_type,
@@ -54,21 +65,22 @@ async def send_message(
             template_name=template_name
         )
         
+        # The id comes back via RETURNING on the INSERT; no refresh round-trip
         db.add(message_record)
-        db.commit()
-        db.refresh(message_record)
+        await db.flush()
         
-        # Queue message for processing
-        queue_data = {
+        # Queue message for processing - the outbox row commits atomically with the
+        # message, and the outbox dispatcher publishes it to RabbitMQ
+        db.add(OutboxMessage(queue='outgoing_messages', payload={
             "message_id": message_record.id,
             "tenant_id": tenant.id,
-            "whatsapp_account_id": whatsapp_account.id,
+            "whatsapp_account_id": sender["account_id"],
             "to_number": to_number,
             "content": message,
             "message_type": message_type
-        }
-        
-        rabbitmq_service.send_message('outgoing_messages', queue_data)
+        }))
+        await db.commit()
+        outbox_dispatcher.notify()
         
         logger.info(f"📨 Message queued for tenant {tenant.name}: {message_record.id}")
         
@@ -81,8 +93,6 @@ async def send_message(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Message sending failed for tenant {tenant.id}: {e}")
-        raise HTTPException(status_code=500, detail="Message sending failed")
-    finally:
-        db.close()
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Message sending failed")
\ No newline at end of file
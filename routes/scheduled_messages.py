@@ -1,10 +1,17 @@
 # routes/scheduled_messages.py
-from fastapi import APIRouter, Request, HTTPException, Header, Query
+from fastapi import APIRouter, Depends, Request, HTTPException, Header, Query
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from datetime import datetime
-from database.session import SessionLocal
-from database.models import ScheduledMessage, Tenant, WhatsAppAccount
-from typing import Optional
+from datetime import datetime, timezone
+from sqlalchemy import func, literal, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.session import get_async_db
+from database.models import ScheduledMessage, ScheduledStatus, Tenant, WhatsAppAccount
+from services.scheduler import SCHEDULER_WAKE_CHANNEL
+from typing import List, Optional
+from uuid import UUID
+import ciso8601
 import logging
 
 router = APIRouter()
@@ -17,6 +24,21 @@ class ScheduledMessageResponse(BaseModel):
     status: str
     scheduled_at: str
 
+class ScheduleMessageItem(BaseModel):
+    to: str
+    message: str
+    scheduled_at: str
+    timezone: str = "UTC"
+    message_type: str = "text"
+
+class BulkScheduleResponse(BaseModel):
+    scheduled_message_ids: List[str]
+    status: str
+    count: int
+
+# Upper bound on one /schedule/bulk request - keeps a single INSERT reasonably sized
+MAX_BULK_SCHEDULE = 1000
+
 # ------------------ UTILITIES ------------------
 
 def get_tenant_from_request(request: Request):
@@ -34,6 +56,45 @@ def get_tenant_from_request(request: Request):
     logger.debug(f"✅ Tenant retrieved from request.state: {tenant.id} - {tenant.name}")
     return tenant
 
+def parse_scheduled_time(scheduled_at: str) -> datetime:
+    """Parse an ISO timestamp and require it to be in the future."""
+    try:
+        # C parser; a trailing 'Z' or an offset gives an aware datetime
+        scheduled_time = ciso8601.parse_datetime(scheduled_at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid datetime format. Use ISO format: YYYY-MM-DDTHH:MM:SS")
+
+    # scheduled_at is stored as naive UTC
+    if scheduled_time.tzinfo:
+        scheduled_time = scheduled_time.astimezone(timezone.utc).replace(tzinfo=None)
+
+    if scheduled_time <= datetime.utcnow():
+        raise HTTPException(status_code=400, detail="Scheduled time must be in the future")
+
+    return scheduled_time
+
+async def get_active_account_id(db: AsyncSession, tenant_id: str) -> str:
+    """Id of the tenant's active WhatsApp account; 400 if none is configured."""
+    account_id = await db.scalar(
+        select(WhatsAppAccount.id)
+        .where(WhatsAppAccount.tenant_id == tenant_id, WhatsAppAccount.is_active == True)
+        .limit(1)
+    )
+    if not account_id:
+        raise HTTPException(status_code=400, detail="No active WhatsApp account configured")
+    return account_id
+
+async def insert_scheduled_messages(db: AsyncSession, rows: List[dict]) -> List[str]:
+    """One multi-row INSERT ... RETURNING id for any number of scheduled messages."""
+    result = await db.execute(
+        pg_insert(ScheduledMessage).values(rows).returning(ScheduledMessage.id)
+    )
+    ids = [str(message_id) for message_id in result.scalars().all()]
+    # Delivered on commit - idle schedulers pick the new rows up without waiting out their backoff
+    await db.execute(select(func.pg_notify(SCHEDULER_WAKE_CHANNEL, "")))
+    await db.commit()
+    return ids
+
 # ------------------ ROUTES ------------------
 
 @router.post("/schedule", response_model=ScheduledMessageResponse)
@@ -45,131 +106,185 @@ async def schedule_message(
     scheduled_at: str = Query(..., description="Scheduled time in ISO format (e.g., 2024-01-01T14:30:00)"),
     timezone: str = Query("UTC", description="Timezone for the scheduled time"),
     message_type: str = Query("text", description="Type of message (text, template, etc.)"),
-    x_tenant_id: str = Header(None)  # ✅ Add header support for Swagger
+    x_tenant_id: str = Header(None),  # ✅ Add header support for Swagger
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Schedule a message for future delivery."""
     logger.debug(f"🚀 Schedule message endpoint called (Tenant header: {x_tenant_id})")
 
     tenant = get_tenant_from_request(request)
-    db = SessionLocal()
     try:
-        # Parse scheduled time
-        try:
-            scheduled_time = datetime.fromisoformat(scheduled_at.replace('Z', '+00:00'))
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid datetime format. Use ISO format: YYYY-MM-DDTHH:MM:SS")
-
-        # Validate scheduled time
-        if scheduled_time <= datetime.utcnow():
-            raise HTTPException(status_code=400, detail="Scheduled time must be in the future")
+        scheduled_time = parse_scheduled_time(scheduled_at)
 
         # Get tenant's active WhatsApp account
-        whatsapp_account = db.query(WhatsAppAccount).filter(
-            WhatsAppAccount.tenant_id == tenant.id,
-            WhatsAppAccount.is_active == True
-        ).first()
-
-        if not whatsapp_account:
-            raise HTTPException(status_code=400, detail="No active WhatsApp account configured")
-
-        # Create scheduled message
-        scheduled_message = ScheduledMessage(
-            tenant_id=tenant.id,
-            whatsapp_account_id=whatsapp_account.id,
-            to_number=to,
-            message=message,
-            message_type=message_type,
-            scheduled_at=scheduled_time,
-            timezone=timezone,
-            status="scheduled"
+        whatsapp_account_id = await get_active_account_id(db, tenant.id)
+
+        # Create scheduled message - the id comes back from the INSERT itself
+        [scheduled_message_id] = await insert_scheduled_messages(db, [{
+            "tenant_id": tenant.id,
+            "whatsapp_account_id": whatsapp_account_id,
+            "to_number": to,
+            "message": message,
+            "message_type": message_type,
+            "scheduled_at": scheduled_time,
+            "timezone": timezone,
+            "status": ScheduledStatus.SCHEDULED
+        }])
+
+        logger.info(f"📅 Message scheduled for {scheduled_time}: {scheduled_message_id} for tenant {tenant.id}")
+
+        return ScheduledMessageResponse(
+            scheduled_message_id=scheduled_message_id,
+            status="scheduled",
+            scheduled_at=scheduled_time.isoformat()
         )
 
-        db.add(scheduled_message)
-        db.commit()
-        db.refresh(scheduled_message)
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"❌ Scheduling failed for tenant {tenant.id}: {e}")
+        raise HTTPException(status_code=500, detail="Message scheduling failed")
 
-        logger.info(f"📅 Message scheduled for {scheduled_time}: {scheduled_message.id} for tenant {tenant.id}")
+@router.post("/schedule/bulk", response_model=BulkScheduleResponse)
+async def schedule_messages_bulk(
+    request: Request,
+    items: List[ScheduleMessageItem],
+    x_tenant_id: str = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Schedule many messages in a single INSERT."""
+    tenant = get_tenant_from_request(request)
 
-        return ScheduledMessageResponse(
-            scheduled_message_id=str(scheduled_message.id),
+    if not items:
+        raise HTTPException(status_code=400, detail="No messages to schedule")
+    if len(items) > MAX_BULK_SCHEDULE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_SCHEDULE} messages per request")
+
+    try:
+        whatsapp_account_id = await get_active_account_id(db, tenant.id)
+
+        rows = [
+            {
+                "tenant_id": tenant.id,
+                "whatsapp_account_id": whatsapp_account_id,
+                "to_number": item.to,
+                "message": item.message,
+                "message_type": item.message_type,
+                "scheduled_at": parse_scheduled_time(item.scheduled_at),
+                "timezone": item.timezone,
+                "status": ScheduledStatus.SCHEDULED
+            }
+            for item in items
+        ]
+        scheduled_message_ids = await insert_scheduled_messages(db, rows)
+
+        logger.info(f"📅 {len(scheduled_message_ids)} messages scheduled for tenant {tenant.id}")
+
+        return BulkScheduleResponse(
+            scheduled_message_ids=scheduled_message_ids,
             status="scheduled",
-            scheduled_at=scheduled_message.scheduled_at.isoformat()
+            count=len(scheduled_message_ids)
         )
 
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
-        logger.error(f"❌ Scheduling failed for tenant {tenant.id}: {e}")
+        await db.rollback()
+        logger.error(f"❌ Bulk scheduling failed for tenant {tenant.id}: {e}")
         raise HTTPException(status_code=500, detail="Message scheduling failed")
-    finally:
-        db.close()
+
+def scheduled_page_query(tenant_id: str, after: Optional[datetime], after_id: Optional[UUID], limit: int):
+    """Keyset page over (scheduled_at, id) - id breaks ties so equal times aren't skipped."""
+    query = (
+        select(
+            ScheduledMessage.id,
+            ScheduledMessage.to_number,
+            ScheduledMessage.message,
+            ScheduledMessage.scheduled_at,
+            ScheduledMessage.status,
+            ScheduledMessage.attempts,
+            ScheduledMessage.sent_at
+        )
+        .where(ScheduledMessage.tenant_id == tenant_id)
+        .order_by(ScheduledMessage.scheduled_at.asc(), ScheduledMessage.id.asc())
+        .limit(limit)
+    )
+    if after is not None:
+        if after_id is not None:
+            # Bound with the column's uuid type - a varchar bind has no uuid comparison operator
+            query = query.where(
+                tuple_(ScheduledMessage.scheduled_at, ScheduledMessage.id)
+                > tuple_(after, literal(str(after_id), ScheduledMessage.id.type))
+            )
+        else:
+            query = query.where(ScheduledMessage.scheduled_at > after)
+    return query
 
 # ------------------ GET ROUTE ------------------
 
 @router.get("/scheduled")
 async def get_scheduled_messages(
     request: Request,
-    x_tenant_id: str = Header(None)  # ✅ Added here too
+    after: Optional[datetime] = Query(None, description="Cursor: scheduled_at of the last message already seen"),
+    after_id: Optional[UUID] = Query(None, description="Cursor: id of the last message already seen"),
+    limit: int = Query(100, ge=1, le=500),
+    x_tenant_id: str = Header(None),  # ✅ Added here too
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Retrieve all scheduled messages for the current tenant."""
+    """Retrieve the current tenant's scheduled messages, one keyset page at a time."""
     tenant = get_tenant_from_request(request)
-    db = SessionLocal()
 
     try:
-        messages = db.query(ScheduledMessage).filter(
-            ScheduledMessage.tenant_id == tenant.id
-        ).order_by(ScheduledMessage.scheduled_at.asc()).all()
+        query = scheduled_page_query(tenant.id, after, after_id, limit)
+
+        # Plain rows of the serialized columns - no identity map / ORM instances
+        messages = (await db.execute(query)).all()
 
         logger.debug(f"📋 Retrieved {len(messages)} scheduled messages for tenant {tenant.id}")
 
-        return {
-            "scheduled_messages": [
-                {
-                    "id": str(msg.id),
-                    "to_number": msg.to_number,
-                    "message": msg.message,
-                    "scheduled_at": msg.scheduled_at.isoformat(),
-                    "status": msg.status,
-                    "attempts": msg.attempts,
-                    "sent_at": msg.sent_at.isoformat() if msg.sent_at else None
-                }
-                for msg in messages
-            ]
-        }
+        # Rows go straight to orjson (datetimes included) - skips FastAPI's jsonable_encoder pass
+        return ORJSONResponse({
+            "scheduled_messages": [msg._asdict() for msg in messages],
+            # Pass back as ?after=...&after_id=... for the next page; null on the last page
+            "next_cursor": {
+                "after": messages[-1].scheduled_at.isoformat(),
+                "after_id": str(messages[-1].id)
+            } if len(messages) == limit else None
+        })
 
     except Exception as e:
         logger.error(f"❌ Failed to fetch scheduled messages for tenant {tenant.id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch scheduled messages")
-    finally:
-        db.close()
 
 # ------------------ DELETE ROUTE ------------------
 
 @router.delete("/scheduled/{message_id}")
 async def cancel_scheduled_message(
     request: Request,
-    message_id: str,
-    x_tenant_id: str = Header(None)  # ✅ Added here too
+    message_id: UUID,  # malformed ids are rejected with 422 before touching the uuid column
+    x_tenant_id: str = Header(None),  # ✅ Added here too
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Cancel a scheduled message."""
     tenant = get_tenant_from_request(request)
-    db = SessionLocal()
 
     try:
-        message = db.query(ScheduledMessage).filter(
-            ScheduledMessage.id == message_id,
-            ScheduledMessage.tenant_id == tenant.id
-        ).first()
+        message = await db.scalar(
+            select(ScheduledMessage).where(
+                ScheduledMessage.id == str(message_id),
+                ScheduledMessage.tenant_id == tenant.id
+            )
+        )
 
         if not message:
             raise HTTPException(status_code=404, detail="Scheduled message not found")
 
-        if message.status != "scheduled":
+        if message.status != ScheduledStatus.SCHEDULED:
             raise HTTPException(status_code=400, detail="Only scheduled messages can be cancelled")
 
-        message.status = "cancelled"
-        db.commit()
+        message.status = ScheduledStatus.CANCELLED
+        await db.commit()
 
         logger.info(f"❌ Scheduled message cancelled: {message_id} for tenant {tenant.id}")
 
@@ -178,8 +293,6 @@ async def cancel_scheduled_message(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"❌ Failed to cancel message {message_id} for tenant {tenant.id}: {e}")
-        raise HTTPException(status_code=500, detail="Failed to cancel scheduled message")
-    finally:
-        db.close()
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to cancel scheduled message")
\ No newline at end of file
@@ -1,29 +1,75 @@
 # routes/templates.py
+import time
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database.session import get_db
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.session import get_async_db
 from database.models import MessageTemplate, Tenant
+from services.cache import cache_service
 
 router = APIRouter()
 
+# QUICK FIX tenant: the first tenant row barely ever changes, re-read it at most every 5 minutes
+DEFAULT_TENANT_TTL_SECONDS = 300
+_default_tenant_cache = {"id": None, "expires": 0.0}
+
+async def _default_tenant_id(db: AsyncSession) -> Optional[str]:
+    """Id of the first tenant, cached in-process for DEFAULT_TENANT_TTL_SECONDS"""
+    now = time.monotonic()
+    if _default_tenant_cache["id"] is not None and now < _default_tenant_cache["expires"]:
+        return _default_tenant_cache["id"]
+    
+    tenant_id = await db.scalar(select(Tenant.id).limit(1))
+    _default_tenant_cache["id"] = tenant_id
+    _default_tenant_cache["expires"] = now + DEFAULT_TENANT_TTL_SECONDS
+    return tenant_id
+
+# Tenant-scoped template lists are served from Redis; creating a template drops the entry
+TEMPLATE_LIST_TTL = 60
+
+# Listed fields - tenant_id is implied by the caller
+TEMPLATE_LIST_COLUMNS = (
+    MessageTemplate.id,
+    MessageTemplate.name,
+    MessageTemplate.category,
+    MessageTemplate.language,
+    MessageTemplate.status,
+    MessageTemplate.header,
+    MessageTemplate.body,
+    MessageTemplate.footer,
+    MessageTemplate.buttons,
+    MessageTemplate.meta_template_id,
+    MessageTemplate.created_at,
+)
+
+def _template_list_key(tenant_id: str) -> str:
+    return f"templates:v2:{tenant_id}"
+
+@event.listens_for(Tenant, "after_delete")
+def _invalidate_default_tenant(mapper, connection, target):
+    if target.id == _default_tenant_cache["id"]:
+        _default_tenant_cache["id"] = None
+
 @router.post("/templates/")
-def create_template(
+async def create_template(
     name: str,
     category: str,
     body: str,
     header: str = None,
     footer: str = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new message template"""
     try:
         # QUICK FIX: Get first tenant from database
-        tenant = db.query(Tenant).first()
-        if not tenant:
+        tenant_id = await _default_tenant_id(db)
+        if not tenant_id:
             raise HTTPException(status_code=400, detail="No tenant found")
         
         template = MessageTemplate(
-            tenant_id=tenant.id,
+            tenant_id=tenant_id,
             name=name,
             category=category,
             header=header,
@@ -33,22 +79,36 @@ def create_template(
         )
         
         db.add(template)
-        db.commit()
-        db.refresh(template)
+        # id comes back via RETURNING at flush; expire_on_commit=False keeps it readable
+        await db.commit()
+        await cache_service.delete(_template_list_key(tenant_id))
         
         return {"message": "Template created", "template_id": template.id}
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         # This will show us the actual error
         print(f"❌ Template creation error: {e}")
         raise HTTPException(status_code=400, detail=f"Template creation failed: {str(e)}")
 
 @router.get("/templates/")
-def list_templates(db: Session = Depends(get_db)):
+async def list_templates(db: AsyncSession = Depends(get_async_db)):
     """List all templates"""
-    tenant = db.query(Tenant).first()
-    if not tenant:
+    tenant_id = await _default_tenant_id(db)
+    if not tenant_id:
         return []
     
-    return db.query(MessageTemplate).filter(MessageTemplate.tenant_id == tenant.id).all()
\ No newline at end of file
+    cache_key = _template_list_key(tenant_id)
+    cached = await cache_service.get_json(cache_key)
+    if cached is not None:
+        return cached
+    
+    # Plain column rows, fetched from the cursor in chunks - no ORM identity map per template
+    result = await db.stream(
+        select(*TEMPLATE_LIST_COLUMNS)
+        .where(MessageTemplate.tenant_id == tenant_id)
+        .execution_options(yield_per=500)
+    )
+    templates = [dict(row) async for row in result.mappings()]
+    await cache_service.set_json(cache_key, templates, TEMPLATE_LIST_TTL)
+    return ORJSONResponse(templates)
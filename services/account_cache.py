@@ -0,0 +1,137 @@
+import asyncio
+import base64
+import hashlib
+from typing import Iterable, Optional
+import redis as sync_redis
+from cryptography.fernet import Fernet, InvalidToken
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+from loguru import logger
+from core.config import settings
+from database.session import AsyncSessionLocal
+from database.models import Tenant, WhatsAppAccount
+from services.cache import cache_service
+
+# Account credentials change rarely; mutations below delete the entry right away
+ACCOUNT_CACHE_TTL = 3600
+
+# Cache scope for the single-tenant demo endpoints in routes/clients.py
+DEFAULT_SCOPE = "default"
+
+# Session.info key collecting the tenants whose entries a transaction invalidates
+_PENDING_SCOPES = "account_cache_scopes"
+
+class AccountCache:
+    """
+    Redis cache of the sender details for a tenant (tenant name + active WhatsApp
+    account), so a send skips the tenant/account SELECTs. The access token is
+    Fernet-encrypted before it leaves the process
+    """
+
+    def __init__(self, ttl: int = ACCOUNT_CACHE_TTL):
+        self.ttl = ttl
+        self._fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(settings.SECRET_KEY.encode()).digest()))
+        # Eviction tasks scheduled from commit hooks, referenced until they finish
+        self._evictions: set = set()
+        # Sync sessions commit in the threadpool, off the event loop - those evict
+        # through a plain client
+        self._sync_client = sync_redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT
+        )
+        logger.info("Account cache initialized")
+
+    @staticmethod
+    def key(scope: str) -> str:
+        return f"tenant:{scope}:wa"
+
+    async def get(self, scope: str) -> Optional[dict]:
+        sender = await cache_service.get_json(self.key(scope))
+        if sender is None:
+            return None
+        try:
+            sender["access_token"] = self._fernet.decrypt(sender["access_token"].encode()).decode()
+        except (InvalidToken, KeyError):
+            # Written under another SECRET_KEY - treat as a miss
+            return None
+        return sender
+
+    async def put(self, scope: str, tenant: Tenant, account: WhatsAppAccount) -> dict:
+        sender = {
+            "tenant_id": tenant.id,
+            "tenant_name": tenant.name,
+            "account_id": account.id,
+            "phone_number_id": account.phone_number_id,
+            "phone_number": account.phone_number,
+            "access_token": account.access_token
+        }
+        await cache_service.set_json(
+            self.key(scope),
+            {**sender, "access_token": self._fernet.encrypt(account.access_token.encode()).decode()},
+            self.ttl
+        )
+        return sender
+
+    async def resolve(self, tenant_id: str) -> Optional[dict]:
+        """Sender for a tenant - Redis first, one tenant/account JOIN on a miss; None without an active account"""
+        sender = await self.get(tenant_id)
+        if sender is not None:
+            return sender
+        
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(
+                select(Tenant, WhatsAppAccount)
+                .join(WhatsAppAccount, WhatsAppAccount.tenant_id == Tenant.id)
+                .where(Tenant.id == tenant_id, WhatsAppAccount.is_active == True)
+                .limit(1)
+            )).first()
+        if row is None:
+            return None
+        return await self.put(tenant_id, *row)
+    
+    async def evict(self, *tenant_ids: str):
+        """Drop tenants' entries from async code, e.g. after the Graph API rejected a token"""
+        await cache_service.delete(*map(self.key, tenant_ids), self.key(DEFAULT_SCOPE))
+    
+    def invalidate(self, tenant_ids: Iterable[str]):
+        """Drop entries after a commit: in the background on the event loop (an AsyncSession
+        commit runs there), inline from a threadpool sync session"""
+        tenant_ids = tuple(tenant_ids)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        
+        if loop is not None:
+            task = loop.create_task(self.evict(*tenant_ids))
+            self._evictions.add(task)
+            task.add_done_callback(self._evictions.discard)
+            return
+        
+        try:
+            self._sync_client.delete(*map(self.key, tenant_ids), self.key(DEFAULT_SCOPE))
+        except Exception as e:
+            logger.warning(f"⚠️ Account cache invalidation failed for tenants {tenant_ids}: {e}")
+
+# Global instance
+account_cache = AccountCache()
+
+@event.listens_for(WhatsAppAccount, "after_insert")
+@event.listens_for(WhatsAppAccount, "after_update")
+@event.listens_for(WhatsAppAccount, "after_delete")
+@event.listens_for(Tenant, "after_update")
+@event.listens_for(Tenant, "after_delete")
+def _collect_account_scope(mapper, connection, target):
+    # Runs inside the flush - only note the tenant; Redis is touched once the commit lands
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING_SCOPES, set()).add(
+            target.tenant_id if isinstance(target, WhatsAppAccount) else target.id
+        )
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_scopes(session):
+    scopes = session.info.pop(_PENDING_SCOPES, None)
+    if scopes:
+        account_cache.invalidate(scopes)
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime
+from typing import Optional
+from loguru import logger
+from database.session import async_engine
+from database.models import APILog
+
+# Bounded columns - values are cut at write time so one oversized header can't fail a batch
+_LENGTH_LIMITS = {
+    column.name: column.type.length
+    for column in APILog.__table__.columns
+    if getattr(column.type, "length", None)
+}
+
+class APILogWriter:
+    """
+    Buffers APILog rows in memory and writes them in batches from a background task,
+    so request handling never waits on the log INSERT/COMMIT
+    """
+
+    def __init__(self, batch_size: int = 500, flush_interval: float = 0.1, max_pending: int = 10_000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.task: Optional[asyncio.Task] = None
+        logger.info("API log writer initialized")
+
+    def log(self, **row):
+        """Enqueue one APILog row (column name -> value); never blocks the caller"""
+        row.setdefault("created_at", datetime.utcnow())
+        for name, limit in _LENGTH_LIMITS.items():
+            value = row.get(name)
+            if isinstance(value, str) and len(value) > limit:
+                row[name] = value[:limit]
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            logger.warning("⚠️ API log buffer full, dropping entry")
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the writer and flush whatever is still buffered"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        batch = []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            await self._write(batch)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch.append(await self.queue.get())
+                deadline = loop.time() + self.flush_interval
+
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+
+                pending, batch = batch, []
+                await self._write(pending)
+        except asyncio.CancelledError:
+            # Shutdown while a batch was being collected - don't drop it
+            if batch:
+                await self._write(batch)
+            raise
+
+    async def _write(self, batch: list):
+        try:
+            # Core executemany on a bare connection - no ORM unit of work for plain log rows
+            async with async_engine.begin() as conn:
+                await conn.execute(APILog.__table__.insert(), batch)
+        except Exception as e:
+            logger.error(f"❌ Failed to write {len(batch)} API logs: {e}")
+
+# Global instance
+api_log_writer = APILogWriter()
@@ -0,0 +1,198 @@
+import asyncio
+import re
+from loguru import logger
+from services.cache import cache_service
+from services.whatsapp_service import whatsapp_service, DEFAULT_PHONE_NUMBER_ID, DEFAULT_ACCESS_TOKEN
+
+try:
+    import ahocorasick
+except ImportError:  # optional C extension - generate_smart_reply falls back to one compiled regex
+    ahocorasick = None
+
+# Meta retries a webhook for up to ~a day; remember handled message ids that long
+WEBHOOK_DEDUP_TTL = 24 * 3600
+
+# Graph API sends in flight at once across all webhook batches in this process
+AUTO_REPLY_CONCURRENCY = 50
+_send_slots = asyncio.Semaphore(AUTO_REPLY_CONCURRENCY)
+
+async def process_incoming_message(message_data: dict):
+    """Process incoming WhatsApp messages with smart replies (runs in the incoming_messages consumer)"""
+    try:
+        # Replies are collected and sent together below, not one Graph API round-trip at a time
+        replies = []
+        entries = message_data.get('entry', [])
+        
+        for entry in entries:
+            changes = entry.get('changes', [])
+            
+            for change in changes:
+                value = change.get('value', {})
+                messages = value.get('messages', [])
+                
+                for message in messages:
+                    # Meta redelivers the same webhook (hours later, too) - handle each wamid once
+                    message_id = message.get('id')
+                    if message_id and not await cache_service.claim(f"wa:msg:{message_id}", WEBHOOK_DEDUP_TTL):
+                        logger.info(f"♻️ Duplicate webhook message {message_id}, skipping")
+                        continue
+                    
+                    from_number = message.get('from')
+                    
+                    # Handle different message types
+                    if 'text' in message:
+                        # generate_smart_reply lowercases once itself
+                        message_text = message.get('text', {}).get('body', '')
+                        logger.info(f"💬 Received from {from_number}: {message_text}")
+                        
+                        # SMART AUTO-REPLY BASED ON CONTENT
+                        auto_reply = generate_smart_reply(message_text)
+                        replies.append(send_whatsapp_message(from_number, auto_reply))
+                    
+                    elif 'image' in message:
+                        image_id = message.get('image', {}).get('id')
+                        logger.info(f"🖼️ Received image from {from_number}")
+                        replies.append(send_whatsapp_message(from_number, "Thanks for the image! 📸 I'll share it with our team."))
+                    
+                    elif 'audio' in message:
+                        audio_id = message.get('audio', {}).get('id')
+                        logger.info(f"🎵 Received audio from {from_number}")
+                        replies.append(send_whatsapp_message(from_number, "Got your voice message! 🎤 Our team will listen and respond shortly."))
+                    
+                    elif 'document' in message:
+                        doc_id = message.get('document', {}).get('id')
+                        logger.info(f"📄 Received document from {from_number}")
+                        replies.append(send_whatsapp_message(from_number, "Thanks for the document! 📁 We've received it."))
+                    
+                    elif 'video' in message:
+                        video_id = message.get('video', {}).get('id')
+                        logger.info(f"🎥 Received video from {from_number}")
+                        replies.append(send_whatsapp_message(from_number, "Thanks for the video! 🎬 We'll review it."))
+                    
+                    else:
+                        logger.info(f"📱 Received message from {from_number}")
+                        replies.append(send_whatsapp_message(from_number, "Thanks for your message! Our team will respond shortly. 👍"))
+        
+        if replies:
+            await asyncio.gather(*replies, return_exceptions=True)
+                        
+    except Exception as e:
+        logger.error(f"❌ Error processing incoming message: {e}")
+
+# Keyword groups in priority order - the first group with a keyword anywhere in the
+# lowercased text wins, exactly like the if/elif chain this table replaced
+SMART_REPLIES = (
+    # GREETINGS & BASIC
+    (('hi', 'hello', 'hey', 'hola', 'namaste', 'hlo'), "Hello! 👋 Thanks for reaching out. How can I help you today?"),
+    (('good morning', 'gm', 'gud mrng'), "Good morning! ☀️ How can I assist you today?"),
+    (('good afternoon',), "Good afternoon! 🌞 What can I help you with?"),
+    (('good evening', 'good night', 'gn'), "Good evening! 🌙 How can I help you?"),
+    # ORDERS & DELIVERY
+    (('status', 'track', 'where is', 'when', 'delivery'), "To check your order status, please share your order number. I'll look it up for you! 📦"),
+    (('order', 'booking', 'reservation'), "For order assistance, please share your order number or booking details. I'll check it right away! 📋"),
+    (('cancel', 'cancellation'), "I can help with cancellations! Please share your order number and we'll process it. ❌"),
+    (('return', 'refund'), "For returns/refunds, please share your order details. We'll guide you through the process! 🔄"),
+    (('late', 'delay', 'not received'), "I'm sorry for the delay! 🕒 Please share your order number so I can check the status immediately."),
+    # PRICING & PAYMENTS
+    (('price', 'cost', 'how much', 'rate', 'charges'), "I'd be happy to help with pricing! 💰 Could you let me know which product or service you're interested in?"),
+    (('discount', 'offer', 'coupon', 'promo'), "We have various offers available! 🎁 Please visit our website or let me know what you're looking for."),
+    (('payment', 'pay', 'bill', 'invoice'), "For payment assistance, please share your order number. I'll check your invoice! 💳"),
+    # SUPPORT & HELP
+    (('help', 'support', 'problem', 'issue'), "I'm here to help! 🛠️ Please describe your issue and I'll connect you with our support team."),
+    (('complaint', 'wrong', 'bad', 'not working', 'broken'), "I'm sorry you're having issues! 😔 Please share details and we'll resolve it immediately."),
+    (('urgent', 'emergency', 'asap', 'important'), "I understand this is urgent! ⚡ Please share details and we'll prioritize your request."),
+    # BUSINESS INFO
+    (('time', 'hour', 'open', 'close', 'timing'), "We're open Monday-Friday 9AM-6PM and Saturday 10AM-4PM. 🕘 How can we assist you?"),
+    (('where', 'location', 'address', 'place'), "We're located at 123 Business Street, City. 🗺️ Would you like directions or more location details?"),
+    (('contact', 'phone', 'number', 'call'), "You can reach us at +1-234-567-8900 📞 or email support@business.com. How can we help?"),
+    (('website', 'online', 'portal'), "Visit our website at www.business.com 🌐 for more information. How else can I assist?"),
+    # PRODUCTS & SERVICES
+    (('product', 'item', 'menu', 'catalog', 'service'), "I can help you browse our products/services! 🛍️ What are you looking for specifically?"),
+    (('available', 'stock', 'in stock'), "I can check availability for you! Please let me know which product you're interested in. 📊"),
+    (('feature', 'specification', 'detail'), "I'd be happy to share product details! Please specify which product you're asking about. 📝"),
+    # POSITIVE FEEDBACK
+    (('thank', 'thanks', 'appreciate'), "You're welcome! 😊 Is there anything else I can help you with?"),
+    (('good', 'great', 'awesome', 'love', 'amazing', 'excellent'), "Thank you for the kind words! 😊 We're happy to serve you!"),
+    (('perfect', 'nice', 'wonderful'), "Glad to hear that! 😄 Thanks for your feedback!"),
+    # TECHNICAL
+    (('app', 'application', 'login', 'password'), "For app/login issues, please contact our tech support at tech@business.com or call +1-234-567-8901. 💻"),
+    (('update', 'upgrade'), "For updates or upgrades, please visit our website or contact sales@business.com. 🔄"),
+    # GENERAL INQUIRIES
+    (('what', 'how', 'why', 'when', 'where'), "I'd be happy to answer your question! 🤔 Could you please provide more details?"),
+    (('information', 'info', 'detail'), "I can provide information! Please let me know what specific details you need. 📚"),
+)
+
+# keyword -> (priority, reply); keywords listed in more than one group keep their earliest group
+_KEYWORD_TO_REPLY = {}
+for _priority, (_keywords, _reply) in enumerate(SMART_REPLIES):
+    for _keyword in _keywords:
+        _KEYWORD_TO_REPLY.setdefault(_keyword, (_priority, _reply))
+
+def _build_reply_automaton():
+    """One Aho-Corasick automaton over every keyword, value = (priority, reply)"""
+    automaton = ahocorasick.Automaton()
+    for keyword, match in _KEYWORD_TO_REPLY.items():
+        automaton.add_word(keyword, match)
+    automaton.make_automaton()
+    return automaton
+
+def _build_reply_pattern() -> re.Pattern:
+    """
+    Fallback without pyahocorasick: one alternation inside a lookahead, so finditer
+    reports a match at every position. Alternatives are in priority order, so each
+    position yields its highest-priority keyword
+    """
+    alternation = "|".join(map(re.escape, _KEYWORD_TO_REPLY))
+    return re.compile(f"(?=({alternation}))")
+
+_REPLY_AUTOMATON = _build_reply_automaton() if ahocorasick else None
+_REPLY_PATTERN = _build_reply_pattern()
+
+def _keyword_matches(message_text: str):
+    """(priority, reply) for every keyword occurrence in message_text"""
+    if _REPLY_AUTOMATON is not None:
+        return (match for _, match in _REPLY_AUTOMATON.iter(message_text))
+    return (_KEYWORD_TO_REPLY[m.group(1)] for m in _REPLY_PATTERN.finditer(message_text))
+
+def generate_smart_reply(message_text: str) -> str:
+    """Generate intelligent replies based on message content"""
+    message_text = message_text.lower()
+    
+    # One pass over the text finds every keyword; keep the highest-priority group
+    best = None
+    for match in _keyword_matches(message_text):
+        if best is None or match[0] < best[0]:
+            best = match
+            if best[0] == 0:
+                break
+    
+    if best is not None:
+        return best[1]
+    return f"Thanks for your message! I understand you're saying: '{message_text}'. Our team will respond with more specific help shortly. 💬"
+
+async def send_whatsapp_message(to_number: str, message: str):
+    """Send WhatsApp message to user"""
+    if not DEFAULT_PHONE_NUMBER_ID or not DEFAULT_ACCESS_TOKEN:
+        logger.error("❌ WhatsApp access token not configured")
+        return
+    
+    try:
+        payload = {
+            "messaging_product": "whatsapp",
+            "to": to_number,
+            "text": {"body": message}
+        }
+        
+        logger.info(f"📤 Sending auto-reply to {to_number}")
+        
+        # Shared keep-alive client - no per-reply TCP/TLS handshake, event loop not blocked
+        async with _send_slots:
+            response = await whatsapp_service.post_message(DEFAULT_PHONE_NUMBER_ID, DEFAULT_ACCESS_TOKEN, payload)
+        
+        if response.status_code == 200:
+            logger.success(f"✅ Auto-reply sent successfully to {to_number}")
+        else:
+            logger.error(f"❌ Failed to send auto-reply: {response.status_code} - {response.text}")
+            
+    except Exception as e:
+        logger.error(f"❌ Error sending WhatsApp message: {e}")
@@ -0,0 +1,61 @@
+from typing import Any, Optional
+import orjson
+import redis.asyncio as redis
+from loguru import logger
+from core.config import settings
+
+class CacheService:
+    """
+    Shared async Redis client for counters and short-lived caches
+    """
+    
+    def __init__(self):
+        # Connections are opened lazily on the first command
+        self.client = redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT
+        )
+        logger.info("Cache service initialized")
+    
+    async def get_json(self, key: str) -> Optional[Any]:
+        """Cached JSON value, or None on a miss or when Redis is unreachable"""
+        try:
+            cached = await self.client.get(key)
+        except Exception as e:
+            logger.warning(f"⚠️ Cache read failed for {key}: {e}")
+            return None
+        return orjson.loads(cached) if cached is not None else None
+    
+    async def set_json(self, key: str, value: Any, ttl: int):
+        """Store a JSON value for `ttl` seconds; a Redis outage only costs the cache entry"""
+        try:
+            await self.client.setex(key, ttl, orjson.dumps(value))
+        except Exception as e:
+            logger.warning(f"⚠️ Cache write failed for {key}: {e}")
+    
+    async def claim(self, key: str, ttl: int) -> bool:
+        """SET NX EX: True for the first caller within `ttl`, False for repeats.
+        Fails open - a Redis outage lets the work run rather than dropping it"""
+        try:
+            return bool(await self.client.set(key, 1, nx=True, ex=ttl))
+        except Exception as e:
+            logger.warning(f"⚠️ Claim failed for {key}, proceeding: {e}")
+            return True
+    
+    async def delete(self, *keys: str):
+        """Drop cache entries; a Redis outage leaves them to expire on their TTL"""
+        try:
+            await self.client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"⚠️ Cache delete failed for {keys}: {e}")
+    
+    async def close(self):
+        """Close the connection pool"""
+        try:
+            await self.client.aclose()
+        except Exception as e:
+            logger.error(f"❌ Error closing Redis connection: {e}")
+
+# Global instance
+cache_service = CacheService()
@@ -1,70 +1,74 @@
-import json
+import asyncio
 import time
-import requests
 import os
+from typing import Optional
+import aio_pika
+from aio_pika.abc import AbstractIncomingMessage
+import orjson
 from dotenv import load_dotenv
 from loguru import logger
-from services.message_queue import rabbitmq_service
+from core.config import settings
+from services.whatsapp_service import whatsapp_service, DEFAULT_PHONE_NUMBER_ID, DEFAULT_ACCESS_TOKEN
+from services.auto_reply import process_incoming_message
+from services.account_cache import account_cache
+from services.webhook_handler import webhook_handler
 
 # Load environment variables from .env file
 load_dotenv()
 
-def process_outgoing_message(message_data: dict):
+async def process_outgoing_message(message_data: dict):
     """Process messages and send to WhatsApp API"""
-    logger.info(f"🔄 Processing queued message: {message_data}")
+    # Per-message detail is debug-level with deferred formatting - under LOGURU_LEVEL=INFO
+    # (production) these calls return before building any string
+    logger.debug("🔄 Processing queued message: {}", message_data.get('message_id'))
     
     try:
         # Extract data
         to_number = message_data.get('to') or message_data.get('to_number')
         message_content = message_data.get('message') or message_data.get('content')
         
-        logger.info(f"📞 To: {to_number}")
-        logger.info(f"💬 Message: {message_content}")
-        
         if not to_number or not message_content:
             logger.error("❌ Missing 'to' or 'message' in data")
             return False
         
-        # Get WhatsApp credentials - TEMPORARILY HARCODED FOR TESTING
-        # Replace these with your ACTUAL credentials from Facebook Developer Console
-        phone_number_id = "902614526258424"  # ⚠️ REPLACE WITH YOUR REAL PHONE NUMBER ID
-        access_token = "EAAORRjYfA6oBP5ZBH2gnvHUDd1RGZAoqAFoNQAzMsMSu5654OJEyEkVle1fTtJ7MSJFyZBCT1CeRzNVpyJhJ0rEsZAr59QTs1HCuMVUNpZCQbV9OvHvzaRxCbbNpXUeAdL3yAxMwT0bGWoeZCoWZA3ZBwDO4fcZCZAB2ZC4ApZA1K0IX2v4ja6NzuHZAdYAg2UzjRlwZDZD"  # ⚠️ REPLACE WITH YOUR REAL ACCESS TOKEN
-        
-        # Debug: Show what credentials we're using
-        print(f"🔍 DEBUG: Using Phone Number ID: {phone_number_id}")
-        print(f"🔍 DEBUG: Using Access Token: {access_token[:20]}..." if access_token and len(access_token) > 20 else "None")
+        # WhatsApp credentials - tenant sends resolve the account's through account_cache
+        # (no token in the queue message); others use the module constants from settings
+        tenant_id = message_data.get('tenant_id')
+        if tenant_id:
+            sender = await account_cache.resolve(tenant_id)
+            if sender is None:
+                logger.error(f"❌ No active WhatsApp account for tenant {tenant_id}")
+                return False
+            phone_number_id = sender['phone_number_id']
+            access_token = sender['access_token']
+        else:
+            phone_number_id = DEFAULT_PHONE_NUMBER_ID
+            access_token = DEFAULT_ACCESS_TOKEN
         
         if not phone_number_id or not access_token:
             logger.error("❌ Missing WhatsApp credentials")
             return False
         
-        # WhatsApp API URL
-        url = f"https://graph.facebook.com/v18.0/{phone_number_id}/messages"
-        
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-        
         payload = {
             "messaging_product": "whatsapp",
             "to": to_number,
             "text": {"body": message_content}
         }
         
-        logger.info(f"📤 Sending to WhatsApp API...")
-        logger.info(f"🔗 URL: {url}")
-        logger.info(f"📞 Sending to: {to_number}")
-        logger.info(f"💬 Message content: {message_content}")
+        logger.debug("📤 Sending to {} via {}: {}", to_number, phone_number_id, message_content)
         
-        # Make API call
-        response = requests.post(url, headers=headers, json=payload)
+        # Make API call on the shared keep-alive client
+        response = await whatsapp_service.post_message(phone_number_id, access_token, payload)
         
         if response.status_code == 200:
-            logger.success(f"✅ WhatsApp message sent successfully!")
-            result = response.json()
-            message_id = result.get('messages', [{}])[0].get('id', 'Unknown')
-            logger.info(f"📨 Message ID: {message_id}")
+            wamid = response.json().get('messages', [{}])[0].get('id')
+            logger.debug("✅ WhatsApp message sent, ID: {}", wamid)
+            
+            # Link the messages row to WhatsApp's id so webhook statuses can update it
+            # (scheduled sends carry a scheduled_messages id instead)
+            message_id = message_data.get('message_id')
+            if wamid and message_id and not message_data.get('is_scheduled'):
+                await webhook_handler.record_wamid(message_id, wamid)
             return True
         else:
             logger.error(f"❌ WhatsApp API error: {response.status_code}")
@@ -73,10 +77,15 @@ def process_outgoing_message(message_data: dict):
             # Show specific error messages
             if response.status_code == 401:
                 logger.error("🔐 Authentication failed - Check your Access Token")
+                if tenant_id:
+                    # Token revoked/rotated - the next send re-reads the account from the database
+                    await account_cache.evict(tenant_id)
             elif response.status_code == 404:
                 logger.error("🔍 Phone Number ID not found - Check your Phone Number ID")
             elif response.status_code == 400:
                 logger.error("📱 Bad request - Check phone number format")
+            elif response.status_code == 429:
+                logger.error("🐢 Rate limited by WhatsApp API - retries exhausted")
             
             return False
             
@@ -84,68 +93,169 @@ def process_outgoing_message(message_data: dict):
         logger.error(f"❌ Error in process_outgoing_message: {e}")
         return False
 
-def process_consumer_message(ch, method, properties, body):
-    """Process individual messages from RabbitMQ"""
+async def process_consumer_message(message: AbstractIncomingMessage) -> bool:
+    """Process individual messages from RabbitMQ; acking is left to the batch loop"""
     try:
-        message_data = json.loads(body)
-        logger.info(f"📨 Received message from RabbitMQ: {message_data}")
+        message_data = orjson.loads(message.body)
+        logger.debug("📨 Received message from RabbitMQ: {}", message_data.get('message_id'))
         
-        # Process the message
-        success = process_outgoing_message(message_data)
+        return await process_outgoing_message(message_data)
         
-        if success:
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            logger.info(f"✅ Message acknowledged: {method.delivery_tag}")
-        else:
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            logger.error(f"❌ Message failed, not requeued: {method.delivery_tag}")
-            
     except Exception as e:
         logger.error(f"❌ Error processing message: {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return False
 
-def start_message_consumers():
-    """Start all message consumers"""
-    print("🔍 DEBUG: Starting message consumers...")
-    
-    # Check RabbitMQ connection
-    if not rabbitmq_service.is_connected:
-        logger.error("❌ Cannot start consumers: RabbitMQ not connected")
-        print("🔍 DEBUG: Trying to reconnect to RabbitMQ...")
+async def process_incoming_delivery(message: AbstractIncomingMessage) -> bool:
+    """Inbound webhook payload queued by POST /webhook: smart replies to its messages,
+    delivery statuses applied to the sent messages rows"""
+    try:
+        payload = orjson.loads(message.body)
+        await asyncio.gather(
+            process_incoming_message(payload),
+            webhook_handler.process_statuses(payload)
+        )
+        return True
         
+    except Exception as e:
+        logger.error(f"❌ Error processing incoming webhook: {e}")
+        return False
+
+# Queue -> delivery handler; every queue gets CONSUMER_CONCURRENCY consumers
+QUEUE_HANDLERS = {
+    'outgoing_messages': process_consumer_message,
+    'incoming_messages': process_incoming_delivery,
+}
+
+class AckBatcher:
+    """Acks processed deliveries with one basic.ack(multiple=True) per batch
+    
+    Messages are handled in delivery order on one channel, so acking the last
+    successful delivery_tag with multiple=True covers everything before it.
+    """
+    
+    def __init__(self, batch_size: int, timeout: float):
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.last_message: Optional[AbstractIncomingMessage] = None
+        self.count = 0
+        self.deadline = 0.0
+    
+    def add(self, message: AbstractIncomingMessage):
+        if self.count == 0:
+            self.deadline = asyncio.get_running_loop().time() + self.timeout
+        self.last_message = message
+        self.count += 1
+    
+    def time_left(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        return max(0.0, self.deadline - asyncio.get_running_loop().time())
+    
+    def is_full(self) -> bool:
+        return self.count >= self.batch_size
+    
+    def _reset(self):
+        self.last_message = None
+        self.count = 0
+    
+    async def flush(self):
+        if self.count == 0:
+            return
         try:
-            rabbitmq_service.connect()
-            if rabbitmq_service.is_connected:
-                logger.info("✅ Successfully reconnected to RabbitMQ")
-            else:
-                logger.error("❌ Failed to reconnect to RabbitMQ")
-                return
+            await self.last_message.ack(multiple=True)
+            logger.info(f"✅ Acknowledged {self.count} messages up to {self.last_message.delivery_tag}")
         except Exception as e:
-            logger.error(f"❌ Reconnection failed: {e}")
+            # Channel is gone - the broker will redeliver whatever was unacked
+            logger.error(f"❌ Batch ack failed: {e}")
+        finally:
+            self._reset()
+    
+    async def nack_failed(self, message: AbstractIncomingMessage):
+        """Error path: ack the handled deliveries before message, requeue message alone
+        
+        A multiple=True nack would also requeue deliveries that were already sent.
+        """
+        if self.last_message is message:
+            # It had already been handled - nothing to reject
+            await self.flush()
             return
+        await self.flush()
+        try:
+            await message.nack(requeue=True)
+            logger.error(f"❌ Nacked {message.delivery_tag} for redelivery")
+        except Exception as e:
+            logger.error(f"❌ Nack failed: {e}")
+
+async def _consume_in_batches(inbox: asyncio.Queue, handler):
+    """Drain deliveries in order, acking after CONSUMER_ACK_BATCH_SIZE messages or the timeout"""
+    batcher = AckBatcher(
+        settings.CONSUMER_ACK_BATCH_SIZE,
+        settings.CONSUMER_ACK_BATCH_TIMEOUT_MS / 1000
+    )
     
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(inbox.get(), timeout=batcher.time_left())
+            except asyncio.TimeoutError:
+                await batcher.flush()
+                continue
+            
+            try:
+                success = await handler(message)
+                
+                if success:
+                    batcher.add(message)
+                    if batcher.is_full():
+                        await batcher.flush()
+                else:
+                    # Ack the good ones before it, then drop this one
+                    await batcher.flush()
+                    await message.nack(requeue=False)
+                    logger.error(f"❌ Message failed, not requeued: {message.delivery_tag}")
+                    
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error in consumer batch loop: {e}")
+                await batcher.nack_failed(message)
+    finally:
+        # Shutdown: don't leave finished sends unacked
+        await batcher.flush()
+
+async def start_message_consumers():
+    """Start all message consumers (runs as an asyncio task until cancelled)"""
     logger.info("🚀 Starting RabbitMQ message consumers...")
     
+    connection = await aio_pika.connect_robust(
+        settings.RABBITMQ_URL,
+        heartbeat=settings.RABBITMQ_HEARTBEAT
+    )
+    
     try:
-        # Ensure channel exists
-        if not hasattr(rabbitmq_service, 'channel') or rabbitmq_service.channel is None:
-            logger.error("❌ RabbitMQ channel not available")
-            return
+        consumers = []
+        for queue_name, handler in QUEUE_HANDLERS.items():
+            for _ in range(settings.CONSUMER_CONCURRENCY):
+                # One channel per consumer: ack batching relies on in-order handling per channel,
+                # so sends run concurrently across channels and sequentially within one
+                channel = await connection.channel()
+                await channel.set_qos(prefetch_count=settings.RABBITMQ_PREFETCH_COUNT)
+                
+                queue = await channel.declare_queue(queue_name, durable=True)
+                
+                inbox: asyncio.Queue = asyncio.Queue()
+                await queue.consume(inbox.put)
+                consumers.append(_consume_in_batches(inbox, handler))
             
-        # ✅ FIXED: Listening to correct queue
-        rabbitmq_service.channel.basic_consume(
-            queue='outgoing_messages',  # ✅ CORRECT QUEUE NAME
-            on_message_callback=process_consumer_message,
-            auto_ack=False
-        )
-        
-        logger.info("👂 Consumer started for 'outgoing_messages'")  # ✅ UPDATED LOG
-        print("✅ DEBUG: Consumer successfully registered with RabbitMQ!")
-        print("✅ DEBUG: Listening to queue: outgoing_messages")
+            logger.info(f"👂 {settings.CONSUMER_CONCURRENCY} consumers started for '{queue_name}'")
         
-        # Start consuming (this will block, so it runs in background thread)
-        rabbitmq_service.channel.start_consuming()
+        # connect_robust reconnects on its own; process until shutdown
+        await asyncio.gather(*consumers)
         
+    except asyncio.CancelledError:
+        logger.info("🛑 Message consumers stopped")
+        raise
     except Exception as e:
         logger.error(f"❌ Failed to start consumer: {e}")
-        print(f"🔴 DEBUG: Consumer start failed: {e}")
\ No newline at end of file
+    finally:
+        await connection.close()
@@ -1,93 +1,299 @@
-import pika
-import json
-import time
-from typing import Dict, Any
+import asyncio
+from typing import Dict, Any, List, Optional, Union
+import aio_pika
+import orjson
+from aio_pika.pool import Pool
 from loguru import logger
+from core.config import settings
 
 class RabbitMQService:
+    QUEUES = ('outgoing_messages', 'incoming_messages', 'webhook_notifications')
+    
     def __init__(self):
         self.connection = None
         self.channel = None
+        self.channel_pool: Optional[Pool] = None
         self.is_connected = False
         self.max_retries = 3
-        self.retry_delay = 5
+        self.retry_delay = 1
+        self.max_retry_delay = 30
+        # After a failed connect, publishes fail fast until this loop time instead of
+        # each one opening its own connection attempt against a down broker
+        self.reconnect_after = 0.0
+        self.failed_connects = 0
+        self._connect_lock = asyncio.Lock()
+        self.batch_size = settings.PUBLISHER_BATCH_SIZE
+        # Connection is opened from the app lifespan (await rabbitmq_service.connect())
+    
+    async def connect(self, max_retries: Optional[int] = None):
+        """Connect to RabbitMQ, retrying with capped exponential backoff"""
+        if max_retries is None:
+            max_retries = self.max_retries
         
-        # ✅ ENABLE AUTO-CONNECT NOW THAT RABBITMQ IS RUNNING
-        self.connect()
+        async with self._connect_lock:
+            await self._connect(max_retries)
     
-    def connect(self, retry_count=0):
-        """Connect to RabbitMQ with retry logic"""
-        try:
-            logger.info("🔗 Connecting to RabbitMQ...")
-            
-            self.connection = pika.BlockingConnection(
-                pika.ConnectionParameters(
-                    host='localhost',
-                    port=5672,
-                    heartbeat=600,
-                    blocked_connection_timeout=300
+    async def _connect(self, max_retries: int):
+        for attempt in range(max_retries + 1):
+            # Drop the previous connection first - connect_robust would otherwise leave it
+            # (and its channel pool) open alongside the new one
+            await self._release_connection()
+            try:
+                logger.info("🔗 Connecting to RabbitMQ...")
+                
+                self.connection = await aio_pika.connect_robust(
+                    settings.RABBITMQ_URL,
+                    heartbeat=settings.RABBITMQ_HEARTBEAT
                 )
-            )
-            
-            self.channel = self.connection.channel()
-            
-            # Create queues
-            self.channel.queue_declare(queue='outgoing_messages', durable=True)
-            self.channel.queue_declare(queue='incoming_messages', durable=True)
-            self.channel.queue_declare(queue='webhook_notifications', durable=True)
-            
-            self.is_connected = True
-            logger.success("✅ Connected to RabbitMQ successfully!")
-            
+                
+                # Publisher confirms: publish() resolves once the broker has the message,
+                # without blocking other publishes in the meantime
+                self.channel = await self.connection.channel(publisher_confirms=True)
+                
+                # Create queues
+                for queue_name in self.QUEUES:
+                    await self.channel.declare_queue(queue_name, durable=True)
+                
+                # Publishes are spread over a pool of confirm-mode channels, so concurrent
+                # requests don't serialize on one channel's frames and confirm sequence
+                self.channel_pool = Pool(self._create_channel, max_size=settings.RABBITMQ_CHANNEL_POOL_SIZE)
+                
+                self.is_connected = True
+                self.failed_connects = 0
+                logger.success("✅ Connected to RabbitMQ successfully!")
+                return
+                
+            except Exception as e:
+                logger.error(f"❌ Failed to connect to RabbitMQ (attempt {attempt + 1}/{max_retries + 1}): {e}")
+                
+                if attempt < max_retries:
+                    delay = self._backoff(attempt)
+                    logger.info(f"🔄 Retrying in {delay} seconds...")
+                    await asyncio.sleep(delay)
+        
+        logger.error("🚨 Max retries reached. RabbitMQ connection failed.")
+        self.is_connected = False
+        # Each consecutive failed round doubles the fail-fast window (capped)
+        self.reconnect_after = asyncio.get_running_loop().time() + self._backoff(self.failed_connects)
+        self.failed_connects += 1
+    
+    async def _release_connection(self):
+        """Close the channel pool and connection, if any; errors only get logged"""
+        pool, connection = self.channel_pool, self.connection
+        self.channel_pool = self.connection = self.channel = None
+        self.is_connected = False
+        try:
+            if pool is not None:
+                await pool.close()
+            if connection is not None and not connection.is_closed:
+                await connection.close()
         except Exception as e:
-            logger.error(f"❌ Failed to connect to RabbitMQ (attempt {retry_count + 1}/{self.max_retries}): {e}")
-            
-            if retry_count < self.max_retries:
-                logger.info(f"🔄 Retrying in {self.retry_delay} seconds...")
-                time.sleep(self.retry_delay)
-                self.connect(retry_count + 1)
-            else:
-                logger.error("🚨 Max retries reached. RabbitMQ connection failed.")
-                self.is_connected = False
+            logger.warning(f"⚠️ Error closing previous RabbitMQ connection: {e}")
+    
+    def _publish_failed(self):
+        # A NACK or confirm timeout leaves the connection usable; only a closed
+        # connection makes the next publish reconnect
+        if self.connection is None or self.connection.is_closed:
+            self.is_connected = False
+    
+    def _backoff(self, attempt: int) -> float:
+        return min(self.retry_delay * 2 ** attempt, self.max_retry_delay)
+
+    def _connection_ok(self) -> bool:
+        return self.is_connected and self.connection is not None and not self.connection.is_closed
+    
+    async def ensure_connection(self):
+        """Ensure we have a connection; fails fast while a failed connect is backing off"""
+        if self._connection_ok():
+            return
+        
+        async with self._connect_lock:
+            # Concurrent publishers queue on the lock - only the first one reconnects
+            if self._connection_ok():
+                return
+            if asyncio.get_running_loop().time() < self.reconnect_after:
+                raise ConnectionError("RabbitMQ unavailable, waiting before reconnecting")
+            await self._connect(max_retries=0)
+        
+        if not self.is_connected:
+            raise ConnectionError("RabbitMQ unavailable")
 
-    def ensure_connection(self):
-        """Ensure we have a connection"""
-        if not self.is_connected or self.connection is None or self.connection.is_closed:
-            self.connect()
+    async def _create_channel(self) -> aio_pika.abc.AbstractChannel:
+        return await self.connection.channel(publisher_confirms=True)
 
-    def send_message(self, queue_name: str, message_data: Dict[str, Any]):
+    @staticmethod
+    def _build_message(message_data: Union[Dict[str, Any], bytes]) -> aio_pika.Message:
+        # Already-encoded JSON (e.g. a raw webhook body) is published as-is
+        return aio_pika.Message(
+            body=message_data if isinstance(message_data, bytes) else orjson.dumps(message_data),
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,  # Make message persistent
+            content_type='application/json'
+        )
+
+    async def send_message(self, queue_name: str, message_data: Union[Dict[str, Any], bytes]):
         """Send message to queue with error handling"""
         try:
-            self.ensure_connection()
+            await self.ensure_connection()
             
-            self.channel.basic_publish(
-                exchange='',
-                routing_key=queue_name,
-                body=json.dumps(message_data),
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # Make message persistent
-                    content_type='application/json'
+            async with self.channel_pool.acquire() as channel:
+                await channel.default_exchange.publish(
+                    self._build_message(message_data),
+                    routing_key=queue_name
                 )
-            )
             
             logger.debug(f"📨 Message sent to '{queue_name}': {message_data}")
             return True
             
         except Exception as e:
             logger.error(f"❌ Failed to send message to '{queue_name}': {e}")
-            self.is_connected = False
+            self._publish_failed()
             return False
 
-    # ✅ ADD THIS MISSING METHOD
-    def close(self):
+    async def send_messages(self, queue_name: str, messages: List[Union[Dict[str, Any], bytes]]):
+        """Send many messages, awaiting broker confirms once per batch of PUBLISHER_BATCH_SIZE"""
+        try:
+            await self.ensure_connection()
+            
+            async with self.channel_pool.acquire() as channel:
+                exchange = channel.default_exchange
+                for start in range(0, len(messages), self.batch_size):
+                    batch = messages[start:start + self.batch_size]
+                    await asyncio.gather(*(
+                        exchange.publish(self._build_message(data), routing_key=queue_name)
+                        for data in batch
+                    ))
+            
+            logger.debug(f"📨 {len(messages)} messages sent to '{queue_name}'")
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Failed to send batch to '{queue_name}': {e}")
+            self._publish_failed()
+            return False
+
+    async def send_messages_batch(self, queue_name: str, messages: List[Union[Dict[str, Any], bytes]]) -> List[bool]:
+        """Like send_messages, but reports the broker confirm of every message (in order)"""
+        results: List[bool] = []
+        try:
+            await self.ensure_connection()
+            
+            async with self.channel_pool.acquire() as channel:
+                exchange = channel.default_exchange
+                for start in range(0, len(messages), self.batch_size):
+                    batch = messages[start:start + self.batch_size]
+                    confirms = await asyncio.gather(*(
+                        exchange.publish(self._build_message(data), routing_key=queue_name)
+                        for data in batch
+                    ), return_exceptions=True)
+                    results.extend(not isinstance(confirm, BaseException) for confirm in confirms)
+            
+            logger.debug(f"📨 {sum(results)}/{len(messages)} messages confirmed on '{queue_name}'")
+            return results
+            
+        except Exception as e:
+            logger.error(f"❌ Failed to send batch to '{queue_name}': {e}")
+            self._publish_failed()
+            # Keep the confirms of chunks that already went out - only the rest failed
+            return results + [False] * (len(messages) - len(results))
+
+    async def close(self):
         """Close connection gracefully"""
         try:
+            if self.channel_pool is not None:
+                await self.channel_pool.close()
+                self.channel_pool = None
             if self.connection and not self.connection.is_closed:
-                self.connection.close()
+                await self.connection.close()
                 self.is_connected = False
                 logger.info("🔌 RabbitMQ connection closed")
         except Exception as e:
             logger.error(f"❌ Error closing RabbitMQ connection: {e}")
 
-# Global instance
-rabbitmq_service = RabbitMQService()
\ No newline at end of file
+class PublishBuffer:
+    """
+    Coalesces publishes from concurrent requests: whatever arrives within
+    PUBLISH_BUFFER_DELAY_MS (up to PUBLISH_BUFFER_SIZE) goes out through
+    send_messages, so a burst shares confirm rounds instead of one per message
+    """
+    
+    def __init__(self, service: RabbitMQService):
+        self.service = service
+        self.max_batch = settings.PUBLISH_BUFFER_SIZE
+        self.max_delay = settings.PUBLISH_BUFFER_DELAY_MS / 1000
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+    
+    async def publish(self, queue_name: str, message_data: Union[Dict[str, Any], bytes]) -> bool:
+        """Publish through the buffer; resolves once the broker confirmed (or rejected) the batch"""
+        if self.task is None:
+            return await self.service.send_message(queue_name, message_data)
+        
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((queue_name, message_data, future))
+        return await future
+    
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the buffer and publish whatever is still waiting"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        
+        batch = []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            await self._flush(batch)
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch.append(await self.queue.get())
+                deadline = loop.time() + self.max_delay
+                
+                while len(batch) < self.max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                
+                pending, batch = batch, []
+                try:
+                    await self._flush(pending)
+                finally:
+                    # Cancelled mid-flush: whatever wasn't resolved yet may or may not have
+                    # reached the broker - fail those callers rather than leave them hanging
+                    for _, _, future in pending:
+                        if not future.done():
+                            future.set_exception(ConnectionError("Publish buffer stopped during the flush"))
+        except asyncio.CancelledError:
+            # Callers are awaiting these futures - don't strand them
+            if batch:
+                await self._flush(batch)
+            raise
+    
+    async def _flush(self, batch: list):
+        by_queue: Dict[str, list] = {}
+        for queue_name, message_data, future in batch:
+            by_queue.setdefault(queue_name, []).append((message_data, future))
+        
+        for queue_name, entries in by_queue.items():
+            success = await self.service.send_messages(queue_name, [data for data, _ in entries])
+            for _, future in entries:
+                if not future.done():
+                    future.set_result(success)
+
+# Global instances
+rabbitmq_service = RabbitMQService()
+publish_buffer = PublishBuffer(rabbitmq_service)
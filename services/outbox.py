@@ -0,0 +1,109 @@
+import asyncio
+from typing import Dict, List, Optional
+from sqlalchemy import delete, select, update
+from loguru import logger
+from core.config import settings
+from database.session import AsyncSessionLocal
+from database.models import OutboxMessage
+from services.message_queue import rabbitmq_service
+
+# Longest pause between dispatch rounds while publishes keep failing
+OUTBOX_MAX_BACKOFF = 30.0
+
+class OutboxDispatcher:
+    """
+    Drains the outbox table into RabbitMQ. Rows are claimed with FOR UPDATE SKIP LOCKED,
+    so every worker can run a dispatcher without publishing the same row twice, and a
+    row is only deleted once the broker has confirmed it (at-least-once delivery)
+    """
+
+    def __init__(self):
+        self.batch_size = settings.OUTBOX_BATCH_SIZE
+        self.poll_interval = settings.OUTBOX_POLL_INTERVAL_MS / 1000
+        self.task: Optional[asyncio.Task] = None
+        # Consecutive rounds with unconfirmed publishes - drives the retry backoff
+        self.failed_rounds = 0
+        self._wakeup = asyncio.Event()
+        logger.info("Outbox dispatcher initialized")
+
+    def notify(self):
+        """Wake the dispatcher now instead of at the next poll (call after committing outbox rows)"""
+        self._wakeup.set()
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                dispatched = await self.dispatch_batch()
+            except Exception as e:
+                logger.error(f"❌ Outbox dispatch failed: {e}")
+                dispatched = 0
+
+            if self.failed_rounds:
+                # Broker trouble: back off (ignoring wake-ups) instead of re-claiming the same
+                # rows and burning through their attempts every poll
+                await asyncio.sleep(min(self.poll_interval * 2 ** self.failed_rounds, OUTBOX_MAX_BACKOFF))
+                continue
+
+            # A full batch means there is probably more backlog - go again right away
+            if dispatched < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def dispatch_batch(self) -> int:
+        """Publish one batch of outbox rows; returns how many the broker confirmed"""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(OutboxMessage.id, OutboxMessage.queue, OutboxMessage.payload)
+                .order_by(OutboxMessage.created_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not rows:
+                return 0
+
+            by_queue: Dict[str, List] = {}
+            for row in rows:
+                by_queue.setdefault(row.queue, []).append(row)
+
+            # Per-message confirms: only rows the broker acknowledged are deleted, so a
+            # partly published batch isn't sent again on the next round
+            published, failed = [], []
+            for queue_name, entries in by_queue.items():
+                confirmed = await rabbitmq_service.send_messages_batch(queue_name, [row.payload for row in entries])
+                for row, ok in zip(entries, confirmed):
+                    (published if ok else failed).append(row.id)
+
+            if published:
+                await db.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(published)))
+            if failed:
+                await db.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_(failed))
+                    .values(attempts=OutboxMessage.attempts + 1)
+                )
+            await db.commit()
+
+        if failed:
+            self.failed_rounds += 1
+            logger.warning(f"⚠️ {len(failed)} outbox messages left for retry")
+        else:
+            self.failed_rounds = 0
+        return len(published)
+
+# Global instance
+outbox_dispatcher = OutboxDispatcher()
@@ -1,111 +1,258 @@
 import asyncio
 import logging
 from datetime import datetime, timedelta
-from database.session import SessionLocal
-from database.models import ScheduledMessage, Tenant, WhatsAppAccount
+from typing import Optional
+import asyncpg
+from core.config import settings
+from database.session import AsyncSessionLocal
+from database.models import ScheduledMessage, ScheduledStatus, Tenant, WhatsAppAccount
 from services.message_queue import rabbitmq_service
-from sqlalchemy import and_
+from sqlalchemy import bindparam, case, cast, select, update
 
 logger = logging.getLogger(__name__)
 
+# Postgres NOTIFY channel; scheduling a message wakes every worker's scheduler
+SCHEDULER_WAKE_CHANNEL = "scheduler_wake"
+
 class MessageScheduler:
-    def __init__(self, check_interval=60):  # Check every 60 seconds
-        self.check_interval = check_interval
-        self.is_running = False
+    def __init__(self, min_interval=1.0, max_interval=60.0, backoff_factor=1.7, batch_size=500, stale_after=300):
+        # Poll fast while there is work, back off geometrically to max_interval when idle
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        # Rows claimed per tick; FOR UPDATE SKIP LOCKED lets other workers take the next batch
+        self.batch_size = batch_size
+        # A row still 'processing' this many seconds after its claim was left by a crashed tick
+        self.stale_after = stale_after
+        self._stopped = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._listener: Optional[asyncpg.Connection] = None
+    
+    def wake(self):
+        """Cut the current sleep short and run a tick now"""
+        self._wake.set()
     
     async def start(self):
         """Start the scheduler in background"""
-        self.is_running = True
+        self._stopped.clear()
         logger.info("🚀 Starting message scheduler...")
+        await self._listen()
+        await self.recover_stale()
         
-        while self.is_running:
+        interval = self.min_interval
+        while not self._stopped.is_set():
             try:
-                await self.process_due_messages()
-                await asyncio.sleep(self.check_interval)
+                processed = await self.process_due_messages()
+                if processed >= self.batch_size:
+                    # Full batch - a backlog is draining, claim the next chunk without sleeping
+                    continue
+                interval = self.min_interval if processed else min(interval * self.backoff_factor, self.max_interval)
             except Exception as e:
                 logger.error(f"Scheduler error: {e}")
-                await asyncio.sleep(30)  # Wait before retry
+                interval = self.max_interval
+            
+            try:
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
     
     async def stop(self):
         """Stop the scheduler"""
-        self.is_running = False
+        self._stopped.set()
+        # Cut the current sleep short so the loop exits now, not after up to max_interval
+        self._wake.set()
         logger.info("🛑 Stopping message scheduler...")
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
     
-    async def process_due_messages(self):
-        """Process messages that are due to be sent"""
-        db = SessionLocal()
+    async def _listen(self):
+        """LISTEN on SCHEDULER_WAKE_CHANNEL over a dedicated asyncpg connection"""
         try:
-            now = datetime.utcnow()
-            
-            # Find due messages (scheduled time has passed, not yet sent/failed)
-            due_messages = db.query(ScheduledMessage).filter(
-                and_(
-                    ScheduledMessage.scheduled_at <= now,
-                    ScheduledMessage.status.in_(["scheduled", "failed"]),
-                    ScheduledMessage.attempts < ScheduledMessage.max_attempts
-                )
-            ).all()
-            
-            if due_messages:
+            self._listener = await asyncpg.connect(settings.DATABASE_URL)
+            await self._listener.add_listener(SCHEDULER_WAKE_CHANNEL, lambda *_: self.wake())
+        except Exception as e:
+            # Adaptive polling alone still delivers everything, just later
+            logger.warning(f"Scheduler wake-ups unavailable, polling only: {e}")
+            self._listener = None
+    
+    async def process_due_messages(self) -> int:
+        """Process messages that are due to be sent; returns how many were due"""
+        now = datetime.utcnow()
+        
+        # 1. Claim: lock, mark processing and commit, so the row locks are released before
+        #    the broker round-trip (other workers skip 'processing' rows)
+        try:
+            async with AsyncSessionLocal() as db:
+                # Find due messages (scheduled time has passed, not yet sent/failed) - plain
+                # column rows, every write below is a set-based UPDATE
+                due_messages = (await db.execute(
+                    select(
+                        ScheduledMessage.id,
+                        ScheduledMessage.tenant_id,
+                        ScheduledMessage.to_number,
+                        ScheduledMessage.message,
+                        ScheduledMessage.message_type
+                    ).where(
+                        ScheduledMessage.scheduled_at <= now,
+                        # Rendered as literals: asyncpg's generic prepared plans can't match a
+                        # bound $1/$2 against the ix_scheduled_due_partial predicate
+                        ScheduledMessage.status.in_(bindparam(
+                            "due_statuses", (ScheduledStatus.SCHEDULED, ScheduledStatus.FAILED),
+                            expanding=True, literal_execute=True
+                        )),
+                        ScheduledMessage.attempts < ScheduledMessage.max_attempts
+                    )
+                    .order_by(ScheduledMessage.scheduled_at)
+                    .limit(self.batch_size)
+                    # Every worker's scheduler can poll; each claims a disjoint set
+                    .with_for_update(skip_locked=True)
+                )).all()
+                
+                if not due_messages:
+                    return 0
+                
                 logger.info(f"📅 Processing {len(due_messages)} due scheduled messages")
-            
-            for message in due_messages:
-                await self.process_single_message(db, message, now)
                 
-            db.commit()
-            
+                # Claim the whole tick in one statement
+                await self.update_messages(
+                    db, [message.id for message in due_messages],
+                    status=ScheduledStatus.PROCESSING,
+                    attempts=ScheduledMessage.attempts + 1,
+                    last_attempt_at=now
+                )
+                
+                # One query for the active account of every tenant in this tick, not one per row.
+                # The access token stays out of the (persistent) queue message - the consumer
+                # resolves it through account_cache
+                tenant_ids = {message.tenant_id for message in due_messages}
+                accounts = {}
+                for account in await db.execute(
+                    select(
+                        WhatsAppAccount.tenant_id,
+                        WhatsAppAccount.id,
+                        WhatsAppAccount.phone_number_id
+                    ).where(
+                        WhatsAppAccount.tenant_id.in_(tenant_ids),
+                        WhatsAppAccount.is_active == True
+                    )
+                ):
+                    accounts.setdefault(account.tenant_id, account)
+                
+                # Build every payload first, then publish the whole tick as one confirm batch
+                pending = []
+                no_account_ids = []
+                for message in due_messages:
+                    account = accounts.get(message.tenant_id)
+                    if account is None:
+                        no_account_ids.append(message.id)
+                    else:
+                        pending.append((message.id, self.build_payload(message, account)))
+                
+                await self.mark_failed(db, no_account_ids, "No active WhatsApp account found")
+                await db.commit()
         except Exception as e:
-            db.rollback()
-            logger.error(f"Error processing scheduled messages: {e}")
-        finally:
-            db.close()
+            logger.error(f"Error claiming scheduled messages: {e}")
+            return 0
+        
+        if not pending:
+            return len(due_messages)
+        
+        # 2. Publish - no transaction or row lock is held while waiting on broker confirms
+        sent_ids = []
+        unconfirmed_ids = []
+        confirmed = await rabbitmq_service.send_messages_batch(
+            'outgoing_messages', [queue_data for _, queue_data in pending]
+        )
+        for (message_id, _), ok in zip(pending, confirmed):
+            (sent_ids if ok else unconfirmed_ids).append(message_id)
+        
+        logger.info(f"✅ Scheduled messages sent: {len(sent_ids)}/{len(pending)}")
+        
+        # 3. Record the outcome - one UPDATE per outcome, one commit
+        try:
+            async with AsyncSessionLocal() as db:
+                await self.update_messages(db, sent_ids, status=ScheduledStatus.SENT, sent_at=now)
+                # Retried on a later tick until max_attempts
+                await self.mark_failed(db, unconfirmed_ids, "Broker did not confirm the publish")
+                await db.commit()
+        except Exception as e:
+            # Rows stay 'processing'; recover_stale() returns them to the sweep on the next start
+            logger.error(f"Error recording scheduled message results: {e}")
+        
+        return len(due_messages)
     
-    async def process_single_message(self, db, message, current_time):
-        """Process a single scheduled message"""
+    async def recover_stale(self):
+        """Return rows left 'processing' by a crashed tick to the sweep (as failed, attempt counted)"""
         try:
-            # Update status to processing
-            message.status = "processing"
-            message.attempts += 1
-            message.last_attempt_at = current_time
-            db.commit()
-            
-            # Get tenant's WhatsApp account
-            whatsapp_account = db.query(WhatsAppAccount).filter(
-                WhatsAppAccount.tenant_id == message.tenant_id,
-                WhatsAppAccount.is_active == True
-            ).first()
-            
-            if not whatsapp_account:
-                raise Exception("No active WhatsApp account found")
-            
-            # Queue message for sending
-            queue_data = {
-                "message_id": message.id,
-                "tenant_id": message.tenant_id,
-                "whatsapp_account_id": whatsapp_account.id,
-                "to_number": message.to_number,
-                "content": message.message,
-                "message_type": message.message_type,
-                "is_scheduled": True
-            }
-            
-            rabbitmq_service.send_message('outgoing_messages', queue_data)
-            
-            # Update status to sent
-            message.status = "sent"
-            message.sent_at = current_time
-            logger.info(f"✅ Scheduled message sent: {message.id}")
-            
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    update(ScheduledMessage)
+                    .where(
+                        ScheduledMessage.status == ScheduledStatus.PROCESSING,
+                        ScheduledMessage.last_attempt_at < datetime.utcnow() - timedelta(seconds=self.stale_after)
+                    )
+                    .values(status=ScheduledStatus.FAILED, error_message="Interrupted while processing")
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+            if result.rowcount:
+                logger.warning(f"♻️ Recovered {result.rowcount} stale processing scheduled messages")
         except Exception as e:
-            error_msg = str(e)
-            message.status = "failed"
-            message.error_message = error_msg
-            logger.error(f"❌ Failed scheduled message {message.id}: {error_msg}")
-            
-            # If max attempts reached, mark as permanently failed
-            if message.attempts >= message.max_attempts:
-                message.status = "permanently_failed"
-                logger.error(f"🚫 Scheduled message permanently failed: {message.id}")
+            logger.error(f"Error recovering stale scheduled messages: {e}")
+    
+    @staticmethod
+    def build_payload(message, account) -> dict:
+        return {
+            "message_id": message.id,
+            "tenant_id": message.tenant_id,
+            "whatsapp_account_id": account.id,
+            "phone_number_id": account.phone_number_id,
+            "to_number": message.to_number,
+            "content": message.message,
+            "message_type": message.message_type,
+            "is_scheduled": True
+        }
+    
+    @staticmethod
+    async def update_messages(db, message_ids, **values):
+        """Set the same values on every listed row - one UPDATE ... WHERE id IN (...)"""
+        if not message_ids:
+            return
+        await db.execute(
+            update(ScheduledMessage)
+            .where(ScheduledMessage.id.in_(message_ids))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+    
+    async def mark_failed(self, db, message_ids, error_msg: str):
+        if not message_ids:
+            return
+        logger.error(f"❌ Failed {len(message_ids)} scheduled messages: {error_msg}")
+        
+        # If max attempts reached, mark as permanently failed - decided per row in the UPDATE
+        rows = await db.execute(
+            update(ScheduledMessage)
+            .where(ScheduledMessage.id.in_(message_ids))
+            .values(
+                # Bare literals in a CASE resolve to text, which Postgres won't assign to the enum
+                status=cast(
+                    case(
+                        (ScheduledMessage.attempts >= ScheduledMessage.max_attempts, ScheduledStatus.PERMANENTLY_FAILED.value),
+                        else_=ScheduledStatus.FAILED.value
+                    ),
+                    ScheduledMessage.status.type
+                ),
+                error_message=error_msg
+            )
+            .returning(ScheduledMessage.id, ScheduledMessage.status)
+            .execution_options(synchronize_session=False)
+        )
+        for message_id, status in rows:
+            if status == ScheduledStatus.PERMANENTLY_FAILED:
+                logger.error(f"🚫 Scheduled message permanently failed: {message_id}")
 
 # Global scheduler instance
 message_scheduler = MessageScheduler()
\ No newline at end of file
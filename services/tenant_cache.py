@@ -0,0 +1,81 @@
+import hmac
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+from cachetools import TTLCache
+from sqlalchemy import event, inspect
+from loguru import logger
+from database.models import Tenant
+
+@dataclass(frozen=True)
+class TenantSnapshot:
+    """Detached, read-only copy of the Tenant fields the auth path needs"""
+    id: str
+    name: str
+    email: Optional[str]
+    api_key: str
+    hmac_secret_bytes: bytes  # the column already holds the raw key bytes
+    # Pre-keyed HMAC-SHA256 (inner/outer pads already computed); copy() it per request
+    hmac_template: hmac.HMAC = field(compare=False, repr=False)
+    webhook_url: Optional[str]
+    is_active: bool
+    monthly_message_limit: int
+    rate_limit_per_minute: int
+    timezone: str
+    billing_tier: str
+
+    @classmethod
+    def from_tenant(cls, tenant: Tenant) -> "TenantSnapshot":
+        return cls(
+            id=tenant.id,
+            name=tenant.name,
+            email=tenant.email,
+            api_key=tenant.api_key,
+            hmac_secret_bytes=tenant.hmac_secret,
+            hmac_template=hmac.new(tenant.hmac_secret, digestmod='sha256'),
+            webhook_url=tenant.webhook_url,
+            is_active=tenant.is_active,
+            monthly_message_limit=tenant.monthly_message_limit,
+            rate_limit_per_minute=tenant.rate_limit_per_minute,
+            timezone=tenant.timezone,
+            billing_tier=tenant.billing_tier
+        )
+
+class TenantCache:
+    """In-process api_key -> TenantSnapshot cache, so authenticated requests skip the SELECT"""
+
+    def __init__(self, maxsize: int = 10_000, ttl: int = 30):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()  # TTLCache is not thread-safe; sync routes run in a threadpool
+        logger.info("Tenant cache initialized")
+
+    def get(self, api_key: str) -> Optional[TenantSnapshot]:
+        with self._lock:
+            return self._cache.get(api_key)
+
+    def put(self, tenant: Tenant) -> TenantSnapshot:
+        snapshot = TenantSnapshot.from_tenant(tenant)
+        with self._lock:
+            self._cache[snapshot.api_key] = snapshot
+        return snapshot
+
+    def invalidate(self, api_key: str):
+        with self._lock:
+            self._cache.pop(api_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+# Global instance
+tenant_cache = TenantCache()
+
+# Drop cached snapshots whenever a tenant row changes (deactivation, key rotation, limits).
+# Other workers pick the change up when their entry expires (ttl).
+@event.listens_for(Tenant, "after_update")
+@event.listens_for(Tenant, "after_delete")
+def _invalidate_tenant(mapper, connection, target):
+    history = inspect(target).attrs.api_key.history
+    for api_key in (*history.deleted, target.api_key):
+        if api_key:
+            tenant_cache.invalidate(api_key)
@@ -0,0 +1,51 @@
+import asyncio
+from typing import Optional
+from sqlalchemy import text
+from loguru import logger
+from core.config import settings
+from database.session import async_engine
+from database.models import MESSAGE_STATUS_COUNTS_VIEW
+
+# Any fixed key works; it only keeps workers from refreshing the same views at once
+REFRESH_LOCK_ID = 43
+
+MATERIALIZED_VIEWS = (MESSAGE_STATUS_COUNTS_VIEW,)
+
+class ViewRefresher:
+    """Periodically runs REFRESH MATERIALIZED VIEW CONCURRENTLY for the analytics views"""
+
+    def __init__(self, interval: int = settings.MATVIEW_REFRESH_SECONDS):
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+        logger.info("Materialized view refresher initialized")
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"❌ Materialized view refresh failed: {e}")
+
+    async def refresh(self):
+        async with async_engine.begin() as conn:
+            # Every worker runs a refresher; whoever holds the lock does the work this round
+            if not await conn.scalar(text("SELECT pg_try_advisory_xact_lock(:lock_id)"), {"lock_id": REFRESH_LOCK_ID}):
+                return
+            for view in MATERIALIZED_VIEWS:
+                await conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}"))
+
+# Global instance
+view_refresher = ViewRefresher()
@@ -1,6 +1,31 @@
-import json
-from typing import Dict, Any
+import asyncio
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import DateTime, String, column, or_, update, values
 from loguru import logger
+from database.session import AsyncSessionLocal
+from database.models import Message
+
+async def _handle_text(message_data: Dict[str, Any]):
+    logger.info(f"📝 Message content: {message_data.get('text', {}).get('body', '')}")
+
+async def _handle_media(message_data: Dict[str, Any]):
+    # image/document/audio/video/sticker all carry {id, mime_type, caption?} under their type
+    media = message_data.get(message_data['type'], {})
+    logger.info(f"📎 Media {media.get('id')} ({media.get('mime_type')}): {media.get('caption', '')}")
+
+async def _handle_unknown(message_data: Dict[str, Any]):
+    logger.debug(f"Unhandled message type: {message_data.get('type')}")
+
+# message type -> handler, looked up once per message
+MESSAGE_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]] = {
+    'text': _handle_text,
+    'image': _handle_media,
+    'document': _handle_media,
+    'audio': _handle_media,
+    'video': _handle_media,
+    'sticker': _handle_media,
+}
 
 class WebhookHandler:
     """
@@ -15,20 +40,20 @@ class WebhookHandler:
         logger.info("📥 Processing webhook payload")
         
         try:
-            for entry in payload.get('entry', []):
-                for change in entry.get('changes', []):
-                    if change.get('field') == 'messages':
-                        value = change.get('value', {})
-                        
-                        # Process messages
-                        messages = value.get('messages', [])
-                        for message in messages:
-                            await WebhookHandler._process_message(message)
-                        
-                        # Process status updates
-                        statuses = value.get('statuses', [])
-                        for status in statuses:
-                            await WebhookHandler._process_status(status)
+            # Handle every message of the payload concurrently; statuses go out as one bulk UPDATE
+            tasks = [
+                WebhookHandler._process_message(message)
+                for value in WebhookHandler._message_values(payload)
+                for message in value.get('messages', ())
+            ]
+            
+            status_rows = WebhookHandler.latest_statuses(payload)
+            if status_rows:
+                tasks.append(WebhookHandler._update_statuses(status_rows))
+            
+            # return_exceptions: one bad item doesn't abort the rest of the batch
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
             
             return {"status": "processed", "message": "Webhook handled successfully"}
             
@@ -36,6 +61,32 @@ class WebhookHandler:
             logger.error(f"❌ Error processing webhook: {e}")
             return {"status": "error", "message": str(e)}
     
+    @staticmethod
+    async def process_statuses(payload: Dict[str, Any]):
+        """Apply only the delivery statuses of a webhook (the incoming_messages consumer
+        answers the messages themselves through auto_reply)"""
+        status_rows = WebhookHandler.latest_statuses(payload)
+        if status_rows:
+            await WebhookHandler._update_statuses(status_rows)
+    
+    @staticmethod
+    def _message_values(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        for entry in payload.get('entry', ()):
+            for change in entry.get('changes', ()):
+                if change.get('field') == 'messages':
+                    yield change.get('value') or {}
+    
+    @staticmethod
+    def latest_statuses(payload: Dict[str, Any]) -> List[Tuple[str, str, datetime]]:
+        """One (wamid, status, status_timestamp) row per wamid - the latest in the payload"""
+        status_rows = {}
+        for value in WebhookHandler._message_values(payload):
+            for row in map(WebhookHandler._process_status, value.get('statuses', ())):
+                # sent/delivered/read for one wamid often share a payload - keep the latest
+                if row and (row[0] not in status_rows or status_rows[row[0]][2] <= row[2]):
+                    status_rows[row[0]] = row
+        return list(status_rows.values())
+    
     @staticmethod
     async def _process_message(message_data: Dict[str, Any]):
         """Process individual message"""
@@ -47,9 +98,7 @@ class WebhookHandler:
             logger.info(f"💬 Received {message_type} message from {from_number}")
             
             # Extract message content based on type
-            if message_type == 'text':
-                content = message_data.get('text', {}).get('body', '')
-                logger.info(f"📝 Message content: {content}")
+            await MESSAGE_HANDLERS.get(message_type, _handle_unknown)(message_data)
             
             # Here you would save to database and notify the business
             # For now, just log it
@@ -58,18 +107,59 @@ class WebhookHandler:
             logger.error(f"❌ Error processing message: {e}")
     
     @staticmethod
-    async def _process_status(status_data: Dict[str, Any]):
-        """Process message status updates"""
+    def _process_status(status_data: Dict[str, Any]) -> Optional[Tuple[str, str, datetime]]:
+        """Turn one status update into a (wamid, status, status_timestamp) row"""
         try:
-            message_id = status_data.get('id')
-            status = status_data.get('status')
+            message_id = status_data['id']
+            status = status_data['status']
             
             logger.info(f"📊 Message {message_id} status: {status}")
             
-            # Here you would update message status in database
+            return message_id, status, datetime.utcfromtimestamp(int(status_data['timestamp']))
             
         except Exception as e:
             logger.error(f"❌ Error processing status: {e}")
+            return None
+    
+    @staticmethod
+    async def record_wamid(message_id: str, wamid: str):
+        """Store the id the Graph API gave an outbound send, so its statuses can find the row"""
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Message)
+                    .where(Message.id == message_id)
+                    .values(wamid=wamid)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"❌ Error recording wamid for message {message_id}: {e}")
+    
+    @staticmethod
+    async def _update_statuses(rows: list):
+        """Apply every status row of a webhook in one UPDATE ... FROM (VALUES ...)"""
+        try:
+            incoming = values(
+                column('wamid', String),
+                column('status', String),
+                column('status_timestamp', DateTime),
+                name='incoming'
+            ).data(rows)
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Message)
+                    .where(
+                        Message.wamid == incoming.c.wamid,
+                        # Webhooks arrive out of order - never move a message back to an older status
+                        or_(Message.status_timestamp.is_(None), Message.status_timestamp <= incoming.c.status_timestamp)
+                    )
+                    .values(status=incoming.c.status, status_timestamp=incoming.c.status_timestamp)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"❌ Error updating {len(rows)} message statuses: {e}")
 
 # Global instance
 webhook_handler = WebhookHandler()
\ No newline at end of file
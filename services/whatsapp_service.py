@@ -1,8 +1,34 @@
-import requests
-import json
 import asyncio
-from typing import Dict, Any, Optional
+import random
+import httpx
+import orjson
+from typing import Dict, Any, Optional, Tuple
 from loguru import logger
+from core.config import settings
+from sqlalchemy import select
+from database.session import AsyncSessionLocal
+from database.models import WhatsAppAccount
+
+# Fallback sender for sends that don't carry tenant credentials (webhook auto-replies,
+# queued messages) - resolved once at import from WHATSAPP_* in env/.env. Unset means
+# "not configured": those sends are logged and skipped
+DEFAULT_PHONE_NUMBER_ID = settings.WHATSAPP_PHONE_NUMBER_ID
+DEFAULT_ACCESS_TOKEN = settings.WHATSAPP_ACCESS_TOKEN
+if not DEFAULT_PHONE_NUMBER_ID or not DEFAULT_ACCESS_TOKEN:
+    logger.warning("⚠️ WHATSAPP_PHONE_NUMBER_ID / WHATSAPP_ACCESS_TOKEN not set - auto-replies and untargeted sends are disabled")
+
+# Deletes every non-digit in the Latin-1 range in one C-level str.translate pass
+_NON_DIGITS = str.maketrans('', '', ''.join(c for c in map(chr, range(256)) if not c.isdigit()))
+
+def digits_only(number: str) -> str:
+    """Strip spaces, '+', dashes etc. from a phone number"""
+    if number.isascii():
+        return number.translate(_NON_DIGITS)
+    # Rare non-ASCII input keeps the exact str.isdigit semantics
+    return ''.join(filter(str.isdigit, number))
+
+# Graph API throttling / transient errors - retried inside the call before giving up
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
 
 class WhatsAppService:
     """
@@ -10,16 +36,62 @@ class WhatsAppService:
     """
     
     def __init__(self):
-        self.base_url = "https://graph.facebook.com/v18.0"
+        self.base_url = settings.WHATSAPP_API_URL
+        self._client: Optional[httpx.AsyncClient] = None
         logger.info("WhatsApp Service initialized")
     
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared Graph API client - keep-alive + HTTP/2, so sends reuse one TLS session"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=True,
+                timeout=settings.WHATSAPP_API_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=settings.WHATSAPP_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.WHATSAPP_HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=settings.WHATSAPP_HTTP_KEEPALIVE_EXPIRY
+                )
+            )
+        return self._client
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def post_message(self, phone_number_id: str, access_token: str, payload: Dict[str, Any]) -> httpx.Response:
+        """POST a payload to /{phone_number_id}/messages on the shared client"""
+        # Serialized by orjson up front - httpx's json= goes through the stdlib encoder
+        content = orjson.dumps(payload)
+        headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+        for attempt in range(settings.WHATSAPP_MAX_RETRIES + 1):
+            response = await self.client.post(f"/{phone_number_id}/messages", content=content, headers=headers)
+            if response.status_code not in RETRYABLE_STATUSES or attempt == settings.WHATSAPP_MAX_RETRIES:
+                break
+            delay = self.retry_delay(response, attempt)
+            logger.warning(f"⏳ WhatsApp API {response.status_code}, retry {attempt + 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        return response
+    
+    @staticmethod
+    def retry_delay(response: httpx.Response, attempt: int) -> float:
+        """Retry-After when the Graph API sends one, else 2**attempt - plus jitter, capped"""
+        try:
+            delay = float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            delay = 2 ** attempt
+        return min(delay + random.random(), settings.WHATSAPP_RETRY_MAX_DELAY)
+    
     async def send_message(
         self, 
         to: str,
         message: str,
         message_type: str = "text",
         phone_number_id: str = None,
-        access_token: str = None
+        access_token: str = None,
+        tenant_id: str = None
     ) -> bool:
         """
         Send a message via WhatsApp Business API
@@ -28,36 +100,14 @@ class WhatsAppService:
         logger.info(f"📤 Sending {message_type} message to {to}")
         
         # Format phone number (remove any spaces/special characters)
-        to_number = ''.join(filter(str.isdigit, to))
+        to_number = digits_only(to)
         
-        # For scheduled messages, you might need to get phone_number_id and access_token from database
-        # For now, using parameters or environment variables
+        # Callers normally pass the account's credentials; otherwise look them up
         if not phone_number_id or not access_token:
-            # Try to get from environment or database
-            # You might want to modify this based on your setup
-            from database.session import SessionLocal
-            from database.models import WhatsAppAccount
-            
-            db = SessionLocal()
-            try:
-                # Get the first active WhatsApp account
-                # In production, you might want to get tenant-specific account
-                whatsapp_account = db.query(WhatsAppAccount).filter(
-                    WhatsAppAccount.is_active == True
-                ).first()
-                
-                if whatsapp_account:
-                    phone_number_id = whatsapp_account.phone_number_id
-                    access_token = whatsapp_account.access_token
-                else:
-                    logger.error("❌ No active WhatsApp account found")
-                    return False
-                    
-            except Exception as e:
-                logger.error(f"❌ Failed to get WhatsApp account: {e}")
+            credentials = await self.get_credentials(tenant_id)
+            if credentials is None:
                 return False
-            finally:
-                db.close()
+            phone_number_id, access_token = credentials
         
         if message_type == "text":
             return await self.send_text_message(phone_number_id, access_token, to_number, message)
@@ -66,6 +116,30 @@ class WhatsAppService:
             logger.warning(f"⚠️ Message type '{message_type}' not fully implemented, using text")
             return await self.send_text_message(phone_number_id, access_token, to_number, message)
     
+    async def get_credentials(self, tenant_id: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """
+        Active account credentials for a tenant (or the first active account).
+        Fallback only - queued sends resolve theirs through account_cache
+        """
+        query = select(WhatsAppAccount.phone_number_id, WhatsAppAccount.access_token).where(
+            WhatsAppAccount.is_active == True
+        ).limit(1)
+        if tenant_id:
+            query = query.where(WhatsAppAccount.tenant_id == tenant_id)
+        try:
+            # Pooled async session - a miss doesn't block the event loop
+            async with AsyncSessionLocal() as db:
+                whatsapp_account = (await db.execute(query)).first()
+        except Exception as e:
+            logger.error(f"❌ Failed to get WhatsApp account: {e}")
+            return None
+        
+        if not whatsapp_account:
+            logger.error("❌ No active WhatsApp account found")
+            return None
+        
+        return tuple(whatsapp_account)
+    
     async def send_text_message(
         self, 
         phone_number_id: str,
@@ -90,26 +164,13 @@ class WhatsAppService:
             }
         }
         
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-        
-        url = f"{self.base_url}/{phone_number_id}/messages"
-        
         try:
-            logger.info(f"🔗 Calling WhatsApp API: {url}")
+            logger.info(f"🔗 Calling WhatsApp API: {self.base_url}/{phone_number_id}/messages")
             
-            # Use async HTTP client in production (aiohttp)
-            # For now using requests with async wrapper
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None, 
-                lambda: requests.post(url, json=payload, headers=headers, timeout=30)
-            )
+            response = await self.post_message(phone_number_id, access_token, payload)
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 message_id = result.get("messages", [{}])[0].get("id")
                 logger.success(f"✅ Message sent successfully! ID: {message_id}")
                 return True
@@ -137,7 +198,7 @@ class WhatsAppService:
         """
         logger.info(f"📤 Sending template '{template_name}' to {to_number}")
         
-        to_number = ''.join(filter(str.isdigit, to_number))
+        to_number = digits_only(to_number)
         
         payload = {
             "messaging_product": "whatsapp",
@@ -151,22 +212,11 @@ class WhatsAppService:
             }
         }
         
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-        
-        url = f"{self.base_url}/{phone_number_id}/messages"
-        
         try:
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: requests.post(url, json=payload, headers=headers, timeout=30)
-            )
+            response = await self.post_message(phone_number_id, access_token, payload)
             response.raise_for_status()
             
-            result = response.json()
+            result = orjson.loads(response.content)
             message_id = result.get("messages", [{}])[0].get("id")
             logger.success(f"✅ Template message sent! ID: {message_id}")
             return True
@@ -192,18 +242,7 @@ class WhatsAppService:
                 "message_id": message_id
             }
             
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
-            
-            url = f"{self.base_url}/{phone_number_id}/messages"
-            
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: requests.post(url, json=payload, headers=headers, timeout=10)
-            )
+            response = await self.post_message(phone_number_id, access_token, payload)
             response.raise_for_status()
             
             logger.info(f"✅ Message {message_id} marked as read")
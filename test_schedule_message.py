@@ -1,6 +1,5 @@
 # test_schedule_message.py
 import hmac
-import hashlib
 import time
 import requests
 import json
@@ -9,15 +8,13 @@ from datetime import datetime, timedelta
 # ✅ USE REAL CREDENTIALS FROM YOUR DATABASE
 CLIENT_ID = "eef44639-6fcb-463c-a9dc-4f9f900a2805"
 HMAC_SECRET = "my_hmac_secret_123"
+# Encoded once, not per signature
+_HMAC_KEY = HMAC_SECRET.encode('utf-8')
 
-def generate_hmac_signature(body: str, secret: str) -> tuple:
+def generate_hmac_signature(body: str, key: bytes) -> tuple:
     timestamp = str(int(time.time()))
-    message = f"{timestamp}.{body}"
-    signature = hmac.new(
-        key=secret.encode('utf-8'),
-        msg=message.encode('utf-8'),
-        digestmod=hashlib.sha256
-    ).hexdigest()
+    # One-shot C HMAC - no HMAC object per call
+    signature = hmac.digest(key, f"{timestamp}.{body}".encode('utf-8'), 'sha256').hex()
     return timestamp, signature
 
 # Test data with new format
@@ -31,7 +28,7 @@ test_data = {
 }
 
 body_str = json.dumps(test_data)
-timestamp, signature = generate_hmac_signature(body_str, HMAC_SECRET)
+timestamp, signature = generate_hmac_signature(body_str, _HMAC_KEY)
 
 headers = {
     'X-Client-ID': CLIENT_ID,
@@ -0,0 +1,134 @@
+"""Shared fakes - the suite runs without Postgres, Redis or RabbitMQ"""
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from services.cache import cache_service
+
+
+def compile_pg(statement) -> str:
+    """Render a statement as Postgres SQL with its parameters inlined"""
+    return str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+class FakeResult(list):
+    """Iterable result rows with the all()/first() calls the code under test uses"""
+
+    rowcount = 0
+
+    def all(self):
+        return list(self)
+
+    def first(self):
+        return self[0] if self else None
+
+
+class FakeAsyncSession:
+    """AsyncSession stand-in: records executed statements, answers from a queue of results"""
+
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.statements = []
+        self.commits = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, *args, **kwargs):
+        self.statements.append(statement)
+        return FakeResult(self.results.pop(0) if self.results else [])
+
+    async def commit(self):
+        self.commits += 1
+
+
+class FakePipeline:
+    """MULTI/EXEC pipeline over FakeRedis: commands queue up and run on execute()"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def incr(self, key):
+        self.ops.append(lambda: self.redis.incr(key))
+
+    def expire(self, key, ttl):
+        self.ops.append(lambda: True)
+
+    def sadd(self, key, member):
+        self.ops.append(lambda: self.redis.store.setdefault(key, set()).add(member))
+
+    async def execute(self):
+        return [op() for op in self.ops]
+
+
+class FakeRedis:
+    """In-memory stand-in for the redis.asyncio commands cache_service.client sees.
+    Set `down` to make every command fail like an unreachable server"""
+
+    def __init__(self):
+        self.store = {}
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError("redis down")
+
+    @staticmethod
+    def _encode(value):
+        # Redis hands everything back as bytes
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def incr(self, key):
+        self.store[key] = self.store.get(key, 0) + 1
+        return self.store[key]
+
+    def pipeline(self, transaction=True):
+        self._check()
+        return FakePipeline(self)
+
+    async def get(self, key):
+        self._check()
+        return self.store.get(key)
+
+    async def set(self, key, value, nx=False, ex=None):
+        self._check()
+        if nx and key in self.store:
+            return None
+        self.store[key] = self._encode(value)
+        return True
+
+    async def setex(self, key, ttl, value):
+        self._check()
+        self.store[key] = self._encode(value)
+
+    async def delete(self, *keys):
+        self._check()
+        return sum(self.store.pop(key, None) is not None for key in keys)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    """Point the shared cache_service at an in-memory Redis"""
+    client = FakeRedis()
+    monkeypatch.setattr(cache_service, "client", client)
+    return client
+
+
+@pytest.fixture
+def use_sessions(monkeypatch):
+    """Make `module.AsyncSessionLocal()` hand out the given fake sessions in order"""
+
+    def use(module, *sessions):
+        queue = iter(sessions)
+        monkeypatch.setattr(module, "AsyncSessionLocal", lambda: next(queue))
+
+    return use
@@ -0,0 +1,44 @@
+import asyncio
+
+from sqlalchemy.orm import Session
+
+from services import account_cache as account_cache_module
+from services.account_cache import DEFAULT_SCOPE, account_cache
+
+
+def cached(redis, *scopes):
+    for scope in scopes:
+        redis.store[account_cache.key(scope)] = b"{}"
+
+
+def test_commit_on_the_event_loop_evicts_through_the_async_client(monkeypatch, redis):
+    cached(redis, "t1", "t2", DEFAULT_SCOPE)
+
+    def blocking_delete(*keys):
+        raise AssertionError("sync Redis call on the event loop")
+
+    monkeypatch.setattr(account_cache._sync_client, "delete", blocking_delete)
+
+    async def scenario():
+        session = Session()
+        session.info[account_cache_module._PENDING_SCOPES] = {"t1"}
+        session.commit()
+        # Nothing is deleted inside the commit; the eviction runs right after
+        assert account_cache.key("t1") in redis.store
+        await asyncio.gather(*account_cache._evictions)
+
+    asyncio.run(scenario())
+
+    assert set(redis.store) == {account_cache.key("t2")}
+
+
+def test_commit_off_the_loop_evicts_inline(monkeypatch):
+    deleted = []
+    monkeypatch.setattr(account_cache._sync_client, "delete", lambda *keys: deleted.extend(keys))
+
+    session = Session()
+    session.info[account_cache_module._PENDING_SCOPES] = {"t1"}
+    session.commit()
+
+    assert deleted == [account_cache.key("t1"), account_cache.key(DEFAULT_SCOPE)]
+    assert account_cache_module._PENDING_SCOPES not in session.info
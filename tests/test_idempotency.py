@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from routes import clients
+
+
+def counting_handler(monkeypatch, gate=None):
+    calls = []
+
+    async def handler(to_number, message, db, label="Auto-message"):
+        calls.append(to_number)
+        if gate is not None:
+            await gate.wait()
+        return {"message_id": f"m{len(calls)}", "status": "queued"}
+
+    monkeypatch.setattr(clients, "send_message_handler", handler)
+    return calls
+
+
+def test_repeated_key_replays_first_response(monkeypatch, redis):
+    calls = counting_handler(monkeypatch)
+
+    first = asyncio.run(clients.send_idempotent("order-confirm", "key-1", "+1", "hi", None))
+    again = asyncio.run(clients.send_idempotent("order-confirm", "key-1", "+1", "hi", None))
+
+    assert first == again == {"message_id": "m1", "status": "queued"}
+    assert len(calls) == 1
+
+
+def test_concurrent_retries_send_once(monkeypatch, redis):
+    async def scenario():
+        gate = asyncio.Event()
+        calls = counting_handler(monkeypatch, gate)
+        first = asyncio.create_task(clients.send_idempotent("order-confirm", "key-1", "+1", "hi", None))
+        await asyncio.sleep(0)
+        # Second retry arrives while the first is still sending
+        with pytest.raises(HTTPException) as exc:
+            await clients.send_idempotent("order-confirm", "key-1", "+1", "hi", None)
+        gate.set()
+        await first
+        return calls, exc.value
+
+    calls, error = asyncio.run(scenario())
+
+    assert error.status_code == 409
+    assert len(calls) == 1
+
+
+def test_failed_send_releases_the_key(monkeypatch, redis):
+    async def failing(to_number, message, db, label="Auto-message"):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(clients, "send_message_handler", failing)
+    with pytest.raises(RuntimeError):
+        asyncio.run(clients.send_idempotent("order-confirm", "key-1", "+1", "hi", None))
+    assert redis.store == {}
+
+    calls = counting_handler(monkeypatch)
+    asyncio.run(clients.send_idempotent("order-confirm", "key-1", "+1", "hi", None))
+    assert len(calls) == 1
+
+
+def test_no_key_always_sends(monkeypatch, redis):
+    calls = counting_handler(monkeypatch)
+    asyncio.run(clients.send_idempotent("order-confirm", None, "+1", "hi", None))
+    asyncio.run(clients.send_idempotent("order-confirm", None, "+1", "hi", None))
+    assert len(calls) == 2 and redis.store == {}
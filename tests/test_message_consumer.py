@@ -0,0 +1,58 @@
+import asyncio
+
+import httpx
+
+from services import message_consumer
+from services.account_cache import account_cache
+from services.message_consumer import AckBatcher
+
+
+class FakeDelivery:
+    def __init__(self, tag, calls):
+        self.delivery_tag = tag
+        self.calls = calls
+
+    async def ack(self, multiple=False):
+        self.calls.append(("ack", self.delivery_tag, multiple))
+
+    async def nack(self, multiple=False, requeue=True):
+        self.calls.append(("nack", self.delivery_tag, multiple, requeue))
+
+
+def test_failed_delivery_is_requeued_alone():
+    calls = []
+    handled = [FakeDelivery(tag, calls) for tag in (1, 2)]
+    failed = FakeDelivery(3, calls)
+
+    async def scenario():
+        batcher = AckBatcher(batch_size=10, timeout=1.0)
+        for delivery in handled:
+            batcher.add(delivery)
+        await batcher.nack_failed(failed)
+        return batcher
+
+    batcher = asyncio.run(scenario())
+
+    # Sent deliveries are acked, not requeued for a duplicate send
+    assert calls == [("ack", 2, True), ("nack", 3, False, True)]
+    assert batcher.count == 0
+
+
+def test_401_evicts_the_tenants_cached_account(monkeypatch, redis):
+    sender = {"tenant_id": "t1", "phone_number_id": "555", "access_token": "old"}
+
+    async def resolve(tenant_id):
+        return sender
+
+    async def post_message(phone_number_id, access_token, payload):
+        return httpx.Response(401)
+
+    monkeypatch.setattr(account_cache, "resolve", resolve)
+    monkeypatch.setattr(message_consumer.whatsapp_service, "post_message", post_message)
+    redis.store[account_cache.key("t1")] = b"{}"
+
+    sent = asyncio.run(message_consumer.process_outgoing_message(
+        {"message_id": "m1", "tenant_id": "t1", "to_number": "+1", "content": "hi"}
+    ))
+
+    assert sent is False and account_cache.key("t1") not in redis.store
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from services import message_queue as queue_module
+from services.message_queue import PublishBuffer, RabbitMQService
+
+
+class FakeExchange:
+    def __init__(self, fail):
+        self.fail = fail
+
+    async def publish(self, message, routing_key):
+        if self.fail:
+            raise RuntimeError("NACK")
+
+
+class FakeChannel:
+    def __init__(self, fail=False):
+        self.default_exchange = FakeExchange(fail)
+
+    async def declare_queue(self, name, durable):
+        return None
+
+
+class FakeConnection:
+    def __init__(self):
+        self.is_closed = False
+
+    async def channel(self, publisher_confirms=True):
+        return FakeChannel()
+
+    async def close(self):
+        self.is_closed = True
+
+
+class FakePool:
+    def __init__(self, fail=False):
+        self.closed = False
+        self.fail = fail
+
+    def acquire(self):
+        pool = self
+
+        class Lease:
+            async def __aenter__(self):
+                return FakeChannel(pool.fail)
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Lease()
+
+    async def close(self):
+        self.closed = True
+
+
+def connected_service(monkeypatch):
+    connections = []
+
+    async def connect_robust(url, heartbeat):
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(queue_module.aio_pika, "connect_robust", connect_robust)
+    monkeypatch.setattr(queue_module, "Pool", lambda factory, max_size: FakePool())
+    service = RabbitMQService()
+    asyncio.run(service.connect())
+    return service, connections
+
+
+def test_nack_keeps_the_connection(monkeypatch):
+    service, connections = connected_service(monkeypatch)
+    service.channel_pool = FakePool(fail=True)
+
+    assert asyncio.run(service.send_message("outgoing_messages", {"n": 1})) is False
+    assert asyncio.run(service.send_messages_batch("outgoing_messages", [{"n": 1}])) == [False]
+
+    # A rejected publish is not a dead connection - no reconnect
+    assert service.is_connected and len(connections) == 1
+
+
+def test_reconnect_closes_the_old_connection_and_pool(monkeypatch):
+    service, connections = connected_service(monkeypatch)
+    old_pool = service.channel_pool
+    service.is_connected = False
+
+    assert asyncio.run(service.send_message("outgoing_messages", {"n": 1})) is True
+
+    assert len(connections) == 2 and service.connection is connections[1]
+    assert connections[0].is_closed
+    assert old_pool.closed and service.channel_pool is not old_pool
+
+
+def test_cancel_during_flush_fails_the_waiting_publishers():
+    class SlowService:
+        async def send_messages(self, queue_name, messages):
+            await asyncio.Event().wait()
+
+    async def scenario():
+        buffer = PublishBuffer(SlowService())
+        buffer.max_delay = 0
+        buffer.start()
+        publish = asyncio.create_task(buffer.publish("outgoing_messages", {"n": 1}))
+        await asyncio.sleep(0.01)
+        await buffer.stop()
+        return await asyncio.wait_for(publish, 1)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(scenario())
@@ -0,0 +1,103 @@
+import asyncio
+from types import SimpleNamespace
+
+from database.models import Message, OutboxMessage
+from routes import clients
+from services import outbox as outbox_module
+from services.outbox import OutboxDispatcher
+from tests.conftest import FakeAsyncSession, compile_pg
+
+
+class FakeSyncSession:
+    """Sync Session stand-in for send_message_handler's threadpool transaction"""
+
+    def __init__(self):
+        self.added = []
+        self.commits = 0
+
+    def add(self, obj):
+        self.added.append(obj)
+
+    def flush(self):
+        for obj in self.added:
+            if isinstance(obj, Message) and obj.id is None:
+                obj.id = "message-1"
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_send_enqueues_outbox_row_in_the_message_transaction(monkeypatch):
+    notified = []
+
+    async def sender(db):
+        return {"tenant_id": "t1", "tenant_name": "demo", "account_id": "a1", "phone_number": "+100"}
+
+    monkeypatch.setattr(clients, "get_sender", sender)
+    monkeypatch.setattr(clients.outbox_dispatcher, "notify", lambda: notified.append(True))
+    db = FakeSyncSession()
+
+    result = asyncio.run(clients.send_message_handler("+200", "hello", db))
+
+    message, outbox_row = db.added
+    assert isinstance(message, Message) and isinstance(outbox_row, OutboxMessage)
+    assert outbox_row.queue == "outgoing_messages"
+    assert outbox_row.payload == {
+        "message_id": "message-1", "to_number": "+200", "content": "hello", "tenant_name": "demo"
+    }
+    # One commit covers both rows; the dispatcher is woken only afterwards
+    assert db.commits == 1 and notified == [True]
+    assert result["message_id"] == "message-1"
+
+
+def test_dispatch_deletes_only_confirmed_rows(monkeypatch, use_sessions):
+    rows = [
+        SimpleNamespace(id="o1", queue="outgoing_messages", payload={"n": 1}),
+        SimpleNamespace(id="o2", queue="outgoing_messages", payload={"n": 2}),
+        SimpleNamespace(id="o3", queue="webhook_notifications", payload={"n": 3}),
+    ]
+    session = FakeAsyncSession(results=[rows])
+    published = {}
+
+    async def send_messages_batch(queue_name, payloads):
+        published[queue_name] = payloads
+        # Partial publish: the first outgoing message is confirmed, the rest are not
+        return [queue_name == "outgoing_messages" and payload["n"] == 1 for payload in payloads]
+
+    use_sessions(outbox_module, session)
+    monkeypatch.setattr(outbox_module, "rabbitmq_service", SimpleNamespace(send_messages_batch=send_messages_batch))
+    dispatcher = OutboxDispatcher()
+
+    dispatched = asyncio.run(dispatcher.dispatch_batch())
+
+    # Counts what was published, not what was claimed - the run loop backs off on failures
+    assert dispatched == 1 and dispatcher.failed_rounds == 1
+    assert published == {"outgoing_messages": [{"n": 1}, {"n": 2}], "webhook_notifications": [{"n": 3}]}
+    select_sql, delete_sql, update_sql = (compile_pg(statement) for statement in session.statements)
+    assert "FOR UPDATE SKIP LOCKED" in select_sql
+    assert delete_sql.startswith("DELETE FROM outbox") and "('o1')" in delete_sql
+    assert update_sql.startswith("UPDATE outbox SET attempts=(outbox.attempts + 1)") and "('o2', 'o3')" in update_sql
+    assert session.commits == 1
+
+
+def test_fully_confirmed_batch_resets_the_backoff(monkeypatch, use_sessions):
+    rows = [SimpleNamespace(id="o1", queue="outgoing_messages", payload={"n": 1})]
+
+    async def send_messages_batch(queue_name, payloads):
+        return [True] * len(payloads)
+
+    use_sessions(outbox_module, FakeAsyncSession(results=[rows]))
+    monkeypatch.setattr(outbox_module, "rabbitmq_service", SimpleNamespace(send_messages_batch=send_messages_batch))
+    dispatcher = OutboxDispatcher()
+    dispatcher.failed_rounds = 3
+
+    assert asyncio.run(dispatcher.dispatch_batch()) == 1
+    assert dispatcher.failed_rounds == 0
+
+
+def test_dispatch_empty_outbox(use_sessions):
+    session = FakeAsyncSession()
+    use_sessions(outbox_module, session)
+
+    assert asyncio.run(OutboxDispatcher().dispatch_batch()) == 0
+    assert session.commits == 0
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from core.config import settings
+from core.security import SecurityManager
+from middleware import rate_limiter
+
+
+def test_limit_is_crossed_on_the_request_after_the_limit(redis):
+    async def scenario():
+        return [await rate_limiter.check_rate_limit("t1", 3) for _ in range(5)]
+
+    assert asyncio.run(scenario()) == [True, True, True, False, False]
+    # One counter per tenant and window, in the rl:minute: scheme
+    assert all(key.startswith("rl:minute:t1:") for key in redis.store if not key.startswith("rl:minute:seen"))
+
+
+def test_tenants_have_separate_budgets(redis):
+    async def scenario():
+        await rate_limiter.check_rate_limit("t1", 1)
+        return await rate_limiter.check_rate_limit("t2", 1)
+
+    assert asyncio.run(scenario()) is True
+
+
+def test_redis_down_falls_back_to_db_counter(monkeypatch, redis):
+    redis.down = True
+
+    async def db_count(tenant_id, window):
+        return 11
+
+    monkeypatch.setattr(rate_limiter, "_increment_in_db", db_count)
+    assert asyncio.run(rate_limiter.check_rate_limit("t1", 10)) is False
+
+
+def test_both_stores_down_fails_open(monkeypatch, redis):
+    redis.down = True
+
+    async def db_down(tenant_id, window):
+        raise ConnectionError("db down")
+
+    monkeypatch.setattr(rate_limiter, "_increment_in_db", db_down)
+    assert asyncio.run(rate_limiter.check_rate_limit("t1", 10)) is True
+
+
+def test_security_manager_shares_the_middleware_counter(monkeypatch, redis):
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_MINUTE", 2)
+
+    async def scenario():
+        await SecurityManager.check_rate_limit("t1")
+        await rate_limiter.check_rate_limit("t1", 2)
+        await SecurityManager.check_rate_limit("t1")
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(scenario())
+    assert exc.value.status_code == 429
+    assert len([key for key in redis.store if key.startswith("rl:minute:t1:")]) == 1
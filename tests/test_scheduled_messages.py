@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+from uuid import UUID
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.dialects.postgresql import asyncpg
+
+from routes.scheduled_messages import parse_scheduled_time, scheduled_page_query
+
+CURSOR_ID = UUID("6f1c1b9e-3c1a-4d8e-9a57-2b0f3d7c5e11")
+
+
+def test_cursor_query_binds_the_id_as_uuid():
+    query = scheduled_page_query("t1", datetime(2024, 1, 1), CURSOR_ID, 100)
+
+    compiled = query.compile(dialect=asyncpg.dialect())
+
+    # uuid > varchar has no operator in Postgres - the cursor id must bind as ::UUID
+    assert "(scheduled_messages.scheduled_at, scheduled_messages.id) > " \
+           "($2::TIMESTAMP WITHOUT TIME ZONE, $3::UUID)" in str(compiled)
+    assert str(CURSOR_ID) in compiled.params.values()
+
+
+def test_time_only_cursor_and_first_page():
+    with_time = str(scheduled_page_query("t1", datetime(2024, 1, 1), None, 100).compile(dialect=asyncpg.dialect()))
+    first_page = str(scheduled_page_query("t1", None, None, 100).compile(dialect=asyncpg.dialect()))
+
+    assert "scheduled_messages.scheduled_at > $2::TIMESTAMP WITHOUT TIME ZONE" in with_time
+    assert ") > (" not in with_time
+    assert "scheduled_at >" not in first_page
+
+
+def test_parse_scheduled_time_normalizes_offsets_to_naive_utc():
+    local = (datetime.utcnow() + timedelta(days=1)).replace(microsecond=0)
+
+    assert parse_scheduled_time(local.isoformat()) == local
+    assert parse_scheduled_time(local.isoformat() + "Z") == local
+    shifted = parse_scheduled_time(local.isoformat() + "+05:30")
+    assert shifted.tzinfo is None and shifted == local - timedelta(hours=5, minutes=30)
+
+
+def test_parse_scheduled_time_rejects_past_and_garbage():
+    for value in ["2020-01-01T00:00:00Z", "2020-01-01T00:00:00+05:30", "tomorrow"]:
+        with pytest.raises(HTTPException) as exc:
+            parse_scheduled_time(value)
+        assert exc.value.status_code == 400
@@ -0,0 +1,47 @@
+import asyncio
+from types import SimpleNamespace
+
+from services import scheduler as scheduler_module
+from services.scheduler import MessageScheduler
+from tests.conftest import FakeAsyncSession, compile_pg
+
+
+def test_mark_failed_casts_case_to_the_status_enum():
+    session = FakeAsyncSession()
+
+    asyncio.run(MessageScheduler().mark_failed(session, ["s1"], "boom"))
+
+    sql = compile_pg(session.statements[0])
+    assert "CAST(CASE WHEN (scheduled_messages.attempts >= scheduled_messages.max_attempts) " \
+           "THEN 'permanently_failed' ELSE 'failed' END AS scheduled_status)" in sql
+    assert "RETURNING scheduled_messages.id, scheduled_messages.status" in sql
+
+
+def test_tick_commits_the_claim_before_publishing(monkeypatch, use_sessions):
+    due = SimpleNamespace(id="s1", tenant_id="t1", to_number="+1", message="hi", message_type="text")
+    account = SimpleNamespace(tenant_id="t1", id="a1", phone_number_id="555")
+    claim = FakeAsyncSession(results=[[due], [], [account]])
+    record = FakeAsyncSession()
+    published = []
+
+    async def send_messages_batch(queue_name, payloads):
+        # Claim transaction is already committed - no row locks held across the publish
+        assert claim.commits == 1
+        published.extend(payloads)
+        return [True] * len(payloads)
+
+    use_sessions(scheduler_module, claim, record)
+    monkeypatch.setattr(scheduler_module, "rabbitmq_service", SimpleNamespace(send_messages_batch=send_messages_batch))
+
+    assert asyncio.run(MessageScheduler().process_due_messages()) == 1
+
+    select_sql = compile_pg(claim.statements[0])
+    assert "scheduled_messages.status IN ('scheduled', 'failed')" in select_sql
+    assert "FOR UPDATE SKIP LOCKED" in select_sql
+    assert "status='processing'" in compile_pg(claim.statements[1])
+    # No access token in the persistent queue message
+    assert published == [{
+        "message_id": "s1", "tenant_id": "t1", "whatsapp_account_id": "a1", "phone_number_id": "555",
+        "to_number": "+1", "content": "hi", "message_type": "text", "is_scheduled": True
+    }]
+    assert "status='sent'" in compile_pg(record.statements[0]) and record.commits == 1
@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import orjson
+
+from services import message_consumer
+from services import webhook_handler as webhook_module
+from services.webhook_handler import WebhookHandler
+from tests.conftest import FakeAsyncSession, compile_pg
+
+
+def status(wamid, value, timestamp):
+    return {"id": wamid, "status": value, "timestamp": str(timestamp)}
+
+
+def webhook(*statuses):
+    return {"entry": [{"changes": [{"field": "messages", "value": {"statuses": list(statuses)}}]}]}
+
+
+def test_process_status_is_pure_row():
+    row = WebhookHandler._process_status(status("wamid.1", "read", 1700000000))
+    assert row[:2] == ("wamid.1", "read")
+    assert row[2].isoformat() == "2023-11-14T22:13:20"
+    assert WebhookHandler._process_status({"id": "wamid.1"}) is None
+
+
+def test_statuses_are_applied_in_one_bulk_update(use_sessions):
+    session = FakeAsyncSession()
+    use_sessions(webhook_module, session)
+
+    result = asyncio.run(WebhookHandler.process_webhook(webhook(
+        status("wamid.1", "sent", 100),
+        status("wamid.1", "read", 300),
+        status("wamid.1", "delivered", 200),
+        status("wamid.2", "delivered", 150),
+    )))
+
+    assert result["status"] == "processed"
+    assert len(session.statements) == 1 and session.commits == 1
+    sql = compile_pg(session.statements[0])
+    assert sql.startswith("UPDATE messages SET status=incoming.status, status_timestamp=incoming.status_timestamp")
+    assert "FROM (VALUES" in sql
+    assert "messages.wamid = incoming.wamid" in sql
+    # Out-of-order guard: an older status never overwrites a newer one
+    assert "messages.status_timestamp IS NULL OR messages.status_timestamp <= incoming.status_timestamp" in sql
+    # Latest status per wamid only
+    assert "'wamid.1', 'read'" in sql and "'sent'" not in sql and "'wamid.1', 'delivered'" not in sql
+    assert "'wamid.2', 'delivered'" in sql
+
+
+def test_no_statuses_no_update(use_sessions):
+    session = FakeAsyncSession()
+    use_sessions(webhook_module, session)
+
+    asyncio.run(WebhookHandler.process_webhook(webhook()))
+
+    assert session.statements == []
+
+
+def test_incoming_delivery_applies_statuses(monkeypatch, use_sessions):
+    session = FakeAsyncSession()
+    use_sessions(webhook_module, session)
+    replied = []
+
+    async def auto_reply(payload):
+        replied.append(payload)
+
+    monkeypatch.setattr(message_consumer, "process_incoming_message", auto_reply)
+    body = orjson.dumps(webhook(status("wamid.1", "delivered", 100)))
+
+    assert asyncio.run(message_consumer.process_incoming_delivery(SimpleNamespace(body=body))) is True
+    assert len(replied) == 1
+    assert "'wamid.1', 'delivered'" in compile_pg(session.statements[0])
+
+
+def test_sent_message_records_its_wamid(monkeypatch, use_sessions):
+    session = FakeAsyncSession()
+    use_sessions(webhook_module, session)
+
+    async def post_message(phone_number_id, access_token, payload):
+        return httpx.Response(200, json={"messages": [{"id": "wamid.9"}]})
+
+    monkeypatch.setattr(message_consumer, "DEFAULT_PHONE_NUMBER_ID", "555")
+    monkeypatch.setattr(message_consumer, "DEFAULT_ACCESS_TOKEN", "token")
+    monkeypatch.setattr(message_consumer.whatsapp_service, "post_message", post_message)
+
+    sent = asyncio.run(message_consumer.process_outgoing_message(
+        {"message_id": "m1", "to_number": "+1", "content": "hi"}
+    ))
+    # Scheduled sends carry a scheduled_messages id - no messages row to link
+    scheduled = asyncio.run(message_consumer.process_outgoing_message(
+        {"message_id": "s1", "to_number": "+1", "content": "hi", "is_scheduled": True}
+    ))
+
+    assert sent is scheduled is True
+    assert len(session.statements) == 1 and session.commits == 1
+    sql = compile_pg(session.statements[0])
+    assert sql.startswith("UPDATE messages SET wamid='wamid.9'") and "messages.id = 'm1'" in sql
@@ -0,0 +1,89 @@
+import asyncio
+
+import httpx
+import orjson
+
+from core.config import settings
+from services import whatsapp_service as whatsapp_module
+from services.whatsapp_service import WhatsAppService
+
+
+def make_service(handler):
+    service = WhatsAppService()
+    service._client = httpx.AsyncClient(base_url="https://graph.test", transport=httpx.MockTransport(handler))
+    return service
+
+
+def record_sleeps(monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(whatsapp_module.asyncio, "sleep", fake_sleep)
+    return delays
+
+
+def test_post_message_retries_429_then_succeeds(monkeypatch):
+    delays = record_sleeps(monkeypatch)
+    statuses = iter([429, 503, 200])
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(next(statuses), headers={"Retry-After": "2"}, json={"messages": [{"id": "wamid.1"}]})
+
+    service = make_service(handler)
+    payload = {"messaging_product": "whatsapp", "to": "123", "text": {"body": "hi"}}
+    response = asyncio.run(service.post_message("555", "token", payload))
+
+    assert response.status_code == 200
+    assert len(requests) == 3
+    # Retry-After wins over the exponential step; jitter stays under a second
+    assert len(delays) == 2 and all(2 <= delay < 3 for delay in delays)
+    # Body serialized once by orjson and reused on every attempt
+    assert {request.content for request in requests} == {orjson.dumps(payload)}
+    assert requests[0].headers["Content-Type"] == "application/json"
+    assert requests[0].headers["Authorization"] == "Bearer token"
+
+
+def test_post_message_gives_up_after_max_retries(monkeypatch):
+    delays = record_sleeps(monkeypatch)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(429)
+
+    response = asyncio.run(make_service(handler).post_message("555", "token", {}))
+
+    assert response.status_code == 429
+    assert len(calls) == settings.WHATSAPP_MAX_RETRIES + 1
+    assert len(delays) == settings.WHATSAPP_MAX_RETRIES
+
+
+def test_post_message_does_not_retry_client_errors(monkeypatch):
+    delays = record_sleeps(monkeypatch)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(400)
+
+    response = asyncio.run(make_service(handler).post_message("555", "token", {}))
+
+    assert response.status_code == 400
+    assert len(calls) == 1 and delays == []
+
+
+def test_retry_delay_backoff_and_cap():
+    no_header = httpx.Response(503)
+    for attempt in range(3):
+        assert 2 ** attempt <= WhatsAppService.retry_delay(no_header, attempt) < 2 ** attempt + 1
+
+    huge = httpx.Response(429, headers={"Retry-After": "3600"})
+    assert WhatsAppService.retry_delay(huge, 0) == settings.WHATSAPP_RETRY_MAX_DELAY
+
+    # HTTP-date form isn't parsed - falls back to the exponential step
+    dated = httpx.Response(429, headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+    assert 2 <= WhatsAppService.retry_delay(dated, 1) < 3